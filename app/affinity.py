@@ -0,0 +1,100 @@
+from datetime import datetime
+from collections import Counter
+from sqlalchemy import select
+from app.db_models_shared import UserAffinity, PurchasedCoupon, SharedBase
+from app.bulk import upsert_rows, insert_ignoring_conflicts
+
+#affinity column -> key of a coupon leg
+AFFINITY_COLUMNS = {
+    "sport": "sport_counts",
+    "league": "league_counts",
+    "country": "country_counts",
+    "home_team": "home_team_counts",
+    "away_team": "away_team_counts",
+}
+
+def new_user_affinity(user_id):
+    affinity = UserAffinity(user_id=user_id, coupons_count=0, last_updated=datetime.utcnow())
+    for column in AFFINITY_COLUMNS.values():
+        setattr(affinity, column, {})
+    return affinity
+
+def apply_coupon(affinity, recommended_events):
+    #JSON columns are not mutation-tracked, so every column is rebuilt and reassigned
+    counts = {column: dict(getattr(affinity, column) or {}) for column in AFFINITY_COLUMNS.values()}
+
+    for event in recommended_events:
+        for field, column in AFFINITY_COLUMNS.items():
+            #missing values are counted under "" so they still take a top-2 slot, like the coupon rescan did
+            value = event.get(field) or ""
+            counts[column][value] = counts[column].get(value, 0) + 1
+
+    for column, value in counts.items():
+        setattr(affinity, column, value)
+    affinity.coupons_count = (affinity.coupons_count or 0) + 1
+    affinity.last_updated = datetime.utcnow()
+
+def affinity_row(affinity):
+    #the columns apply_coupon maintains, anything else keeps its stored value or its default
+    row = {column: getattr(affinity, column) for column in AFFINITY_COLUMNS.values()}
+    row.update(user_id=affinity.user_id, coupons_count=affinity.coupons_count, last_updated=affinity.last_updated)
+    return row
+
+def lock_user_affinities(session, user_ids):
+    #rows of first-time buyers are created empty first, then every row of the batch is locked in id order,
+    #so a concurrent purchase of the same user waits for this commit instead of overwriting its counts
+    table = UserAffinity.__table__
+    user_ids = sorted(user_ids)
+    insert_ignoring_conflicts(session, table, [affinity_row(new_user_affinity(user_id)) for user_id in user_ids],
+                              returning="user_id")
+    locked = select(table).where(table.c.user_id.in_(user_ids)).order_by(table.c.user_id).with_for_update()
+    #objects the session does not track, they are written back with one statement
+    return {row["user_id"]: UserAffinity(**row) for row in session.execute(locked).mappings()}
+
+def update_user_affinities(session, coupon_data_list):
+    affinities = lock_user_affinities(session, {coupon_data["user_id"] for coupon_data in coupon_data_list})
+
+    for coupon_data in coupon_data_list:
+        apply_coupon(affinities[coupon_data["user_id"]], coupon_data["recommended_events"])
+
+    #the locked rows go back as one INSERT ... ON CONFLICT DO UPDATE
+    upsert_rows(session, UserAffinity.__table__, [affinity_row(affinity) for affinity in affinities.values()],
+                ["user_id"])
+    return affinities
+
+def get_user_affinity(session, user_id):
+    return session.get(UserAffinity, user_id)
+
+def top_affinity_values(affinity, n=2):
+    top_values = {field: [] for field in AFFINITY_COLUMNS}
+    if affinity is None:
+        return top_values
+
+    for field, column in AFFINITY_COLUMNS.items():
+        for value, count in Counter(getattr(affinity, column) or {}).most_common(n):
+            if value:
+                top_values[field].append(value)
+    return top_values
+
+def rebuild_user_affinities(session, user_ids=None, batch_size=1000):
+    """Recomputes affinities from the full coupon history; not used on the request path."""
+    SharedBase.metadata.create_all(bind=session.get_bind(), tables=[UserAffinity.__table__])
+
+    query = session.query(PurchasedCoupon.user_id, PurchasedCoupon.recommended_events)
+    delete = session.query(UserAffinity)
+    if user_ids is not None:
+        query = query.filter(PurchasedCoupon.user_id.in_(user_ids))
+        delete = delete.filter(UserAffinity.user_id.in_(user_ids))
+    delete.delete(synchronize_session=False)
+
+    affinities = {}
+    for user_id, recommended_events in query.yield_per(batch_size):
+        affinity = affinities.get(user_id)
+        if affinity is None:
+            affinity = new_user_affinity(user_id)
+            affinities[user_id] = affinity
+        apply_coupon(affinity, recommended_events or [])
+
+    session.add_all(affinities.values())
+    session.commit()
+    return len(affinities)
@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta
+from sqlalchemy import insert, select, delete
+from app.config import Config
+from app.db_models_shared import Event, ArchivedEvent, SharedBase, event_teams
+
+ARCHIVED_COLUMNS = [column.name for column in Event.__table__.columns]
+
+def archive_finished_events(session, now=None, batch_size=None):
+    """Moves events that finished more than EVENT_ARCHIVE_GRACE_HOURS ago to events_archive."""
+    batch_size = batch_size or Config.EVENT_ARCHIVE_BATCH_SIZE
+    cutoff = (now or datetime.utcnow()) - timedelta(hours=Config.EVENT_ARCHIVE_GRACE_HOURS)
+    SharedBase.metadata.create_all(bind=session.get_bind(), tables=[ArchivedEvent.__table__])
+
+    archived = 0
+    while True:
+        #an event begins before it ends, so the begin_timestamp bound lets the index narrow the scan
+        ids = [row[0] for row in session.query(Event.id)
+               .filter(Event.begin_timestamp < cutoff, Event.end_timestamp < cutoff)
+               .limit(batch_size).all()]
+        if not ids:
+            break
+
+        source = select(*[Event.__table__.c[name] for name in ARCHIVED_COLUMNS]).where(Event.id.in_(ids))
+        session.execute(insert(ArchivedEvent.__table__).from_select(ARCHIVED_COLUMNS, source))
+        session.execute(delete(event_teams).where(event_teams.c.event_id.in_(ids)))
+        session.execute(delete(Event.__table__).where(Event.id.in_(ids)))
+        session.commit()
+        archived += len(ids)
+
+    return archived
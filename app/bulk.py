@@ -0,0 +1,83 @@
+import csv
+import io
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql, sqlite
+from app.config import Config
+from app.migrations import tenant_schema
+
+#dialect inserts that can render ON CONFLICT DO NOTHING ... RETURNING
+CONFLICT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+#written for None values, COPY reads it back as NULL
+COPY_NULL = "\\N"
+
+def chunked(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+def uniform_rows(rows):
+    #a multi-row VALUES needs the same keys in every row, absent optional fields become NULL
+    keys = list(dict.fromkeys(key for row in rows for key in row))
+    return keys, [{key: row.get(key) for key in keys} for row in rows]
+
+def insert_ignoring_conflicts(session, table, rows, returning="id"):
+    #returns the `returning` values of the inserted rows, rows that hit a unique or primary key are skipped
+    if not rows:
+        return []
+
+    bind = session.get_bind()
+    keys, rows = uniform_rows(rows)
+    if bind.dialect.name == "postgresql" and len(rows) >= Config.BULK_COPY_THRESHOLD:
+        return copy_ignoring_conflicts(session, table, keys, rows, returning)
+
+    insert = CONFLICT_INSERTS[bind.dialect.name]
+    inserted = []
+    for chunk in chunked(rows, Config.BULK_INSERT_CHUNK_SIZE):
+        statement = insert(table).values(chunk).on_conflict_do_nothing().returning(table.c[returning])
+        inserted.extend(session.execute(statement).scalars())
+    return inserted
+
+def upsert_rows(session, table, rows, index_elements):
+    #INSERT ... ON CONFLICT DO UPDATE, a row that hits index_elements overwrites the other columns it carries
+    if not rows:
+        return
+
+    insert = CONFLICT_INSERTS[session.get_bind().dialect.name]
+    keys, rows = uniform_rows(rows)
+    for chunk in chunked(rows, Config.BULK_INSERT_CHUNK_SIZE):
+        statement = insert(table).values(chunk)
+        statement = statement.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={key: statement.excluded[key] for key in keys if key not in index_elements})
+        session.execute(statement)
+
+def staging_table(session, table):
+    schema = tenant_schema(session.get_bind())
+    target = f'"{schema}".{table.name}' if schema else table.name
+    staging = f"staging_{table.name}"
+
+    #lives as long as the pooled connection and is emptied at every commit, LIKE leaves out the unique indexes
+    session.execute(text(f"CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {target} INCLUDING DEFAULTS) "
+                         f"ON COMMIT DELETE ROWS"))
+    session.execute(text(f"TRUNCATE {staging}"))
+    return target, staging
+
+def copy_ignoring_conflicts(session, table, keys, rows, returning="id"):
+    #COPY has no ON CONFLICT, so the rows are copied into a staging table and moved with one INSERT ... SELECT
+    target, staging = staging_table(session, table)
+    columns = ", ".join(f'"{key}"' for key in keys)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([COPY_NULL if row[key] is None else row[key] for key in keys])
+    buffer.seek(0)
+
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')", buffer)
+    finally:
+        cursor.close()
+
+    result = session.execute(text(f"INSERT INTO {target} ({columns}) SELECT {columns} FROM {staging} "
+                                  f'ON CONFLICT DO NOTHING RETURNING "{returning}"'))
+    return list(result.scalars())
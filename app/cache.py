@@ -0,0 +1,101 @@
+import json
+import time
+import threading
+from collections import OrderedDict
+from app.config import Config
+
+class RecommendationCache:
+    """Recommender output cached per (casino_id, user_id) with a TTL and an LRU bound per casino."""
+
+    def __init__(self, ttl_seconds, max_entries, overrides=None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.overrides = {int(casino_id): value for casino_id, value in (overrides or {}).items()}
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def settings(self, casino_id):
+        override = self.overrides.get(casino_id, {})
+        return (override.get("ttl_seconds", self.ttl_seconds),
+                override.get("max_entries", self.max_entries))
+
+    def get(self, casino_id, user_id, recommender_type, version=None):
+        with self.lock:
+            casino_entries = self.entries.get(casino_id)
+            entry = casino_entries.get(user_id) if casino_entries else None
+
+            if entry is None or entry[0] != recommender_type:
+                self.misses += 1
+                return None
+
+            if entry[1] <= time.time():
+                del casino_entries[user_id]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            #the version moves with every stored purchase, also ones ingested by another process
+            if entry[3] != version:
+                del casino_entries[user_id]
+                self.invalidations += 1
+                self.misses += 1
+                return None
+
+            casino_entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, casino_id, user_id, recommender_type, value, version=None):
+        ttl_seconds, max_entries = self.settings(casino_id)
+        if ttl_seconds <= 0 or max_entries <= 0:
+            return
+
+        with self.lock:
+            casino_entries = self.entries.setdefault(casino_id, OrderedDict())
+            casino_entries[user_id] = (recommender_type, time.time() + ttl_seconds, value, version)
+            casino_entries.move_to_end(user_id)
+
+            while len(casino_entries) > max_entries:
+                casino_entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, casino_id, user_ids=None):
+        with self.lock:
+            casino_entries = self.entries.get(casino_id)
+            if not casino_entries:
+                return
+
+            if user_ids is None:
+                self.invalidations += len(casino_entries)
+                del self.entries[casino_id]
+                return
+
+            for user_id in set(user_ids):
+                if casino_entries.pop(user_id, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "entries": {casino_id: len(casino_entries) for casino_id, casino_entries in self.entries.items()},
+            }
+
+recommendation_cache = RecommendationCache(Config.RECOMMENDATION_CACHE_TTL_SECONDS,
+                                           Config.RECOMMENDATION_CACHE_MAX_ENTRIES,
+                                           json.loads(Config.RECOMMENDATION_CACHE_OVERRIDES))
@@ -0,0 +1,320 @@
+import sys
+import time
+import random
+import itertools
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+import numpy as np
+from app.config import Config
+from app.db_models_shared import Event
+from app.scoring import EventScoringEngine, EVENT_FIELDS, top_k_indices
+from app.utils import KeyedLocks
+
+CatalogRow = namedtuple("CatalogRow", ["id", "country", "league", "sport", "odd", "home_team", "away_team",
+                                       "begin_timestamp", "end_timestamp"], defaults=(None, None))
+
+CATALOG_COLUMNS = (Event.id, Event.country, Event.league, Event.sport, Event.odd, Event.home_team, Event.away_team,
+                   Event.begin_timestamp, Event.end_timestamp)
+
+EPOCH = datetime(1970, 1, 1)
+#retired positions only cost memory, the catalog is compacted once they outnumber the live ones
+COMPACT_MIN_RETIRED = 1000
+
+event_catalogs = {}
+#held while a casino's catalog is loaded or compacted, other casinos are never blocked by it
+catalog_locks = KeyedLocks()
+#every catalog object gets its own number, caches derived from a catalog key on it instead of id()
+catalog_generations = itertools.count(1)
+
+def epoch_seconds(value, missing):
+    return missing if value is None else (value - EPOCH).total_seconds()
+
+def catalog_row(event):
+    return CatalogRow(event.id, event.country, event.league, event.sport, event.odd,
+                      event.home_team, event.away_team, event.begin_timestamp, event.end_timestamp)
+
+def active_window(now=None):
+    now = now or datetime.utcnow()
+    return (now - timedelta(hours=Config.EVENT_MAX_DURATION_HOURS), now + timedelta(days=Config.EVENT_WINDOW_DAYS))
+
+def active_event_filter(now=None):
+    #the begin_timestamp range is what the index serves, end_timestamp only drops the few finished rows in it
+    now = now or datetime.utcnow()
+    earliest, latest = active_window(now)
+    return (Event.begin_timestamp >= earliest, Event.begin_timestamp <= latest, Event.end_timestamp > now)
+
+def is_active(row, now=None):
+    now = now or datetime.utcnow()
+    earliest, latest = active_window(now)
+    if row.begin_timestamp is not None and not earliest <= row.begin_timestamp <= latest:
+        return False
+    return row.end_timestamp is None or row.end_timestamp > now
+
+class EventCatalog(EventScoringEngine):
+    """In-process columnar copy of one casino's events table."""
+
+    def __init__(self, casino_id, rows=()):
+        self.casino_id = casino_id
+        self.generation = next(catalog_generations)
+        #finished, removed and replaced events stay in the columns as retired positions
+        self._live = np.empty(0, dtype=bool)
+        self._begins = np.empty(0, dtype=np.float64)
+        self._ends = np.empty(0, dtype=np.float64)
+        self.retired = 0
+        self.id_positions = {}
+        self.pair_index = {}
+        self.fill_pool = []
+        self.lock = threading.Lock()
+        self.synced_at = time.time()
+        self.last_refresh_lag = 0.0
+        self.refreshes = 0
+        self.expires_at = float("inf")
+        super().__init__(rows)
+
+    def _reserve(self, capacity):
+        super()._reserve(capacity)
+        if len(self._live) < len(self._ids):
+            for name in ("_live", "_begins", "_ends"):
+                array = getattr(self, name)
+                grown = np.empty(len(self._ids), dtype=array.dtype)
+                grown[:self.size] = array[:self.size]
+                setattr(self, name, grown)
+
+    def append(self, rows):
+        new_rows = []
+        for row in rows:
+            if row.id not in self.id_positions:
+                self.id_positions[row.id] = self.size + len(new_rows)
+                new_rows.append(row)
+                if row.end_timestamp is not None:
+                    self.expires_at = min(self.expires_at, epoch_seconds(row.end_timestamp, None))
+
+        start = self.size
+        added = super().append(new_rows)
+        for position, row in enumerate(new_rows, start):
+            self._begins[position] = epoch_seconds(row.begin_timestamp, -np.inf)
+            self._ends[position] = epoch_seconds(row.end_timestamp, np.inf)
+        self._live[start:self.size] = True
+        self._index(start, self.size)
+        return added
+
+    def retire(self, positions):
+        #tombstones instead of a reload: the positions leave the indexes, their columns stay until compaction
+        positions = [position for position in positions if self._live[position]]
+        if not positions:
+            return 0
+
+        self._live[positions] = False
+        for position in positions:
+            self.id_positions.pop(int(self._ids[position]), None)
+        retired = set(positions)
+        #fresh lists are swapped in, readers iterating the old ones are not disturbed
+        self.pair_index = {key: kept for key, kept in
+                           ((key, [p for p in listed if p not in retired]) for key, listed in self.pair_index.items())
+                           if kept}
+        self.fill_pool = [position for position in self.fill_pool if position not in retired]
+
+        live_ends = self._ends[:self.size][self._live[:self.size]]
+        self.expires_at = float(live_ends.min()) if len(live_ends) else float("inf")
+        self.retired += len(positions)
+        return len(positions)
+
+    def retire_finished(self, now=None):
+        now = epoch_seconds(now or datetime.utcnow(), None)
+        with self.lock:
+            size = self.size
+            finished = np.flatnonzero(self._live[:size] & (self._ends[:size] <= now))
+            return self.retire(finished.tolist())
+
+    def live_mask(self):
+        return self._live[:self.size]
+
+    def live_count(self):
+        return self.size - self.retired
+
+    def needs_compaction(self):
+        return self.retired >= max(COMPACT_MIN_RETIRED, self.live_count())
+
+    def top_positions(self, scores, k):
+        #top_k_indices over the live positions only, ties keep their position order; rows appended
+        #after the scores were computed are not scored, so the mask stops at the scores' size
+        live = np.flatnonzero(self._live[:len(scores)])
+        return live[top_k_indices(scores[live], k)]
+
+    def top_events(self, user, top_values, event_limit):
+        scores = self.score(user, top_values)
+        return [self.event_data(position) for position in self.top_positions(scores, event_limit)]
+
+    def _index(self, start, stop):
+        sports = self._codes["sport"]
+        leagues = self._codes["league"]
+
+        for position in range(start, stop):
+            key = (int(sports[position]), int(leagues[position]))
+            self.pair_index.setdefault(key, []).append(position)
+
+            #inside-out Fisher-Yates keeps the pool a uniform shuffle as it grows
+            self.fill_pool.append(position)
+            swap = random.randint(0, len(self.fill_pool) - 1)
+            self.fill_pool[-1], self.fill_pool[swap] = self.fill_pool[swap], self.fill_pool[-1]
+
+    def pair_positions(self, sport, league, limit=None):
+        key = (self.code_of("sport", sport), self.code_of("league", league))
+        positions = self.pair_index.get(key, [])
+        return positions[:limit] if limit is not None else list(positions)
+
+    def fixture_positions(self, sport, league, home_team, away_team):
+        home_code = self.code_of("home_team", home_team)
+        away_code = self.code_of("away_team", away_team)
+        home_teams = self._codes["home_team"]
+        away_teams = self._codes["away_team"]
+        return [position for position in self.pair_positions(sport, league)
+                if home_teams[position] == home_code and away_teams[position] == away_code]
+
+    def random_positions(self, limit, exclude=()):
+        pool = self.fill_pool
+        if limit <= 0 or not pool:
+            return []
+
+        exclude = set(exclude)
+        offset = random.randrange(len(pool))
+        result = []
+        for step in range(len(pool)):
+            position = pool[(offset + step) % len(pool)]
+            if position not in exclude:
+                result.append(position)
+                if len(result) == limit:
+                    break
+        return result
+
+    def patch(self, rows, written_at=None):
+        now = datetime.utcnow()
+        with self.lock:
+            added = self.append(row for row in rows if is_active(row, now))
+            self.refreshes += 1
+            if written_at is not None:
+                self.last_refresh_lag = time.time() - written_at
+        return added
+
+    def sync(self, session):
+        #scans id, odd and timestamps of the active events: unseen and changed ids are fetched in full,
+        #changed and vanished (finished, archived, deleted) ones are retired
+        started = time.time()
+        with self.lock:
+            known_ids = self.id_positions
+            active_ids = set()
+            fetch_ids = set()
+            for event_id, odd, begin_timestamp, end_timestamp in session.query(
+                    Event.id, Event.odd, Event.begin_timestamp, Event.end_timestamp).filter(*active_event_filter()).all():
+                active_ids.add(event_id)
+                position = known_ids.get(event_id)
+                if position is None or self._odds[position] != odd \
+                        or self._begins[position] != epoch_seconds(begin_timestamp, -np.inf) \
+                        or self._ends[position] != epoch_seconds(end_timestamp, np.inf):
+                    fetch_ids.add(event_id)
+
+            self.retire([position for event_id, position in known_ids.items()
+                         if event_id not in active_ids or event_id in fetch_ids])
+            fetch_ids = sorted(fetch_ids)
+            rows = []
+            for start in range(0, len(fetch_ids), 1000):
+                chunk = fetch_ids[start:start + 1000]
+                rows.extend(session.query(*CATALOG_COLUMNS).filter(Event.id.in_(chunk)).all())
+            self.append(rows)
+            self.last_refresh_lag = started - self.synced_at if fetch_ids else 0.0
+            self.synced_at = started
+            self.refreshes += 1
+
+    def is_stale(self):
+        return time.time() - self.synced_at >= Config.EVENT_CATALOG_SYNC_SECONDS
+
+    def has_finished_events(self):
+        return self.expires_at <= time.time()
+
+    def filter_positions(self, limit=None, exclude=(), **criteria):
+        size = self.size
+        mask = self._live[:size].copy()
+        for column, value in criteria.items():
+            mask &= self._codes[column][:size] == self.code_of(column, value)
+        if exclude:
+            mask[list(exclude)] = False
+
+        positions = np.flatnonzero(mask)
+        if limit is not None:
+            positions = positions[:limit]
+        return positions.tolist()
+
+    def sport_league_pairs(self):
+        result = []
+        for sport_code, league_code in list(self.pair_index):
+            result.append((self.vocabularies["sport"][sport_code], self.vocabularies["league"][league_code]))
+        return result
+
+    def nbytes(self):
+        total = self._ids.nbytes + self._odds.nbytes
+        for column in EVENT_FIELDS:
+            total += self._codes[column].nbytes
+            total += sum(len(value) for value in self.vocabularies[column] if isinstance(value, str))
+        total += sys.getsizeof(self.fill_pool)
+        total += sum(sys.getsizeof(positions) for positions in self.pair_index.values())
+        return total
+
+    def stats(self):
+        return {
+            "casino_id": self.casino_id,
+            "events": self.live_count(),
+            "retired_positions": self.retired,
+            "nbytes": self.nbytes(),
+            "vocabulary_sizes": {column: len(self.vocabularies[column]) for column in EVENT_FIELDS},
+            "sport_league_pairs": len(self.pair_index),
+            "refreshes": self.refreshes,
+            "seconds_until_expiry": round(self.expires_at - time.time(), 3) if self.expires_at != float("inf") else None,
+            "seconds_since_sync": round(time.time() - self.synced_at, 3),
+            "last_refresh_lag_seconds": round(self.last_refresh_lag, 3),
+        }
+
+def load_event_catalog(casino_id, session):
+    return EventCatalog(casino_id, session.query(*CATALOG_COLUMNS).filter(*active_event_filter()).all())
+
+def get_event_catalog(casino_id, session):
+    catalog = event_catalogs.get(casino_id)
+
+    if catalog is None:
+        with catalog_locks(casino_id):
+            catalog = event_catalogs.get(casino_id)
+            if catalog is None:
+                catalog = load_event_catalog(casino_id, session)
+                event_catalogs[casino_id] = catalog
+                print(f"Loaded event catalog for casino {casino_id} with {len(catalog)} events.")
+        return catalog
+
+    if catalog.has_finished_events():
+        catalog.retire_finished()
+    if catalog.is_stale():
+        catalog.sync(session)
+
+    if catalog.needs_compaction():
+        #columns are append-only, the retired positions are dropped by loading a fresh catalog;
+        #requests of the casino keep the current one while another request does it
+        lock = catalog_locks(casino_id)
+        if lock.acquire(blocking=False):
+            try:
+                if event_catalogs.get(casino_id) is catalog:
+                    event_catalogs[casino_id] = load_event_catalog(casino_id, session)
+            finally:
+                lock.release()
+
+    return catalog
+
+def refresh_event_catalog(casino_id, rows, written_at=None):
+    catalog = event_catalogs.get(casino_id)
+    if catalog is None:
+        return 0
+    return catalog.patch(rows, written_at=written_at)
+
+def get_catalog_stats(casino_id=None):
+    if casino_id is not None:
+        catalog = event_catalogs.get(casino_id)
+        return catalog.stats() if catalog else None
+    return [catalog.stats() for catalog in event_catalogs.values()]
@@ -0,0 +1,216 @@
+import os
+import json
+import shutil
+import threading
+from datetime import datetime
+import numpy as np
+from scipy.sparse import csr_matrix
+from app.config import Config
+from app.db_models_shared import PurchasedCoupon
+
+#event column -> item token prefix, home and away teams share one item per team
+ITEM_COLUMNS = {
+    "sport": "SPORT",
+    "league": "LEAGUE",
+    "home_team": "TEAM",
+    "away_team": "TEAM",
+}
+
+collaborative_models = {}
+models_lock = threading.Lock()
+
+def item_token(column, value):
+    return f"{ITEM_COLUMNS[column]}:{value}"
+
+def model_dir(casino_id):
+    return os.path.join(Config.COLLABORATIVE_MODEL_DIR, f"casino_{casino_id}")
+
+def vocabulary_items(vocabulary, column, item_index):
+    #catalog vocabulary code -> item index, values without an item map to len(item_index)
+    missing = len(item_index)
+    return np.fromiter((item_index.get(item_token(column, value), missing) for value in vocabulary),
+                       dtype=np.int64, count=len(vocabulary))
+
+def build_interactions(rows):
+    user_index, item_index = {}, {}
+    counts = {}
+
+    for user_id, recommended_events in rows:
+        u = user_index.setdefault(user_id, len(user_index))
+        for event in recommended_events or []:
+            for column in ITEM_COLUMNS:
+                value = event.get(column)
+                if not value:
+                    continue
+                i = item_index.setdefault(item_token(column, value), len(item_index))
+                counts[(u, i)] = counts.get((u, i), 0) + 1
+
+    rows_idx = np.fromiter((key[0] for key in counts), dtype=np.int32, count=len(counts))
+    cols_idx = np.fromiter((key[1] for key in counts), dtype=np.int32, count=len(counts))
+    data = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    interactions = csr_matrix((data, (rows_idx, cols_idx)), shape=(len(user_index), len(item_index)))
+
+    return interactions, list(user_index), list(item_index)
+
+def als_step(confidence, fixed, regularization, alpha):
+    #implicit-feedback ALS: solves (YtY + Yt(Cu - I)Y + lambda*I) x_u = Yt Cu p_u for every row
+    factors = fixed.shape[1]
+    gram = fixed.T @ fixed
+    regularizer = regularization * np.eye(factors)
+    solved = np.zeros((confidence.shape[0], factors), dtype=np.float64)
+
+    for row in range(confidence.shape[0]):
+        start, end = confidence.indptr[row], confidence.indptr[row + 1]
+        if start == end:
+            continue
+        indices = confidence.indices[start:end]
+        weights = alpha * confidence.data[start:end]
+        observed = fixed[indices]
+
+        a = gram + (observed.T * weights) @ observed + regularizer
+        b = observed.T @ (1.0 + weights)
+        solved[row] = np.linalg.solve(a, b)
+
+    return solved
+
+def train_als(interactions, factors=None, iterations=None, regularization=None, alpha=None, seed=0):
+    factors = factors or Config.COLLABORATIVE_FACTORS
+    iterations = iterations or Config.COLLABORATIVE_ITERATIONS
+    regularization = Config.COLLABORATIVE_REGULARIZATION if regularization is None else regularization
+    alpha = Config.COLLABORATIVE_ALPHA if alpha is None else alpha
+
+    rng = np.random.default_rng(seed)
+    user_factors = rng.normal(scale=0.01, size=(interactions.shape[0], factors))
+    item_factors = rng.normal(scale=0.01, size=(interactions.shape[1], factors))
+    by_user = interactions.tocsr()
+    by_item = interactions.T.tocsr()
+
+    for _ in range(iterations):
+        user_factors = als_step(by_user, item_factors, regularization, alpha)
+        item_factors = als_step(by_item, user_factors, regularization, alpha)
+
+    return user_factors.astype(np.float32), item_factors.astype(np.float32)
+
+def write_json(path, data):
+    temporary = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+    with open(temporary, "w") as file:
+        json.dump(data, file)
+    os.replace(temporary, path)
+
+def save_model(casino_id, user_ids, items, user_factors, item_factors):
+    #every training writes its own version directory, readers never see files of two trainings mixed
+    directory = model_dir(casino_id)
+    trained_at = datetime.utcnow()
+    version = f"{trained_at:%Y%m%dT%H%M%S%f}-{os.getpid()}"
+    version_dir = os.path.join(directory, version)
+    os.makedirs(version_dir)
+
+    user_ids = np.asarray(user_ids, dtype=np.int64)
+    order = np.argsort(user_ids, kind="stable")
+    np.save(os.path.join(version_dir, "user_ids.npy"), user_ids[order])
+    np.save(os.path.join(version_dir, "user_factors.npy"), user_factors[order])
+    np.save(os.path.join(version_dir, "item_factors.npy"), item_factors)
+    write_json(os.path.join(version_dir, "items.json"), items)
+
+    #the single atomic switch: loaders only follow model.json to a complete version
+    previous = current_version(directory)
+    write_json(os.path.join(directory, "model.json"), {"version": version, "trained_at": trained_at.isoformat()})
+    remove_old_versions(directory, keep={version, previous})
+    return version
+
+def current_version(directory):
+    try:
+        with open(os.path.join(directory, "model.json")) as file:
+            return json.load(file)["version"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+def remove_old_versions(directory, keep):
+    #the previous version stays for workers still switching over, mapped files outlive their unlink anyway
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name not in keep and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+def train_collaborative_model(casino_id, session, batch_size=1000):
+    rows = session.query(PurchasedCoupon.user_id, PurchasedCoupon.recommended_events).yield_per(batch_size)
+    interactions, user_ids, items = build_interactions(rows)
+    if not user_ids or not items:
+        return None
+
+    user_factors, item_factors = train_als(interactions)
+    save_model(casino_id, user_ids, items, user_factors, item_factors)
+    return {"users": len(user_ids), "items": len(items)}
+
+def pointer_stamp(pointer):
+    #os.replace gives model.json a new inode, so a switch is noticed even within one mtime tick
+    stat = os.stat(pointer)
+    return stat.st_ino, stat.st_mtime_ns
+
+class CollaborativeModel:
+    """Factor matrices of one casino, memory-mapped from disk."""
+
+    def __init__(self, directory):
+        pointer = os.path.join(directory, "model.json")
+        self.stamp = pointer_stamp(pointer)
+        with open(pointer) as file:
+            meta = json.load(file)
+        self.trained_at = meta["trained_at"]
+        #models saved before versioning keep their files and items next to model.json
+        self.version = meta.get("version")
+        version_dir = os.path.join(directory, self.version) if self.version else directory
+        if self.version:
+            with open(os.path.join(version_dir, "items.json")) as file:
+                items = json.load(file)
+        else:
+            items = meta["items"]
+        self.item_index = {token: index for index, token in enumerate(items)}
+        self.user_ids = np.load(os.path.join(version_dir, "user_ids.npy"), mmap_mode="r")
+        self.user_factors = np.load(os.path.join(version_dir, "user_factors.npy"), mmap_mode="r")
+        self.item_factors = np.load(os.path.join(version_dir, "item_factors.npy"), mmap_mode="r")
+        #column -> (catalog generation, item codes), one entry per column
+        self.code_maps = {}
+
+    def user_row(self, user_id):
+        row = int(np.searchsorted(self.user_ids, user_id))
+        if row < len(self.user_ids) and self.user_ids[row] == user_id:
+            return row
+        return None
+
+    def item_codes(self, catalog, column):
+        #catalog vocabulary code -> item index, unknown values point at the trailing zero score
+        vocabulary = catalog.vocabularies[column]
+        cached = self.code_maps.get(column)
+        if cached is not None and cached[0] == catalog.generation and len(cached[1]) == len(vocabulary):
+            return cached[1]
+
+        mapped = vocabulary_items(vocabulary, column, self.item_index)
+        self.code_maps[column] = (catalog.generation, mapped)
+        return mapped
+
+    def score_events(self, user_id, catalog):
+        row = self.user_row(user_id)
+        if row is None:
+            return None
+
+        item_scores = np.append(self.item_factors @ self.user_factors[row], np.float32(0.0))
+        size = len(catalog)
+        scores = np.zeros(size, dtype=np.float32)
+        for column in ITEM_COLUMNS:
+            scores += item_scores[self.item_codes(catalog, column)[catalog.codes(column)[:size]]]
+        return scores
+
+def load_collaborative_model(casino_id):
+    directory = model_dir(casino_id)
+    pointer = os.path.join(directory, "model.json")
+    if not os.path.exists(pointer):
+        return None
+
+    model = collaborative_models.get(casino_id)
+    if model is None or model.stamp != pointer_stamp(pointer):
+        with models_lock:
+            model = collaborative_models.get(casino_id)
+            if model is None or model.stamp != pointer_stamp(pointer):
+                model = CollaborativeModel(directory)
+                collaborative_models[casino_id] = model
+    return model
@@ -16,6 +16,94 @@ class Config:
         f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{MASTER_DATABASE_NAME}"
     )
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    
+    EVENT_CATALOG_SYNC_SECONDS = int(os.getenv("EVENT_CATALOG_SYNC_SECONDS", "60"))
+    #recommenders only see events that have not finished and begin within the next EVENT_WINDOW_DAYS
+    EVENT_WINDOW_DAYS = int(os.getenv("EVENT_WINDOW_DAYS", "14"))
+    EVENT_MAX_DURATION_HOURS = int(os.getenv("EVENT_MAX_DURATION_HOURS", "6"))
+    EVENT_ARCHIVE_GRACE_HOURS = int(os.getenv("EVENT_ARCHIVE_GRACE_HOURS", "24"))
+    EVENT_ARCHIVE_INTERVAL_SECONDS = int(os.getenv("EVENT_ARCHIVE_INTERVAL_SECONDS", "600"))
+    EVENT_ARCHIVE_BATCH_SIZE = int(os.getenv("EVENT_ARCHIVE_BATCH_SIZE", "1000"))
+    #"catalog" scores the in-process event catalog, "stream" scores events straight from a server-side cursor
+    INFERENCE_SCORE_MODE = os.getenv("INFERENCE_SCORE_MODE", "catalog")
+    INFERENCE_SCORE_STREAM_BATCH = int(os.getenv("INFERENCE_SCORE_STREAM_BATCH", "1000"))
+    RECOMMEND_BATCH_MAX_USERS = int(os.getenv("RECOMMEND_BATCH_MAX_USERS", "100000"))
+    RECOMMEND_BATCH_CHUNK_SIZE = int(os.getenv("RECOMMEND_BATCH_CHUNK_SIZE", "1000"))
+    
+    RECOMMENDATION_CACHE_TTL_SECONDS = int(os.getenv("RECOMMENDATION_CACHE_TTL_SECONDS", "300"))
+    RECOMMENDATION_CACHE_MAX_ENTRIES = int(os.getenv("RECOMMENDATION_CACHE_MAX_ENTRIES", "10000"))
+    #per casino overrides, e.g. {"566550": {"ttl_seconds": 60, "max_entries": 50000}}
+    RECOMMENDATION_CACHE_OVERRIDES = os.getenv("RECOMMENDATION_CACHE_OVERRIDES", "{}")
+    
+    #connection pool of every casino engine, per casino overrides e.g. {"566550": {"pool_size": 10, "max_overflow": 20}}
+    TENANT_POOL_SIZE = int(os.getenv("TENANT_POOL_SIZE", "5"))
+    TENANT_MAX_OVERFLOW = int(os.getenv("TENANT_MAX_OVERFLOW", "5"))
+    TENANT_POOL_OVERRIDES = os.getenv("TENANT_POOL_OVERRIDES", "{}")
+    #upper bound on pool_size + max_overflow summed over the open casino engines of one process
+    TENANT_CONNECTION_BUDGET = int(os.getenv("TENANT_CONNECTION_BUDGET", "80"))
+    #a new casino engine waits this long for busy engines to go idle, then the request is refused with a 503
+    TENANT_BUDGET_WAIT_SECONDS = float(os.getenv("TENANT_BUDGET_WAIT_SECONDS", "5"))
+    TENANT_IDLE_SECONDS = int(os.getenv("TENANT_IDLE_SECONDS", "300"))
+    #ids reserved per table and process with one sequence call, then handed out from memory
+    ID_BLOCK_SIZE = int(os.getenv("ID_BLOCK_SIZE", "100"))
+    #rows per multi-row INSERT, batches of at least BULK_COPY_THRESHOLD rows are loaded with COPY instead
+    BULK_INSERT_CHUNK_SIZE = int(os.getenv("BULK_INSERT_CHUNK_SIZE", "500"))
+    BULK_COPY_THRESHOLD = int(os.getenv("BULK_COPY_THRESHOLD", "2000"))
+    #new casino databases are copies of this one, it is created and migrated on first use
+    TENANT_TEMPLATE_DATABASE = os.getenv("TENANT_TEMPLATE_DATABASE", "casino_template")
+    PROVISION_WORKERS = int(os.getenv("PROVISION_WORKERS", "4"))
+    #"database" gives every casino its own database, "schema" a casino_<id> schema in TENANT_SCHEMA_DATABASE
+    TENANCY_MODE = os.getenv("TENANCY_MODE", "database")
+    TENANT_SCHEMA_DATABASE = os.getenv("TENANT_SCHEMA_DATABASE", MASTER_DATABASE_NAME)
+    #the one pool shared by every casino in schema mode
+    TENANT_SCHEMA_POOL_SIZE = int(os.getenv("TENANT_SCHEMA_POOL_SIZE", "20"))
+    TENANT_SCHEMA_MAX_OVERFLOW = int(os.getenv("TENANT_SCHEMA_MAX_OVERFLOW", "10"))
+    
+    #precomputed rows older than this are ignored by /recommend, 0 disables the lookup
+    PRECOMPUTED_MAX_AGE_SECONDS = int(os.getenv("PRECOMPUTED_MAX_AGE_SECONDS", "3600"))
+    #how often /recommend asks whether the casino has precomputed rows at all
+    PRECOMPUTE_RUN_CHECK_SECONDS = int(os.getenv("PRECOMPUTE_RUN_CHECK_SECONDS", "60"))
+    PRECOMPUTE_WORKERS = int(os.getenv("PRECOMPUTE_WORKERS", "4"))
+    PRECOMPUTE_CHUNK_SIZE = int(os.getenv("PRECOMPUTE_CHUNK_SIZE", "500"))
+    
+    COLLABORATIVE_MODEL_DIR = os.getenv("COLLABORATIVE_MODEL_DIR", "models")
+    COLLABORATIVE_FACTORS = int(os.getenv("COLLABORATIVE_FACTORS", "32"))
+    COLLABORATIVE_ITERATIONS = int(os.getenv("COLLABORATIVE_ITERATIONS", "10"))
+    COLLABORATIVE_REGULARIZATION = float(os.getenv("COLLABORATIVE_REGULARIZATION", "0.1"))
+    COLLABORATIVE_ALPHA = float(os.getenv("COLLABORATIVE_ALPHA", "40"))
+    
+    COOCCURRENCE_REBUILD_SECONDS = int(os.getenv("COOCCURRENCE_REBUILD_SECONDS", "900"))
+    #coupons older than this are left out of the rebuilt matrix
+    COOCCURRENCE_WINDOW_DAYS = int(os.getenv("COOCCURRENCE_WINDOW_DAYS", "90"))
+    COOCCURRENCE_RECENT_COUPONS = int(os.getenv("COOCCURRENCE_RECENT_COUPONS", "5"))
+    COOCCURRENCE_FOLD_THRESHOLD = int(os.getenv("COOCCURRENCE_FOLD_THRESHOLD", "10000"))
+    #how often a loaded matrix reads the coupon_events rows written since it was built
+    COOCCURRENCE_CATCHUP_SECONDS = int(os.getenv("COOCCURRENCE_CATCHUP_SECONDS", "10"))
+    
+    TRENDING_HALF_LIFE_HOURS = float(os.getenv("TRENDING_HALF_LIFE_HOURS", "24"))
+    TRENDING_TOP_N = int(os.getenv("TRENDING_TOP_N", "50"))
+    TRENDING_WINDOW_DAYS = int(os.getenv("TRENDING_WINDOW_DAYS", "14"))
+    TRENDING_REBUILD_SECONDS = int(os.getenv("TRENDING_REBUILD_SECONDS", "900"))
+    #how often loaded scores read the coupon_events rows written since they were built
+    TRENDING_CATCHUP_SECONDS = int(os.getenv("TRENDING_CATCHUP_SECONDS", "10"))
+    
+    #records are keyed by casino_id, so this bounds how many consumers of a topic share the casinos
+    KAFKA_NUM_PARTITIONS = int(os.getenv("KAFKA_NUM_PARTITIONS", "3"))
+    #a consumer batch is flushed at whichever of these limits is reached first
+    KAFKA_BATCH_MAX_MESSAGES = int(os.getenv("KAFKA_BATCH_MAX_MESSAGES", "500"))
+    KAFKA_BATCH_MIN_MESSAGES = int(os.getenv("KAFKA_BATCH_MIN_MESSAGES", "10"))
+    KAFKA_BATCH_MAX_BYTES = int(os.getenv("KAFKA_BATCH_MAX_BYTES", "1048576"))
+    KAFKA_BATCH_LINGER_MS = int(os.getenv("KAFKA_BATCH_LINGER_MS", "200"))
+    #the message limit grows while batches are written faster than this and shrinks when they are slower
+    KAFKA_BATCH_TARGET_WRITE_MS = int(os.getenv("KAFKA_BATCH_TARGET_WRITE_MS", "500"))
+    #casino groups are written by this many threads, one in flight per casino
+    KAFKA_WRITER_WORKERS = int(os.getenv("KAFKA_WRITER_WORKERS", "4"))
+    #reading pauses while more consumed messages than this wait to be written
+    KAFKA_MAX_IN_FLIGHT_MESSAGES = int(os.getenv("KAFKA_MAX_IN_FLIGHT_MESSAGES", "5000"))
+    #a casino group whose write still fails after these retries goes to <topic><KAFKA_DEAD_LETTER_SUFFIX>
+    KAFKA_WRITE_RETRIES = int(os.getenv("KAFKA_WRITE_RETRIES", "3"))
+    KAFKA_WRITE_BACKOFF_MS = int(os.getenv("KAFKA_WRITE_BACKOFF_MS", "500"))
+    KAFKA_DEAD_LETTER_SUFFIX = os.getenv("KAFKA_DEAD_LETTER_SUFFIX", "-dead-letter")
  
     FOOTBALL_LEAGUES = [
         "La Liga", "Premier League", "Bundesliga", "Serie A", "Ligue 1", 
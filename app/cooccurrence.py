@@ -0,0 +1,206 @@
+import time
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+from scipy.sparse import csr_matrix, coo_matrix
+from app.config import Config
+from app.db_models_shared import PurchasedCoupon
+from app.collaborative import item_token, vocabulary_items
+from app.coupon_events import latest_leg_id, written_up_to, follow_coupons
+from app.utils import KeyedLocks, get_casino_db_session
+
+#leagues and teams picked together on one coupon co-occur, home and away teams share one item per team
+COOCCURRENCE_COLUMNS = ("league", "home_team", "away_team")
+
+cooccurrence_matrices = {}
+#held while a casino's matrix is built, other casinos are never blocked by it
+rebuild_locks = KeyedLocks()
+
+def coupon_items(recommended_events):
+    items = []
+    for event in recommended_events or []:
+        for column in COOCCURRENCE_COLUMNS:
+            value = event.get(column)
+            if value:
+                items.append(item_token(column, value))
+    return items
+
+class CooccurrenceMatrix:
+    """Symmetric item x item co-occurrence counts of one casino in CSR form, with a small pending delta."""
+
+    def __init__(self, casino_id):
+        self.casino_id = casino_id
+        self.item_index = {}
+        self.matrix = csr_matrix((0, 0), dtype=np.float32)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.built_at = time.time()
+        #coupon_events id up to which coupons are counted, and when newer legs were last read
+        self.last_leg_id = 0
+        self.caught_up_at = self.built_at
+        #column -> (catalog generation, item count, item codes), one entry per column
+        self.code_maps = {}
+
+    def add_coupon(self, recommended_events):
+        tokens = coupon_items(recommended_events)
+        with self.lock:
+            indices = sorted({self.item_index.setdefault(token, len(self.item_index)) for token in tokens})
+            for i in indices:
+                for j in indices:
+                    if i != j:
+                        self.pending[(i, j)] = self.pending.get((i, j), 0) + 1
+            if len(self.pending) >= Config.COOCCURRENCE_FOLD_THRESHOLD:
+                self._fold()
+
+    def _fold(self):
+        #merges the pending delta into a new CSR matrix, growing it to the current item count
+        size = len(self.item_index)
+        matrix = self.matrix
+        if matrix.shape[0] < size:
+            indptr = np.pad(matrix.indptr, (0, size - matrix.shape[0]), mode="edge")
+            matrix = csr_matrix((matrix.data, matrix.indices, indptr), shape=(size, size))
+
+        if self.pending:
+            rows = np.fromiter((key[0] for key in self.pending), dtype=np.int32, count=len(self.pending))
+            cols = np.fromiter((key[1] for key in self.pending), dtype=np.int32, count=len(self.pending))
+            data = np.fromiter(self.pending.values(), dtype=np.float32, count=len(self.pending))
+            matrix = (matrix + coo_matrix((data, (rows, cols)), shape=(size, size)).tocsr()).tocsr()
+            matrix.indices = matrix.indices.astype(np.int32, copy=False)
+            self.pending = {}
+
+        self.matrix = matrix
+
+    def is_stale(self):
+        return time.time() - self.built_at >= Config.COOCCURRENCE_REBUILD_SECONDS
+
+    def is_behind(self):
+        return time.time() - self.caught_up_at >= Config.COOCCURRENCE_CATCHUP_SECONDS
+
+    def item_scores(self, picks):
+        #scores every item by how often it was picked together with the given legs
+        with self.lock:
+            if self.pending or self.matrix.shape[0] < len(self.item_index):
+                self._fold()
+            matrix = self.matrix
+
+        query = np.zeros(matrix.shape[0], dtype=np.float32)
+        for token in coupon_items(picks):
+            index = self.item_index.get(token)
+            if index is not None and index < len(query):
+                query[index] += 1
+        return matrix @ query
+
+    def item_codes(self, catalog, column, size):
+        vocabulary = catalog.vocabularies[column]
+        cached = self.code_maps.get(column)
+        if cached is None or cached[0] != catalog.generation or cached[1] != size or len(cached[2]) != len(vocabulary):
+            mapped = vocabulary_items(vocabulary, column, self.item_index)
+            #items added after the scores were computed count as unknown
+            mapped[mapped >= size] = size
+            cached = (catalog.generation, size, mapped)
+            self.code_maps[column] = cached
+        return cached[2]
+
+    def score_events(self, picks, catalog):
+        item_scores = self.item_scores(picks)
+        if not item_scores.any():
+            return None
+
+        item_scores = np.append(item_scores, np.float32(0.0))
+        items = len(item_scores) - 1
+        size = len(catalog)
+        scores = np.zeros(size, dtype=np.float32)
+        for column in COOCCURRENCE_COLUMNS:
+            scores += item_scores[self.item_codes(catalog, column, items)[catalog.codes(column)[:size]]]
+        return scores
+
+    def nbytes(self):
+        return int(self.matrix.data.nbytes + self.matrix.indices.nbytes + self.matrix.indptr.nbytes)
+
+    def stats(self):
+        return {
+            "casino_id": self.casino_id,
+            "items": len(self.item_index),
+            "nonzero": int(self.matrix.nnz),
+            "pending": len(self.pending),
+            "nbytes": self.nbytes(),
+            "seconds_since_build": round(time.time() - self.built_at, 3),
+        }
+
+def build_cooccurrence_matrix(casino_id, session, batch_size=1000):
+    cooccurrence = CooccurrenceMatrix(casino_id)
+    #coupons written while the build runs are left to the catch-up, so none is counted twice
+    cooccurrence.last_leg_id = latest_leg_id(session)
+    #a bounded window, served by the timestamp index instead of a scan of the whole history
+    cutoff = datetime.utcnow() - timedelta(days=Config.COOCCURRENCE_WINDOW_DAYS)
+    query = session.query(PurchasedCoupon.recommended_events)\
+        .filter(PurchasedCoupon.timestamp >= cutoff, written_up_to(cooccurrence.last_leg_id))
+    for (recommended_events,) in query.yield_per(batch_size):
+        cooccurrence.add_coupon(recommended_events)
+    with cooccurrence.lock:
+        cooccurrence._fold()
+    return cooccurrence
+
+def rebuild_cooccurrence_matrix(casino_id):
+    #runs in a background thread with its own session, requests keep the previous matrix meanwhile
+    lock = rebuild_locks(casino_id)
+    if not lock.acquire(blocking=False):
+        return
+    try:
+        session = get_casino_db_session(casino_id)
+        try:
+            cooccurrence_matrices[casino_id] = build_cooccurrence_matrix(casino_id, session)
+        finally:
+            session.close()
+    except Exception as exc:
+        print(f"Co-occurrence rebuild error for casino {casino_id}: {exc}")
+    finally:
+        lock.release()
+
+def catch_up_cooccurrence_matrix(casino_id):
+    #adds the coupons other processes wrote since the matrix was built or last caught up
+    lock = rebuild_locks(casino_id)
+    if not lock.acquire(blocking=False):
+        return
+    try:
+        cooccurrence = cooccurrence_matrices.get(casino_id)
+        if cooccurrence is None:
+            return
+        session = get_casino_db_session(casino_id)
+        try:
+            cooccurrence.last_leg_id = follow_coupons(session, cooccurrence.last_leg_id,
+                                                      lambda legs, timestamp: cooccurrence.add_coupon(legs))
+        finally:
+            session.close()
+    except Exception as exc:
+        print(f"Co-occurrence catch-up error for casino {casino_id}: {exc}")
+    finally:
+        lock.release()
+
+def start_rebuild(casino_id, target=rebuild_cooccurrence_matrix):
+    if not rebuild_locks(casino_id).locked():
+        threading.Thread(target=target, args=(casino_id,), daemon=True).start()
+
+def get_cooccurrence_matrix(casino_id, session):
+    cooccurrence = cooccurrence_matrices.get(casino_id)
+
+    if cooccurrence is None:
+        #until the first build is done the casino gets an empty matrix and the recommender falls back
+        cooccurrence = CooccurrenceMatrix(casino_id)
+        start_rebuild(casino_id)
+    elif cooccurrence.is_stale():
+        start_rebuild(casino_id)
+    elif cooccurrence.is_behind():
+        #the Kafka consumer writes most coupons, the matrix follows their coupon_events rows
+        cooccurrence.caught_up_at = time.time()
+        start_rebuild(casino_id, target=catch_up_cooccurrence_matrix)
+
+    return cooccurrence
+
+def recent_picks(session, user_id, limit=None):
+    limit = limit or Config.COOCCURRENCE_RECENT_COUPONS
+    rows = session.query(PurchasedCoupon.recommended_events)\
+        .filter(PurchasedCoupon.user_id == user_id)\
+        .order_by(PurchasedCoupon.timestamp.desc())\
+        .limit(limit).all()
+    return [event for (recommended_events,) in rows for event in recommended_events or []]
@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+from collections import Counter
+from sqlalchemy import insert, func, exists
+from app.db_models_shared import CouponEvent, PurchasedCoupon
+
+#coupon leg keys stored as coupon_events columns
+COUPON_EVENT_COLUMNS = ("sport", "league", "country", "home_team", "away_team")
+
+def coupon_event_rows(coupon_id, user_id, timestamp, recommended_events):
+    rows = []
+    for event in recommended_events or []:
+        row = {"coupon_id": coupon_id, "user_id": user_id, "timestamp": timestamp}
+        for column in COUPON_EVENT_COLUMNS:
+            row[column] = event.get(column) or None
+        rows.append(row)
+    return rows
+
+def record_coupon_events(session, coupons):
+    rows = []
+    for coupon in coupons:
+        rows.extend(coupon_event_rows(coupon.id, coupon.user_id, coupon.timestamp, coupon.recommended_events))
+    if not rows:
+        return 0
+
+    #the coupons must exist before their legs reference them
+    session.flush()
+    session.execute(insert(CouponEvent), rows)
+    return len(rows)
+
+def user_legs_query(session, user_id, columns, days=None):
+    query = session.query(*columns, func.count().label("picks")).filter(CouponEvent.user_id == user_id)
+    if days is not None:
+        query = query.filter(CouponEvent.timestamp >= datetime.utcnow() - timedelta(days=days))
+    return query
+
+def user_sport_league_counts(session, user_id, days):
+    rows = user_legs_query(session, user_id, [CouponEvent.sport, CouponEvent.league], days)\
+        .filter(CouponEvent.sport.isnot(None), CouponEvent.league.isnot(None))\
+        .group_by(CouponEvent.sport, CouponEvent.league)\
+        .order_by(CouponEvent.sport, CouponEvent.league).all()
+    return Counter({(sport, league): picks for sport, league, picks in rows})
+
+def latest_leg_id(session):
+    return session.query(func.max(CouponEvent.id)).scalar() or 0
+
+def written_up_to(leg_id):
+    #coupons whose legs were all written by leg_id, later ones are left to coupons_after
+    return ~exists().where(CouponEvent.coupon_id == PurchasedCoupon.id, CouponEvent.id > leg_id)
+
+def coupons_after(session, leg_id, limit):
+    #legs written after leg_id by any process, grouped back into (timestamp, legs) per coupon
+    columns = [getattr(CouponEvent, column) for column in COUPON_EVENT_COLUMNS]
+    rows = session.query(CouponEvent.id, CouponEvent.coupon_id, CouponEvent.timestamp, *columns)\
+        .filter(CouponEvent.id > leg_id)\
+        .order_by(CouponEvent.id)\
+        .limit(limit).all()
+
+    if len(rows) == limit:
+        #the last coupon may have legs past the limit, it is read whole with the next call
+        first = next(index for index, row in enumerate(rows) if row.coupon_id == rows[-1].coupon_id)
+        if first > 0:
+            rows = rows[:first]
+
+    coupons = {}
+    for row in rows:
+        legs = coupons.setdefault(row.coupon_id, (row.timestamp, []))[1]
+        legs.append({column: getattr(row, column) for column in COUPON_EVENT_COLUMNS})
+    return (rows[-1].id if rows else leg_id), list(coupons.values())
+
+def follow_coupons(session, leg_id, add_coupon, batch_size=1000):
+    #feeds every coupon written after leg_id to add_coupon(recommended_events, timestamp), returns the new leg id
+    while True:
+        last_id, coupons = coupons_after(session, leg_id, batch_size)
+        if last_id == leg_id:
+            return leg_id
+        for timestamp, legs in coupons:
+            add_coupon(legs, timestamp)
+        leg_id = last_id
@@ -3,7 +3,7 @@ from app import db
 class Casino(db.Model):
     __tablename__ = "casinos"
 
-    id = db.Column(db.Integer, primary_key=True, autoincrement=True)  
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)  
     db_name = db.Column(db.String(100), nullable=False)
     recommender_type = db.Column(db.String(30))
     recommendation_schema = db.Column(db.JSON)
@@ -1,21 +1,27 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Float, Text, ForeignKey, JSON, Table
+from sqlalchemy import Column, Integer, BigInteger, String, Float, Text, ForeignKey, JSON, Table, DateTime, Index, \
+    UniqueConstraint, func
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
 SharedBase = declarative_base()
+
+#64-bit ids, SQLite only autoincrements INTEGER primary keys
+BigId = BigInteger().with_variant(Integer, "sqlite")
     
 event_teams = Table(
     'event_teams',
     SharedBase.metadata,
-    Column('event_id', Integer, ForeignKey('events.id'), primary_key=True), 
-    Column('team_id', Integer, ForeignKey('teams.id'), primary_key=True)
+    Column('event_id', BigId, ForeignKey('events.id'), primary_key=True), 
+    Column('team_id', BigId, ForeignKey('teams.id'), primary_key=True)
 )
 
 class User(SharedBase):
     __tablename__ = "users"
+    #bulk ingestion skips duplicate users with ON CONFLICT DO NOTHING instead of a lookup per user
+    __table_args__ = (UniqueConstraint("name", "surname", name="uq_users_name_surname"),)
     
-    id = Column(Integer, primary_key=True, autoincrement=True)  
+    id = Column(BigId, primary_key=True, autoincrement=True)  
     name = Column(String(40), autoincrement=True)  
     surname = Column(String(40), autoincrement=True)  
     birth_year = Column(Integer, nullable = False)
@@ -35,22 +41,34 @@ class User(SharedBase):
 class UserProfile(SharedBase):
     __tablename__ = "users_profile"
 
-    id = Column(Integer, primary_key=True, nullable = False)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True, unique=True)
+    id = Column(BigId, primary_key=True, nullable = False)
+    user_id = Column(BigId, ForeignKey("users.id"), nullable=False, index=True, unique=True)
     favorite_sport_league_json = Column(Text)
     purchases_at_last_update = Column(Integer, default=0, nullable = False)
-    last_updated = Column(String(30), default=datetime.utcnow, nullable = False)
+    last_updated = Column(DateTime, default=datetime.utcnow, nullable = False)
 
 
     user = relationship("User", back_populates="user_profile")
 
+class UserAffinity(SharedBase):
+    __tablename__ = "users_affinity"
+
+    user_id = Column(BigId, ForeignKey("users.id"), primary_key=True)
+    sport_counts = Column(JSON, default=dict, nullable=False)
+    league_counts = Column(JSON, default=dict, nullable=False)
+    country_counts = Column(JSON, default=dict, nullable=False)
+    home_team_counts = Column(JSON, default=dict, nullable=False)
+    away_team_counts = Column(JSON, default=dict, nullable=False)
+    coupons_count = Column(Integer, default=0, nullable=False)
+    last_updated = Column(DateTime, default=datetime.utcnow, nullable=False)
+
 class Event(SharedBase):
     __tablename__ = "events"
     
-    id = Column(Integer, primary_key=True, autoincrement=True) 
+    id = Column(BigId, primary_key=True, autoincrement=True) 
     country = Column(String(50), nullable = False)
-    begin_timestamp = Column(String(30), nullable = False)
-    end_timestamp = Column(String(30), nullable = False)
+    begin_timestamp = Column(DateTime, nullable = False, index=True)
+    end_timestamp = Column(DateTime, nullable = False)
     league = Column(String(100), nullable = False)
     sport = Column(String(50), nullable=False)
     odd = Column(Float, nullable=False)
@@ -62,10 +80,24 @@ class Event(SharedBase):
     def __repr__(self):
         return f"<Event {self.id} - {self.sport} in {self.country}>"
 
+class ArchivedEvent(SharedBase):
+    __tablename__ = "events_archive"
+    
+    id = Column(BigId, primary_key=True) 
+    country = Column(String(50), nullable = False)
+    begin_timestamp = Column(DateTime, nullable = False)
+    end_timestamp = Column(DateTime, nullable = False)
+    league = Column(String(100), nullable = False)
+    sport = Column(String(50), nullable=False)
+    odd = Column(Float, nullable=False)
+    home_team = Column(String(40), nullable=False) 
+    away_team = Column(String(40), nullable=False) 
+    archived_at = Column(DateTime, server_default=func.now(), nullable=False)
+
 class Team(SharedBase):
     __tablename__ = "teams"
     
-    id = Column(Integer, primary_key=True, autoincrement=True) 
+    id = Column(BigId, primary_key=True, autoincrement=True) 
     name = Column(String(100), unique = True, nullable = False)
     sport = Column(String(30), nullable = False)
     
@@ -76,15 +108,40 @@ class Team(SharedBase):
     
 class PurchasedCoupon(SharedBase):
     __tablename__ = "purchased_coupons"
+    #a user's coupons of the last N days are one range scan, it also serves plain user_id lookups
+    #the timestamp index serves the windowed rebuilds of co-occurrence and trending
+    __table_args__ = (Index("ix_purchased_coupons_user_id_timestamp", "user_id", "timestamp"),
+                      Index("ix_purchased_coupons_timestamp", "timestamp"))
     
-    id = Column(Integer, primary_key=True, autoincrement=True)  
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    id = Column(BigId, primary_key=True, autoincrement=True)  
+    user_id = Column(BigId, ForeignKey("users.id"), nullable=False)
     stake = Column(Float, nullable=False)
-    timestamp = Column(String(30), nullable = False)
+    timestamp = Column(DateTime, nullable = False)
     recommended_events = Column(JSON, nullable=False)
     
     user = relationship("User", back_populates="purchased_coupons")
 
+class CouponEvent(SharedBase):
+    __tablename__ = "coupon_events"
+    #one row per coupon leg, so per-user counts are GROUP BY queries instead of JSON scans
+    __table_args__ = (Index("ix_coupon_events_user_id_timestamp", "user_id", "timestamp"),)
     
-    
+    id = Column(BigId, primary_key=True, autoincrement=True)
+    coupon_id = Column(BigId, ForeignKey("purchased_coupons.id"), nullable=False, index=True)
+    user_id = Column(BigId, ForeignKey("users.id"), nullable=False)
+    timestamp = Column(DateTime, nullable = False)
+    sport = Column(String(50), index=True)
+    league = Column(String(100), index=True)
+    country = Column(String(50), index=True)
+    home_team = Column(String(40), index=True)
+    away_team = Column(String(40), index=True)
+
+class PrecomputedRecommendation(SharedBase):
+    __tablename__ = "precomputed_recommendations"
 
+    user_id = Column(BigId, ForeignKey("users.id"), primary_key=True)
+    recommender_type = Column(String(30), nullable=False)
+    recommendation = Column(JSON, nullable=False)
+    generated_at = Column(DateTime, nullable=False)
+    #UserAffinity.coupons_count when the row was computed, a later purchase makes the row stale
+    coupons_count = Column(Integer, default=0, nullable=False)
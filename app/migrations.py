@@ -0,0 +1,140 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.types import DateTime, BigInteger
+from app.db_models_shared import SharedBase
+
+
+class DuplicateUsersError(Exception):
+    """Raised when users rows repeat a (name, surname) pair the unique index would forbid."""
+
+    def __init__(self, duplicates):
+        self.duplicates = duplicates
+        shown = ", ".join(f"{name} {surname} ({count} rows)" for name, surname, count in duplicates[:20])
+        more = f" and {len(duplicates) - 20} more" if len(duplicates) > 20 else ""
+        super().__init__(f"Cannot create uq_users_name_surname, {len(duplicates)} (name, surname) pairs "
+                         f"are duplicated: {shown}{more}. Merge or rename these users and run the migration again.")
+
+#columns that older tenant databases still store as String(30) ISO timestamps
+TIMESTAMP_COLUMNS = (
+    ("purchased_coupons", "timestamp"),
+    ("events", "begin_timestamp"),
+    ("events", "end_timestamp"),
+    ("users_profile", "last_updated"),
+    ("users_affinity", "last_updated"),
+    ("precomputed_recommendations", "generated_at"),
+)
+
+#id and foreign key columns that older databases store as 32-bit INTEGER
+BIGINT_COLUMNS = (
+    ("users", "id"),
+    ("users_profile", "id"),
+    ("users_profile", "user_id"),
+    ("users_affinity", "user_id"),
+    ("events", "id"),
+    ("events_archive", "id"),
+    ("teams", "id"),
+    ("event_teams", "event_id"),
+    ("event_teams", "team_id"),
+    ("purchased_coupons", "id"),
+    ("purchased_coupons", "user_id"),
+    ("coupon_events", "id"),
+    ("coupon_events", "coupon_id"),
+    ("coupon_events", "user_id"),
+    ("precomputed_recommendations", "user_id"),
+)
+
+MASTER_BIGINT_COLUMNS = (
+    ("casinos", "id"),
+)
+
+INDEX_STATEMENTS = (
+    "CREATE INDEX IF NOT EXISTS ix_events_begin_timestamp ON events (begin_timestamp)",
+    "CREATE INDEX IF NOT EXISTS ix_purchased_coupons_user_id_timestamp ON purchased_coupons (user_id, \"timestamp\")",
+    #the composite index above starts with user_id, so the single column index is redundant
+    "DROP INDEX IF EXISTS ix_purchased_coupons_user_id",
+    #co-occurrence and trending rebuild from a window of recent coupons
+    "CREATE INDEX IF NOT EXISTS ix_purchased_coupons_timestamp ON purchased_coupons (\"timestamp\")",
+    #serial sequences created as integer stop at 2**31 - 1 even after their column became BIGINT
+    "ALTER SEQUENCE IF EXISTS coupon_events_id_seq AS BIGINT",
+)
+
+#duplicate users used to be rejected by a lookup, the constraint makes ON CONFLICT DO NOTHING skip them
+UNIQUE_USERS_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS uq_users_name_surname ON users (name, surname)"
+
+DUPLICATE_USERS = """
+    SELECT name, surname, count(*) FROM users
+    GROUP BY name, surname HAVING count(*) > 1
+    ORDER BY count(*) DESC, name, surname
+"""
+
+#copies the legs of coupons stored before coupon_events existed, coupons that already have legs are skipped
+BACKFILL_COUPON_EVENTS = """
+    INSERT INTO coupon_events (coupon_id, user_id, "timestamp", sport, league, country, home_team, away_team)
+    SELECT c.id, c.user_id, c."timestamp", leg->>'sport', leg->>'league', leg->>'country', leg->>'home_team', leg->>'away_team'
+    FROM purchased_coupons c CROSS JOIN LATERAL json_array_elements(c.recommended_events::json) AS leg
+    WHERE NOT EXISTS (SELECT 1 FROM coupon_events e WHERE e.coupon_id = c.id)
+"""
+
+def tenant_schema(engine):
+    #set on the casino engines of schema tenancy, None for a database per casino
+    return (engine.get_execution_options().get("schema_translate_map") or {}).get(None)
+
+def pending_columns(engine, columns, column_type):
+    inspector = inspect(engine)
+    schema = tenant_schema(engine)
+    pending = []
+    for table, column in columns:
+        if not inspector.has_table(table, schema=schema):
+            continue
+        types = {info["name"]: info["type"] for info in inspector.get_columns(table, schema=schema)}
+        if column in types and not isinstance(types[column], column_type):
+            pending.append((table, column))
+    return pending
+
+def pending_timestamp_columns(engine):
+    return pending_columns(engine, TIMESTAMP_COLUMNS, DateTime)
+
+def pending_bigint_columns(engine):
+    return pending_columns(engine, BIGINT_COLUMNS, BigInteger)
+
+def migrate_master_db(engine):
+    pending = pending_columns(engine, MASTER_BIGINT_COLUMNS, BigInteger)
+    with engine.begin() as connection:
+        for table, column in pending:
+            connection.execute(text(f'ALTER TABLE {table} ALTER COLUMN "{column}" TYPE BIGINT'))
+    return pending
+
+def migrate_tenant_db(engine):
+    """Brings an existing casino database up to the current models; safe to run more than once."""
+    SharedBase.metadata.create_all(engine)
+    pending = pending_timestamp_columns(engine)
+    widened = pending_bigint_columns(engine)
+    schema = tenant_schema(engine)
+
+    with engine.begin() as connection:
+        if schema:
+            #the raw statements below name tables without a schema, schema_translate_map does not apply to them
+            connection.execute(text(f'SET LOCAL search_path TO "{schema}"'))
+        for table, column in pending:
+            connection.execute(text(
+                f'ALTER TABLE {table} ALTER COLUMN "{column}" TYPE TIMESTAMP USING "{column}"::timestamp'
+            ))
+        for table, column in widened:
+            connection.execute(text(f'ALTER TABLE {table} ALTER COLUMN "{column}" TYPE BIGINT'))
+        for statement in INDEX_STATEMENTS:
+            connection.execute(text(statement))
+        connection.execute(text(BACKFILL_COUPON_EVENTS))
+
+    add_unique_users_index(engine)
+    return pending + widened
+
+def add_unique_users_index(engine):
+    #own transaction after the rest of the migration, so duplicates left from before the constraint
+    #are reported by name instead of aborting every other step with an IntegrityError
+    schema = tenant_schema(engine)
+    with engine.begin() as connection:
+        if schema:
+            connection.execute(text(f'SET LOCAL search_path TO "{schema}"'))
+        duplicates = connection.execute(text(DUPLICATE_USERS)).all()
+        if duplicates:
+            raise DuplicateUsersError([tuple(row) for row in duplicates])
+        connection.execute(text(UNIQUE_USERS_INDEX))
@@ -0,0 +1,99 @@
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import insert
+from app.config import Config
+from app.db_models_shared import User, PrecomputedRecommendation, SharedBase
+from app.services import recommender_registry, purchase_versions
+from app.utils import get_casino_db_session, tenant_router
+
+def reset_engines():
+    #a forked worker must not reuse the connections of the parent's pools
+    tenant_router().dispose_all(close=False)
+
+def precompute_chunk(casino_id, recommender_type, user_ids):
+    recommender_func = recommender_registry[recommender_type]
+    rows = []
+    failed = 0
+
+    #one tenant session for the whole chunk instead of one per user
+    session = get_casino_db_session(casino_id)
+    try:
+        #read before the recommendations, a purchase stored while the chunk runs leaves its row behind the reader's version
+        versions = purchase_versions(casino_id, user_ids, session=session)
+        for user_id in user_ids:
+            try:
+                recommendation = recommender_func(user_id=user_id, casino_id=casino_id, session=session)
+            except Exception as exc:
+                print(f"Precompute error for user {user_id} in casino {casino_id}: {exc}")
+                session.rollback()
+                failed += 1
+                continue
+
+            rows.append({
+                "user_id": user_id,
+                "recommender_type": recommender_type,
+                "recommendation": recommendation,
+                "generated_at": datetime.utcnow(),
+                "coupons_count": versions[user_id]
+            })
+    finally:
+        session.close()
+
+    return rows, failed
+
+def write_precomputed(session, rows):
+    if not rows:
+        return 0
+
+    session.query(PrecomputedRecommendation)\
+        .filter(PrecomputedRecommendation.user_id.in_([row["user_id"] for row in rows]))\
+        .delete(synchronize_session=False)
+    session.execute(insert(PrecomputedRecommendation), rows)
+    session.commit()
+    return len(rows)
+
+def iter_user_id_chunks(session, chunk_size):
+    #yield_per streams the ids through a server-side cursor instead of loading them all
+    chunk = []
+    for row in session.query(User.id).execution_options(yield_per=chunk_size):
+        chunk.append(row[0])
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def run_precompute(casino_id, recommender_type, workers=None, chunk_size=None):
+    workers = workers or Config.PRECOMPUTE_WORKERS
+    chunk_size = chunk_size or Config.PRECOMPUTE_CHUNK_SIZE
+
+    if recommender_type not in recommender_registry:
+        raise ValueError(f"Unsupported recommender_type: {recommender_type}")
+
+    read_session = get_casino_db_session(casino_id)
+    write_session = get_casino_db_session(casino_id)
+    SharedBase.metadata.create_all(bind=write_session.get_bind(), tables=[PrecomputedRecommendation.__table__])
+
+    users, written, failed = 0, 0, 0
+    pending = []
+
+    def drain(limit):
+        nonlocal written, failed
+        while len(pending) > limit:
+            rows, chunk_failed = pending.pop(0).result()
+            written += write_precomputed(write_session, rows)
+            failed += chunk_failed
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=reset_engines) as executor:
+            for user_ids in iter_user_id_chunks(read_session, chunk_size):
+                users += len(user_ids)
+                pending.append(executor.submit(precompute_chunk, casino_id, recommender_type, user_ids))
+                #bounds how many finished chunks wait in memory for the writer
+                drain(2 * workers)
+            drain(0)
+    finally:
+        read_session.close()
+        write_session.close()
+
+    return {"users": users, "written": written, "failed": failed}
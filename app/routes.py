@@ -1,13 +1,18 @@
-from flask import Blueprint, request, jsonify
+import json
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 from app.schemas import UserRequestSchema, RecommendationSchema, ConfigSchema
 from app.services import recommendation_generator, recommender_registry
 from marshmallow import ValidationError
 from app.db_models_shared import User
 from app.db_models_master import Casino
+from app.config import Config
 from app import db 
 from app.services import create_purchased_coupons
+from app.catalog import get_catalog_stats
+from app.trending import get_trending_stats
+from app.cache import recommendation_cache
 from app.utils import generate_dummy_purchased_coupons, get_casino_db_session, generate_dummy_events, \
-generate_dummy_teams
+generate_dummy_teams, tenant_router, ConnectionBudgetExceeded
 
 
 main = Blueprint("main", __name__)
@@ -18,6 +23,28 @@ user_request_schema = UserRequestSchema()
 recommendation_schema = RecommendationSchema()
 config_schema = ConfigSchema()
 
+@main.app_errorhandler(ConnectionBudgetExceeded)
+def connection_budget_exceeded(err):
+    #every casino engine of this process is busy, the client can retry once connections are returned
+    response = jsonify({"error": str(err)})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+def load_casino_config(casino_id):
+    if casino_id not in CONFIGS:
+        casino = Casino.query.get(casino_id)
+        if not casino:
+            return None, (jsonify({"error": "Casino not found"}), 404)
+        if not casino.recommender_type or not casino.recommendation_schema:
+            return None, (jsonify({"error": "Casino is not configured. Please set up the casino first."}), 400)
+
+        CONFIGS[casino_id] = {
+            "recommender_type": casino.recommender_type,
+            "recommendation_schema": casino.recommendation_schema
+        }
+        
+    return CONFIGS[casino_id], None
+
 @main.route("/recommend/<int:user_id>", methods=["GET"])
 def recommend(user_id):
     try:
@@ -31,28 +58,20 @@ def recommend(user_id):
         except ValueError:
             return jsonify({"error": "Casino-ID header must be an integer"}), 400
        
-        if casino_id not in CONFIGS:
-            casino = Casino.query.get(casino_id)
-            if not casino:
-                return jsonify({"error": "Casino not found"}), 404
-            if not casino.recommender_type or not casino.recommendation_schema:
-                return jsonify({"error": "Casino is not configured. Please set up the casino first."}), 400
-
-            CONFIGS[casino_id] = {
-                "recommender_type": casino.recommender_type,
-                "recommendation_schema": casino.recommendation_schema
-            }
+        config, error = load_casino_config(casino_id)
+        if error:
+            return error
             
+        #one tenant session per request, the recommender reuses it and the user it loaded
         session = get_casino_db_session(casino_id)
-        user = session.get(User, user_id)
-        if not user:
-           return jsonify({"error": "User not found"}), 404
-        
-        casino = db.session.get(Casino, casino_id)
+        try:
+            user = session.get(User, user_id)
+            if not user:
+               return jsonify({"error": "User not found"}), 404
             
-        config = CONFIGS[casino_id]
-        
-        recommendation = recommendation_generator(config, casino_id, user_id)
+            recommendation = recommendation_generator(config, casino_id, user_id, session=session)
+        finally:
+            session.close()
         
         return jsonify(recommendation), 200
 
@@ -60,6 +79,66 @@ def recommend(user_id):
     except ValidationError as err:
         return jsonify({"error": err.messages}), 400
     
+@main.route("/recommend/batch", methods=["POST"])
+def recommend_batch():
+    casino_id = request.headers.get("Casino-ID")
+    
+    if not casino_id:
+        return jsonify({"error": "Casino-ID header is required"}), 400
+    try:
+        casino_id = int(casino_id)
+    except ValueError:
+        return jsonify({"error": "Casino-ID header must be an integer"}), 400
+    
+    payload = request.get_json(silent=True) or {}
+    user_ids = payload.get("user_ids")
+    
+    if not isinstance(user_ids, list) or not user_ids:
+        return jsonify({"error": "user_ids must be a non-empty list"}), 400
+    if len(user_ids) > Config.RECOMMEND_BATCH_MAX_USERS:
+        return jsonify({"error": f"At most {Config.RECOMMEND_BATCH_MAX_USERS} user_ids are allowed per batch"}), 400
+    
+    config, error = load_casino_config(casino_id)
+    if error:
+        return error
+    
+    def generate():
+        session = get_casino_db_session(casino_id)
+        try:
+            for start in range(0, len(user_ids), Config.RECOMMEND_BATCH_CHUNK_SIZE):
+                chunk = user_ids[start:start + Config.RECOMMEND_BATCH_CHUNK_SIZE]
+                valid_ids = [user_id for user_id in chunk if type(user_id) is int]
+                
+                #one existence check per chunk instead of one per user
+                existing_ids = set()
+                if valid_ids:
+                    for row in session.query(User.id).filter(User.id.in_(valid_ids)).all():
+                        existing_ids.add(row[0])
+                
+                for user_id in chunk:
+                    if type(user_id) is not int:
+                        line = {"user_id": user_id, "error": "user_id must be an integer"}
+                    elif user_id not in existing_ids:
+                        line = {"user_id": user_id, "error": "User not found"}
+                    else:
+                        try:
+                            line = {"user_id": user_id,
+                                    "recommendation": recommendation_generator(config, casino_id, user_id,
+                                                                               session=session)}
+                        except Exception as exc:
+                            #a failed statement must not abort the transaction for the next users
+                            session.rollback()
+                            line = {"user_id": user_id, "error": str(exc)}
+                            
+                    yield json.dumps(line, default=str) + "\n"
+
+                #objects loaded for this chunk are not needed again, keep the identity map from growing
+                session.expunge_all()
+        finally:
+            session.close()
+    
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+    
 @main.route("/config", methods=['POST'])
 def config():
     casino_id = request.headers.get("Casino-ID")
@@ -95,6 +174,7 @@ def config():
             "recommender_type": recommender_type,
             "recommendation_schema": recommendation_schema
         }
+        recommendation_cache.invalidate(casino_id)
         
         casino.recommender_type = recommender_type
         casino.recommendation_schema = recommendation_schema
@@ -141,3 +221,50 @@ def create_coupons(user_id):
         return jsonify({"error": str(e)}), 400
     
 
+@main.route('/stats/catalog', methods=['GET'])
+def catalog_stats():
+    casino_id = request.headers.get("Casino-ID")
+    if not casino_id:
+        return jsonify({"catalogs": get_catalog_stats()}), 200
+    try:
+        casino_id = int(casino_id)
+    except ValueError:
+        return jsonify({"error": "Casino-ID header must be an integer"}), 400
+    
+    stats = get_catalog_stats(casino_id)
+    if stats is None:
+        return jsonify({"error": "Event catalog not loaded for this casino"}), 404
+    
+    return jsonify(stats), 200
+
+@main.route('/stats/trending', methods=['GET'])
+def trending_stats():
+    casino_id = request.headers.get("Casino-ID")
+    if not casino_id:
+        return jsonify({"trending": get_trending_stats()}), 200
+    try:
+        casino_id = int(casino_id)
+    except ValueError:
+        return jsonify({"error": "Casino-ID header must be an integer"}), 400
+    
+    stats = get_trending_stats(casino_id)
+    if stats is None:
+        return jsonify({"error": "Trending scores not loaded for this casino"}), 404
+    
+    return jsonify(stats), 200
+
+@main.route('/stats/pools', methods=['GET'])
+def pool_stats():
+    casino_id = request.headers.get("Casino-ID")
+    if not casino_id:
+        return jsonify(tenant_router().stats()), 200
+    try:
+        casino_id = int(casino_id)
+    except ValueError:
+        return jsonify({"error": "Casino-ID header must be an integer"}), 400
+    
+    return jsonify(tenant_router().stats(casino_id)), 200
+
+@main.route('/stats/cache', methods=['GET'])
+def cache_stats():
+    return jsonify(recommendation_cache.stats()), 200
@@ -17,9 +17,9 @@ class EventSchema(SQLAlchemyAutoSchema):
     class Meta:
         model = Event
         
-    begin_timestamp = fields.String(required = True)
+    begin_timestamp = fields.DateTime(required = True)
     country =  fields.String(required = True)
-    end_timestamp = fields.String(required = True) 
+    end_timestamp = fields.DateTime(required = True) 
     id = fields.Integer(required=True)  
     league = fields.String(required = True)
     home_team = fields.String(required=True)  
@@ -43,7 +43,7 @@ class PurchasedCouponSchema(SQLAlchemyAutoSchema):
     id = fields.Integer(required=True) 
     user_id = fields.Integer(required=True)  
     stake = fields.Float(required = True)
-    timestamp = fields.String(required = True)
+    timestamp = fields.DateTime(required = True)
     recommended_events = fields.List(fields.Nested(RecommendedEventSchema), required=True)
     
     
@@ -74,7 +74,7 @@ class UserProfileSchema(SQLAlchemyAutoSchema):
     user_id = fields.Int(required=True)
     favorite_sport_league_json = fields.List(fields.List(fields.String()), allow_none=True)
     purchases_at_last_update = fields.Int(required=True)
-    last_updated = fields.Str(required=True)
+    last_updated = fields.DateTime(required=True)
 
     
     
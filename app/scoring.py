@@ -0,0 +1,182 @@
+import sys
+import heapq
+import numpy as np
+
+#(weight for the top item, weight for the runner-up) per scored column
+SCORING_WEIGHTS = {
+    "country": (2, 1),
+    "sport": (2, 1),
+    "league": (3, 2),
+    "home_team": (4, 3),
+    "away_team": (4, 3),
+}
+
+SCORED_COLUMNS = tuple(SCORING_WEIGHTS)
+
+EVENT_FIELDS = ("country", "league", "home_team", "away_team", "sport")
+
+def top_k_indices(scores, k):
+    #Same ordering as a stable sort on -score: ties keep their original position
+    n = len(scores)
+    if n == 0 or k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k >= n:
+        return np.lexsort((np.arange(n), -scores))
+
+    partition = np.argpartition(-scores, k - 1)[:k]
+    kth_score = scores[partition].min()
+
+    above = np.flatnonzero(scores > kth_score)
+    ties = np.flatnonzero(scores == kth_score)[:k - len(above)]
+    candidates = np.concatenate((above, ties))
+
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+def score_event(event, user, top_values):
+    score = 0
+    if event.country in user.country:
+        score += 1
+    if event.sport in user.favorite_sport:
+        score += 1
+
+    for column in SCORED_COLUMNS:
+        first, second = SCORING_WEIGHTS[column]
+        values = top_values.get(column, [])
+        value = getattr(event, column)
+        if value in values[:1]:
+            score += first
+        elif value in values[1:2]:
+            score += second
+    return score
+
+def stream_top_events(rows, user, top_values, event_limit):
+    #min-heap of the best event_limit rows, keyed (score, -row number) so earlier rows win ties
+    heap = []
+    if event_limit <= 0:
+        return []
+
+    for number, row in enumerate(rows):
+        entry = (score_event(row, user, top_values), -number, row)
+        if len(heap) < event_limit:
+            heapq.heappush(heap, entry)
+        elif entry[:2] > heap[0][:2]:
+            heapq.heapreplace(heap, entry)
+
+    return [{
+        "country": row.country,
+        "league": row.league,
+        "home_team": row.home_team,
+        "away_team": row.away_team,
+        "sport": row.sport,
+        "odd": float(row.odd),
+    } for _, _, row in sorted(heap, key=lambda entry: entry[:2], reverse=True)]
+
+class EventScoringEngine:
+    """Dictionary-encoded event columns scored in a single vectorized pass."""
+
+    def __init__(self, rows=()):
+        self.size = 0
+        self._ids = np.empty(0, dtype=np.int64)
+        self._odds = np.empty(0, dtype=np.float64)
+        self._codes = {column: np.empty(0, dtype=np.int32) for column in EVENT_FIELDS}
+        self.vocabularies = {column: [] for column in EVENT_FIELDS}
+        self.lookups = {column: {} for column in EVENT_FIELDS}
+        self.append(rows)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def ids(self):
+        return self._ids[:self.size]
+
+    @property
+    def odds(self):
+        return self._odds[:self.size]
+
+    def codes(self, column):
+        return self._codes[column][:self.size]
+
+    def code_of(self, column, value):
+        return self.lookups[column].get(value, -1)
+
+    def _intern(self, column, value):
+        lookup = self.lookups[column]
+        code = lookup.get(value)
+        if code is None:
+            code = len(lookup)
+            if isinstance(value, str):
+                value = sys.intern(value)
+            lookup[value] = code
+            self.vocabularies[column].append(value)
+        return code
+
+    def _reserve(self, capacity):
+        if capacity <= len(self._ids):
+            return
+        capacity = max(capacity, 2 * len(self._ids), 64)
+
+        def grow(array):
+            grown = np.empty(capacity, dtype=array.dtype)
+            grown[:self.size] = array[:self.size]
+            return grown
+
+        self._ids = grow(self._ids)
+        self._odds = grow(self._odds)
+        for column in EVENT_FIELDS:
+            self._codes[column] = grow(self._codes[column])
+
+    def append(self, rows):
+        rows = list(rows)
+        if not rows:
+            return 0
+        self._reserve(self.size + len(rows))
+
+        position = self.size
+        for row in rows:
+            self._ids[position] = row.id
+            self._odds[position] = row.odd
+            for column in EVENT_FIELDS:
+                self._codes[column][position] = self._intern(column, getattr(row, column))
+            position += 1
+
+        self.size = position
+        return len(rows)
+
+    def _lookup_table(self, column, top_values, user_value=None):
+        first, second = SCORING_WEIGHTS[column]
+        table = np.zeros(len(self.vocabularies[column]), dtype=np.int32)
+
+        for code, value in enumerate(self.vocabularies[column]):
+            score = 0
+            if user_value is not None and value in user_value:
+                score += 1
+            if value in top_values[:1]:
+                score += first
+            elif value in top_values[1:2]:
+                score += second
+            table[code] = score
+
+        return table
+
+    def score(self, user, top_values):
+        user_values = {"country": user.country, "sport": user.favorite_sport}
+        size = self.size
+        scores = np.zeros(size, dtype=np.int32)
+
+        for column in SCORED_COLUMNS:
+            table = self._lookup_table(column, top_values.get(column, []), user_values.get(column))
+            scores += table[self._codes[column][:size]]
+
+        return scores
+
+    def event_data(self, position):
+        event = {}
+        for column in EVENT_FIELDS:
+            event[column] = self.vocabularies[column][self._codes[column][position]]
+        event["odd"] = float(self._odds[position])
+        return event
+
+    def top_events(self, user, top_values, event_limit):
+        scores = self.score(user, top_values)
+        return [self.event_data(position) for position in top_k_indices(scores, event_limit)]
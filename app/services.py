@@ -1,21 +1,64 @@
 import random
+from collections import Counter
 from datetime import datetime, timedelta
 from app.schemas import EventSchema, UserResponseSchema, TeamSchema, CasinoSchema, PurchasedCouponSchema,\
 UserProfileSchema
 from faker import Faker
 from marshmallow import ValidationError
 from app import db
-from app.db_models_shared import User, Event, Team, PurchasedCoupon, UserProfile
+from app.config import Config
+from app.db_models_shared import User, Event, Team, PurchasedCoupon, UserProfile, UserAffinity, PrecomputedRecommendation, \
+event_teams
 from app.db_models_master import Casino
+from app.catalog import get_event_catalog, refresh_event_catalog, catalog_row, active_event_filter
+from app.cache import recommendation_cache
+from app.collaborative import load_collaborative_model
+from app.cooccurrence import get_cooccurrence_matrix, recent_picks
+from app.trending import get_trending_scores, trending_positions
+from app.scoring import stream_top_events
+from app.affinity import update_user_affinities, get_user_affinity, top_affinity_values
+from app.coupon_events import record_coupon_events, user_sport_league_counts
+from app.bulk import insert_ignoring_conflicts
+from app.validators import load_batch
 from app.utils import  generate_value, generate_dummy_users, generate_dummy_casinos, generate_dummy_events, \
-generate_dummy_teams, create_db_per_casino, get_casino_db_session, uppercase_dict, generate_unique_id
-from collections import Counter
-from sqlalchemy.orm import load_only
+generate_dummy_teams, create_db_per_casino, get_casino_db_session, uppercase_dict, generate_unique_id, \
+generate_unique_ids
+from sqlalchemy import select, insert, update, values, column, case, func, BigInteger, Integer
+from sqlalchemy.exc import SQLAlchemyError
 import json
+import time
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 
 fake = Faker()
 
+#casino_id -> (checked_at, newest generated_at of the precomputed rows)
+precompute_runs = {}
+precompute_runs_lock = threading.Lock()
+
+def provision_casino(casino_id):
+    started = time.time()
+    try:
+        create_db_per_casino(casino_id)
+    except Exception as exc:
+        return {"casino_id": casino_id, "status": "failed", "error": str(exc)}
+    return {"casino_id": casino_id, "status": "ready", "seconds": round(time.time() - started, 3)}
+
+def provision_casinos(casino_ids, workers=None):
+    #database creation is I/O bound on the server side, so a few threads provision a batch concurrently
+    workers = workers or Config.PROVISION_WORKERS
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        statuses = list(executor.map(provision_casino, casino_ids))
+    
+    for status in statuses:
+        if status["status"] == "ready":
+            print(f"Casino {status['casino_id']} provisioned in {status['seconds']}s")
+        else:
+            print(f"Provisioning error for casino {status['casino_id']}: {status['error']}")
+    return statuses
+
 def create_casinos(casino_data_list, commit=True):
     casinos = []
     schema = CasinoSchema()
@@ -30,8 +73,6 @@ def create_casinos(casino_data_list, commit=True):
                 db.session.add(c)
                 db.session.flush()
                 
-                create_db_per_casino(c.id)
-                
                 casinos.append(c)
 
             except Exception as exc:
@@ -40,7 +81,10 @@ def create_casinos(casino_data_list, commit=True):
     if commit:
         db.session.commit()
 
-    return casinos
+    statuses = provision_casinos([c.id for c in casinos])
+    ready = {status["casino_id"] for status in statuses if status["status"] == "ready"}
+    
+    return [c for c in casinos if c.id in ready]
     
 def create_user_profile(user_id, session):
     
@@ -48,153 +92,186 @@ def create_user_profile(user_id, session):
     profile = UserProfile(id = profile_id, 
                           user_id = user_id,
                           purchases_at_last_update = 0,
-                          last_updated = datetime.utcnow().isoformat())
+                          last_updated = datetime.utcnow())
     session.add(profile)
+
+def create_user_profiles(user_ids, session):
+    profile_ids = generate_unique_ids(session, UserProfile, len(user_ids))
+    now = datetime.utcnow()
+    rows = [{"id": profile_id, "user_id": user_id, "purchases_at_last_update": 0, "last_updated": now}
+            for profile_id, user_id in zip(profile_ids, user_ids)]
+    insert_ignoring_conflicts(session, UserProfile.__table__, rows)
+
+def validate_batch(data_list, schema, ids, session, kind):
+    #validation needs no database round trip, so the whole batch is checked before anything is written
+    for data, record_id in zip(data_list, ids):
+        data["id"] = record_id
+    rows, errors = load_batch(schema, data_list, session=session)
+    for position, exc in errors:
+        print(f"Validation error for {kind} {data_list[position]}: {exc}")
+    return [row for _, row in rows]
     
-def create_users(user_data_list, casino_id, commit=True):
+def create_users(user_data_list, casino_id, commit=True, raise_errors=False):
     users = []
     session = get_casino_db_session(casino_id)
-    schema = UserResponseSchema()
     
-    for user_data in user_data_list:
-        try:
-            user_data["id"] = generate_unique_id(session, User)
-            
-            user_data_upper = uppercase_dict(user_data)
-            validated_data = schema.load(user_data_upper, session=session)
-            u = User(**validated_data)
+    try:
+        ids = generate_unique_ids(session, User, len(user_data_list))
+        rows = validate_batch(user_data_list, UserResponseSchema(), ids, session, "user")
         
-            existing_user = session.query(User).filter((User.name == u.name) & (User.surname == u.surname)).first()
-            if existing_user:
-                print(f"Duplicate user detected with name {u.name} and surname {u.surname} , skipping.")
+        #the (name, surname) unique constraint replaces the duplicate lookup per user
+        inserted = set(insert_ignoring_conflicts(session, User.__table__, rows))
+        for row in rows:
+            if row["id"] not in inserted:
+                print(f"Duplicate user detected with name {row.get('name')} and surname {row.get('surname')} , skipping.")
                 continue
-            
-            session.add(u)
-            session.flush()
-            create_user_profile(u.id, session=session)
-            users.append(u)
-                    
-        except Exception as exc:
-            print(f"Validation error for user {user_data}: {exc}")
-    
-    if commit:
-        try:
+            users.append(User(**row))
+        
+        create_user_profiles([u.id for u in users], session)
+        if commit:
             session.commit()
             
-        except Exception as exc:
-            print(f"Commit error: {exc}")
-            session.rollback()
-    session.close()
+    except Exception as exc:
+        print(f"Commit error: {exc}")
+        session.rollback()
+        users = []
+        if raise_errors:
+            raise
+    finally:
+        session.close()
             
     return users
 
-def create_teams(team_data_list, casino_id, commit=True):
+def create_teams(team_data_list, casino_id, commit=True, raise_errors=False):
     teams = []
     session = get_casino_db_session(casino_id)
-    schema = TeamSchema()
     
-    for team_data in team_data_list:
-        try:
-            team_data["id"] = generate_unique_id(session, Team)
-            team_data_upper = uppercase_dict(team_data)
-            validated_data = schema.load(team_data_upper, session=session)
-            t = Team(**validated_data)
-            
-            existing_team = session.query(Team).filter((Team.name == t.name) & (Team.sport == t.sport)).first()
-            if existing_team:
-                print(f"Duplicate team detected with name {t.name} and sport {t.sport} , skipping.")
+    try:
+        ids = generate_unique_ids(session, Team, len(team_data_list))
+        rows = validate_batch(team_data_list, TeamSchema(), ids, session, "team")
+        
+        #team names are unique, a conflicting row is a team that already exists
+        inserted = set(insert_ignoring_conflicts(session, Team.__table__, rows))
+        for row in rows:
+            if row["id"] not in inserted:
+                print(f"Duplicate team detected with name {row.get('name')} and sport {row.get('sport')} , skipping.")
                 continue
-            session.add(t)
-            teams.append(t)
-    
-        except Exception as exc:
-            print(f"Validation error for team {team_data}: {exc}")
-    
-    if commit:
-        try:
+            teams.append(Team(**row))
+        
+        if commit:
             session.commit()
             
-        except Exception as exc:
-            print(f"Commit error: {exc}")
-            session.rollback()
-    session.close()
+    except Exception as exc:
+        print(f"Commit error: {exc}")
+        session.rollback()
+        teams = []
+        if raise_errors:
+            raise
+    finally:
+        session.close()
             
     return teams
     
-def create_events(event_data_list, casino_id, commit=True):
+def create_events(event_data_list, casino_id, commit=True, raise_errors=False):
     events = []
     session = get_casino_db_session(casino_id)
-    schema = EventSchema()
-    
-    for event_data in event_data_list:
-        try:
-            event_data["id"] = generate_unique_id(session, Event)
-            event_data_upper = uppercase_dict(event_data)
-            validated_data = schema.load(event_data_upper, session=session)
-            e = Event(**validated_data) 
-                    
-            home_team = session.query(Team).filter_by(name=e.home_team).first()
-            away_team = session.query(Team).filter_by(name=e.away_team).first()
-    
-            if home_team:
-                e.teams.append(home_team)
-            if away_team:
-                e.teams.append(away_team)
     
-            events.append(e)
-            session.add(e)
-    
-        except Exception as exc:
-            print(f"Validation error for event {event_data}: {exc}")
-            
-    if commit:
-        try:
+    try:
+        ids = generate_unique_ids(session, Event, len(event_data_list))
+        rows = validate_batch(event_data_list, EventSchema(), ids, session, "event")
+        
+        #one lookup for the teams of the whole batch instead of two per event
+        names = {row[side] for row in rows for side in ("home_team", "away_team")}
+        team_ids = dict(session.query(Team.name, Team.id).filter(Team.name.in_(names)).all()) if names else {}
+        
+        inserted = set(insert_ignoring_conflicts(session, Event.__table__, rows))
+        events = [Event(**row) for row in rows if row["id"] in inserted]
+        links = [{"event_id": e.id, "team_id": team_ids[name]}
+                 for e in events for name in (e.home_team, e.away_team) if name in team_ids]
+        insert_ignoring_conflicts(session, event_teams, links, returning="event_id")
+        
+        if commit:
             session.commit()
+            refresh_event_catalog(casino_id, [catalog_row(e) for e in events], written_at=time.time())
             
-        except Exception as exc:
-            print(f"Commit error: {exc}")
-            session.rollback()
-            
-    session.close()
+    except Exception as exc:
+        print(f"Commit error: {exc}")
+        session.rollback()
+        events = []
+        if raise_errors:
+            raise
+    finally:
+        session.close()
         
     return events
         
-def create_purchased_coupons(coupon_data_list, casino_id, session=None, commit=True):
+def bump_purchase_counts(session, purchases):
+    #one UPDATE for the batch instead of an ORM increment per coupon
+    if session.get_bind().dialect.name == "postgresql":
+        counts = values(column("user_id", BigInteger), column("purchases", Integer), name="counts")\
+            .data(list(purchases.items()))
+        statement = update(UserProfile.__table__)\
+            .where(UserProfile.user_id == counts.c.user_id)\
+            .values(purchases_at_last_update=UserProfile.purchases_at_last_update + counts.c.purchases)
+    else:
+        #SQLite cannot name the columns of a VALUES list, a CASE keeps it one statement
+        statement = update(UserProfile.__table__)\
+            .where(UserProfile.user_id.in_(purchases))\
+            .values(purchases_at_last_update=UserProfile.purchases_at_last_update
+                    + case(purchases, value=UserProfile.user_id, else_=0))
+    session.execute(statement)
+
+def create_purchased_coupons(coupon_data_list, casino_id, session=None, commit=True, raise_errors=False):
     coupons = []
+    validated_coupons = []
     close_session = False
     
     if session is None:
         session = get_casino_db_session(casino_id)
         close_session = True
-        
-    schema = PurchasedCouponSchema()
     
-    for coupon_data in coupon_data_list:
-        try:
-            user_id = coupon_data.get("user_id")
-            profile = session.query(UserProfile).filter_by(user_id=user_id).first()
-            if not profile:
-                raise ValueError(f"User profile not found for user_id {user_id}")
-                
-            coupon_data["id"] = generate_unique_id(session, PurchasedCoupon)
-            coupon_data_upper = uppercase_dict(coupon_data)
-            validated_data = schema.load(coupon_data_upper, session=session)
-            coupon = PurchasedCoupon(**validated_data)
-            
-            profile.purchases_at_last_update += 1
-
-            session.add(coupon)
-            coupons.append(coupon)
-
-        except Exception as exc:
-            print(f"Validation error for coupon {coupon_data}: {exc}")
-
-    if commit and coupons:
-        try:
-            session.commit()
-        except Exception as exc:
-            print(f"Commit error: {exc}")
-            session.rollback()
+    try:
+        ids = generate_unique_ids(session, PurchasedCoupon, len(coupon_data_list))
+        rows = validate_batch(coupon_data_list, PurchasedCouponSchema(), ids, session, "coupon")
+        
+        #one IN query for the profiles of the whole batch
+        user_ids = {validated_data["user_id"] for validated_data in rows}
+        profiled = set(session.scalars(select(UserProfile.user_id).where(UserProfile.user_id.in_(user_ids)))) \
+            if user_ids else set()
+        
+        for validated_data in rows:
+            if validated_data["user_id"] not in profiled:
+                print(f"Validation error for coupon {validated_data}: User profile not found for user_id {validated_data['user_id']}")
+                continue
+            validated_coupons.append(validated_data)
+        
+        if validated_coupons:
+            #a list of parameter sets goes out as multi-row INSERTs (insertmanyvalues)
+            session.execute(insert(PurchasedCoupon), validated_coupons)
+            purchases = Counter(validated_data["user_id"] for validated_data in validated_coupons)
+            bump_purchase_counts(session, purchases)
+            coupons = [PurchasedCoupon(**validated_data) for validated_data in validated_coupons]
+            update_user_affinities(session, validated_coupons)
+            record_coupon_events(session, coupons)
+            #rows computed before these purchases would be served until they age out
+            session.query(PrecomputedRecommendation)\
+                .filter(PrecomputedRecommendation.user_id.in_(purchases))\
+                .delete(synchronize_session=False)
+            if commit:
+                session.commit()
+    except Exception as exc:
+        print(f"Commit error: {exc}")
+        session.rollback()
+        coupons = []
+        #the Kafka consumer must not commit the offsets of coupons that were never stored
+        if raise_errors:
+            if close_session:
+                session.close()
+            raise
+
+    if coupons:
+        #other processes notice the purchase through purchase_version
+        recommendation_cache.invalidate(casino_id, [coupon_data["user_id"] for coupon_data in validated_coupons])
 
     if close_session:
         session.close()
@@ -209,43 +286,52 @@ def register_recommendation(name):
         return func
     return wrapper
 
-def get_all_sport_league_tuples(casino_id):
+@contextmanager
+def tenant_session(casino_id, session=None):
+    #borrows the caller's request-scoped session, otherwise opens one and closes it afterwards
+    if session is not None:
+        yield session
+        return
+    
     session = get_casino_db_session(casino_id)
-
     try:
-        events = session.query(Event.sport, Event.league).distinct().all()
+        yield session
+    finally:
+        session.close()
+
+def get_all_sport_league_tuples(casino_id, session=None):
+    with tenant_session(casino_id, session) as session:
+        events = session.query(Event.sport, Event.league).filter(*active_event_filter()).distinct().all()
         
         result = []
         for event in events:
             sport = event[0]
             league = event[1]
             result.append((sport, league))    
-    finally:
-       session.close()
+    return result
+
+def cold_start_pairs(casino_id, session, catalog, limit, exclude=()):
+    #trending (sport, league) pairs first, random pairs of the catalog when there are not enough
+    exclude = set(exclude)
+    result = [pair for pair, _ in get_trending_scores(casino_id, session).top_pairs() if pair not in exclude][:limit]
+    
+    if len(result) < limit:
+        available_pairs = list(set(catalog.sport_league_pairs()) - exclude - set(result))
+        remaining = min(limit - len(result), len(available_pairs))
+        if remaining > 0:
+            result.extend(random.sample(available_pairs, k=remaining))
     return result
 
 @register_recommendation("inference")
-def inference_recommendation(user_id, casino_id, event_limit=3, delta_days=30):
+def inference_recommendation(user_id, casino_id, event_limit=3, delta_days=30, session=None):
     threshold = 5
-    session = get_casino_db_session(casino_id)
 
-    try:
+    with tenant_session(casino_id, session) as session:
+        catalog = get_event_catalog(casino_id, session)
         profile = session.query(UserProfile).filter_by(user_id=user_id).first()
         
-        #Extract (sport, league) tuples directly from coupons
-        coupons = session.query(PurchasedCoupon)\
-            .filter_by(user_id=user_id)\
-            .filter(PurchasedCoupon.timestamp >= (datetime.utcnow() - timedelta(days=delta_days)).isoformat())\
-            .options(load_only(PurchasedCoupon.recommended_events))\
-            .all()
-        
-        user_sport_league = []
-        for coupon in coupons:
-            for event in coupon.recommended_events:
-                sport = event.get("sport")
-                league = event.get("league")
-                if sport and league:
-                    user_sport_league.append((sport, league))
+        #(sport, league) counts of the last delta_days, grouped in SQL from the user's coupon legs
+        pair_counts = user_sport_league_counts(session, user_id, delta_days)
                     
         if not profile:
             create_user_profile(user_id, session=session)
@@ -259,11 +345,10 @@ def inference_recommendation(user_id, casino_id, event_limit=3, delta_days=30):
                 result.append(tuple(item))
             sport_league_tuples = result[:event_limit]
         else:
-            #If no coupon history, pick random tuples
-            if not user_sport_league:
-                sport_league_tuples = random.sample(get_all_sport_league_tuples(casino_id), k=event_limit)
+            #If no coupon history, pick the casino's trending tuples
+            if not pair_counts:
+                sport_league_tuples = cold_start_pairs(casino_id, session, catalog, event_limit)
             else:
-                pair_counts = Counter(user_sport_league)
                 result = []
 
                 #Add pairs that appear more than once
@@ -277,14 +362,9 @@ def inference_recommendation(user_id, casino_id, event_limit=3, delta_days=30):
                         if count == 1 and len(result) < event_limit:
                             result.append(pair)
 
-                #Fill remaining with random choices
+                #Fill remaining with trending choices
                 if len(result) < event_limit:
-                    all_pairs = get_all_sport_league_tuples(casino_id)
-                    available_pairs = list(set(all_pairs) - set(result))
-                    remaining = event_limit - len(result)
-                    remaining = min(remaining, len(available_pairs))
-                    if remaining > 0:
-                        result.extend(random.sample(available_pairs, k=remaining))
+                    result.extend(cold_start_pairs(casino_id, session, catalog, event_limit - len(result), exclude=result))
 
                 sport_league_tuples = result
 
@@ -292,40 +372,24 @@ def inference_recommendation(user_id, casino_id, event_limit=3, delta_days=30):
             if profile and (not profile.favorite_sport_league_json or profile.purchases_at_last_update >= threshold):
                 profile.favorite_sport_league_json = json.dumps(sport_league_tuples[:20])
                 profile.purchases_at_last_update = 0
-                profile.last_updated = datetime.utcnow().isoformat()
+                profile.last_updated = datetime.utcnow()
                 session.commit()
 
         all_events = []
-        event_data = []
         counter = 0
 
         while len(all_events) < event_limit and counter < len(sport_league_tuples):
             infer_sport, infer_league = sport_league_tuples[counter]
 
-            query = session.query(Event).filter_by(sport=infer_sport, league=infer_league)
-            events = query.limit(event_limit - len(all_events)).all()
-            all_events.extend(events)
+            all_events.extend(catalog.pair_positions(infer_sport, infer_league, limit=event_limit - len(all_events)))
             counter += 1
         
         #fill the rest with random events, ignores duplicates
         if len(all_events) < event_limit:
             remaining = event_limit - len(all_events)
-            existing_ids = {getattr(e, "id", None) for e in all_events}
-            random_events = session.query(Event).filter(~Event.id.in_(existing_ids)).limit(remaining).all()
-            all_events.extend(random_events)
-
-        for e in all_events:
-            event_data.append({
-                "country":  e.country,
-                "league":   e.league,
-                "home_team": e.home_team,
-                "away_team": e.away_team,
-                "sport":   e.sport,
-                "odd":     e.odd
-            })
+            all_events.extend(catalog.random_positions(remaining, exclude=all_events))
 
-    finally:
-        session.close()
+        event_data = [catalog.event_data(position) for position in all_events]
 
     return {
         "user_id": user_id,
@@ -335,119 +399,28 @@ def inference_recommendation(user_id, casino_id, event_limit=3, delta_days=30):
     }
 
 @register_recommendation("inference_score")
-def inference_score_recommendation(user_id, casino_id, event_limit=3):
-    session = get_casino_db_session(casino_id)
-    score_list = []
-    
-    try:
-        user = session.query(User).filter_by(id=user_id).first()
+def inference_score_recommendation(user_id, casino_id, event_limit=3, session=None):
+    with tenant_session(casino_id, session) as session:
+        #served from the identity map when the route already loaded the user
+        user = session.get(User, user_id)
         if not user:
             raise ValueError(f"User {user_id} not found in casino {casino_id}")
             
-        coupons = session.query(PurchasedCoupon).filter_by(user_id=user_id)\
-            .options(load_only(PurchasedCoupon.recommended_events)).all()
-        
-        top_sports, top_leagues, top_countries = [], [], []
-        top_home_teams, top_away_teams = [], []
+        top_values = top_affinity_values(get_user_affinity(session, user_id))
         
-        if coupons:
-            coupon_events_sports, coupon_events_league, coupon_events_country = [], [], []
-            coupon_events_home_team, coupon_events_away_team = [], []
-            
-            for coupon in coupons:
-                for event in coupon.recommended_events:
-                    coupon_events_sports.append(event.get("sport"))
-                    coupon_events_league.append(event.get("league"))
-                    coupon_events_country.append(event.get("country"))
-                    coupon_events_home_team.append(event.get("home_team"))
-                    coupon_events_away_team.append(event.get("away_team"))
-            
-                                
-            for item in Counter(coupon_events_sports).most_common(2):
-                if item[0]:
-                    top_sports.append(item[0])
-            
-            for item in Counter(coupon_events_league).most_common(2):
-                if item[0]:
-                    top_leagues.append(item[0])
-            
-            for item in Counter(coupon_events_country).most_common(2):
-                if item[0]:
-                    top_countries.append(item[0])
-            
-            for item in Counter(coupon_events_home_team).most_common(2):
-                if item[0]:
-                    top_home_teams.append(item[0])
-            
-            for item in Counter(coupon_events_away_team).most_common(2):
-                if item[0]:
-                    top_away_teams.append(item[0])
-
-            
-        events = session.query(Event).all()
-        if not events:
-           raise ValueError("No available events in the system.")
-           
-        for event in events:
-            score = 0
-            if event.country in user.country:
-                score += 1
-            if event.sport in user.favorite_sport:
-                score += 1
-            if event.country in top_countries[:1]:
-                score += 2
-            elif event.country in top_countries[1:2]:
-                score += 1
-            if event.sport in top_sports[:1]:
-                score += 2
-            elif event.sport in top_sports[1:2]:
-                score += 1
-            if event.league in top_leagues[:1]:
-                score += 3
-            elif event.league in top_leagues[1:2]:
-                score += 2
-            if event.home_team in top_home_teams[:1]:
-                score += 4
-            elif event.home_team in top_home_teams[1:2]:
-                score += 3
-            if event.away_team in top_away_teams[:1]:
-                score += 4
-            elif event.away_team in top_away_teams[1:2]:
-                score += 3
-
-                
-            score_list.append((event.id,
-                               event.country,
-                               event.begin_timestamp,
-                               event.end_timestamp,
-                               event.league,
-                               event.sport,
-                               event.odd,
-                               event.home_team,
-                               event.away_team,
-                               score))
-            
-        # Handle empty or low-score case
-        if not score_list:
-            top_events = random.sample(events, k=min(event_limit, len(events)))
+        if Config.INFERENCE_SCORE_MODE == "stream":
+            #only the scored columns, fetched in batches, peak memory stays O(event_limit)
+            rows = session.query(Event.country, Event.league, Event.sport, Event.odd, Event.home_team, Event.away_team)\
+                .filter(*active_event_filter()).order_by(Event.id).execution_options(yield_per=Config.INFERENCE_SCORE_STREAM_BATCH)
+            event_data = stream_top_events(rows, user, top_values, event_limit)
+            if event_limit > 0 and not event_data:
+                raise ValueError("No available events in the system.")
         else:
-            sorted_score_list = sorted(score_list, key=lambda x: x[-1], reverse=True)
-            
-            top_events = sorted_score_list[:event_limit]
-            
-        event_data = []
-        for e in top_events:
-            event_data.append({
-                "country": e[1],
-                "league": e[4],
-                "home_team": e[7],
-                "away_team": e[8],
-                "sport": e[5],
-                "odd": e[6],
-            })
+            catalog = get_event_catalog(casino_id, session)
+            if not catalog.live_count():
+               raise ValueError("No available events in the system.")
             
-    finally:
-        session.close()
+            event_data = catalog.top_events(user, top_values, event_limit)
     
     return {
         "user_id": user_id,
@@ -458,28 +431,72 @@ def inference_score_recommendation(user_id, casino_id, event_limit=3):
         
 
 @register_recommendation("dynamic")
-def dynamic_recommendation(user_id, casino_id, event_limit=3):
-    session = get_casino_db_session(casino_id)
-    try:
-        user = session.query(User).get(user_id)
+def dynamic_recommendation(user_id, casino_id, event_limit=3, session=None):
+    with tenant_session(casino_id, session) as session:
+        user = session.get(User, user_id)
         if not user:
             raise ValueError(f"User {user_id} not found in casino {casino_id}")
 
-        events = session.query(Event).filter_by(sport=user.favorite_sport).limit(event_limit).all()
-        event_data = []
-
-        for e in events:
-            event_data.append({
-                "country":  e.country,
-                "league":   e.league,
-                "home_team": e.home_team,
-                "away_team": e.away_team,
-                "sport":   e.sport,
-                "odd":     e.odd
-            })
-    finally:
-        session.close()
+        catalog = get_event_catalog(casino_id, session)
+        positions = catalog.filter_positions(limit=event_limit, sport=user.favorite_sport)
+        event_data = [catalog.event_data(position) for position in positions]
+
+    return {
+        "user_id": user_id,
+        "stake": round(random.uniform(1.5, 50.5), 2),
+        "recommended_events": event_data,
+        "timestamp": datetime.utcnow().isoformat(),
+    }
+
+@register_recommendation("collaborative")
+def collaborative_recommendation(user_id, casino_id, event_limit=3, session=None):
+    model = load_collaborative_model(casino_id)
+    if model is None or model.user_row(user_id) is None:
+        #users without coupons at training time have no factors yet
+        return inference_score_recommendation(user_id, casino_id, event_limit=event_limit, session=session)
+    
+    with tenant_session(casino_id, session) as session:
+        catalog = get_event_catalog(casino_id, session)
+        
+    scores = model.score_events(user_id, catalog)
+    event_data = [catalog.event_data(position) for position in catalog.top_positions(scores, event_limit)]
+    
+    return {
+        "user_id": user_id,
+        "stake": round(random.uniform(1.5, 50.5), 2),
+        "recommended_events": event_data,
+        "timestamp": datetime.utcnow().isoformat(),
+    }
 
+@register_recommendation("cooccurrence")
+def cooccurrence_recommendation(user_id, casino_id, event_limit=3, session=None):
+    with tenant_session(casino_id, session) as tenant:
+        picks = recent_picks(tenant, user_id)
+        catalog = get_event_catalog(casino_id, tenant)
+        cooccurrence = get_cooccurrence_matrix(casino_id, tenant)
+    
+    scores = cooccurrence.score_events(picks, catalog) if picks else None
+    if scores is None:
+        #no coupons yet, or picks that never appeared together with anything else
+        return inference_score_recommendation(user_id, casino_id, event_limit=event_limit, session=session)
+        
+    event_data = [catalog.event_data(position) for position in catalog.top_positions(scores, event_limit)]
+    
+    return {
+        "user_id": user_id,
+        "stake": round(random.uniform(1.5, 50.5), 2),
+        "recommended_events": event_data,
+        "timestamp": datetime.utcnow().isoformat(),
+    }
+
+@register_recommendation("trending")
+def trending_recommendation(user_id, casino_id, event_limit=3, session=None):
+    with tenant_session(casino_id, session) as session:
+        catalog = get_event_catalog(casino_id, session)
+        trending = get_trending_scores(casino_id, session)
+    
+    event_data = [catalog.event_data(position) for position in trending_positions(catalog, trending, event_limit)]
+    
     return {
         "user_id": user_id,
         "stake": round(random.uniform(1.5, 50.5), 2),
@@ -488,7 +505,7 @@ def dynamic_recommendation(user_id, casino_id, event_limit=3):
     }
 
 @register_recommendation("static")
-def static_recommendation(user_id, casino_id, event_limit = 3):
+def static_recommendation(user_id, casino_id, event_limit = 3, session=None):
     event_data = [
         {
           "country":  "ITALY",
@@ -523,7 +540,71 @@ def static_recommendation(user_id, casino_id, event_limit = 3):
         "timestamp": datetime.utcnow().isoformat(),
     }
 
-def recommendation_generator(config, casino_id, user_id):
+def latest_precompute_run(casino_id):
+    #newest generated_at of the casino, read in its own session at most every PRECOMPUTE_RUN_CHECK_SECONDS
+    now = time.monotonic()
+    with precompute_runs_lock:
+        checked = precompute_runs.get(casino_id)
+        if checked and now - checked[0] < Config.PRECOMPUTE_RUN_CHECK_SECONDS:
+            return checked[1]
+    
+    session = get_casino_db_session(casino_id)
+    try:
+        newest = session.scalar(select(func.max(PrecomputedRecommendation.generated_at)))
+    except SQLAlchemyError:
+        #casino databases created before the table existed
+        newest = None
+    finally:
+        session.close()
+    
+    with precompute_runs_lock:
+        precompute_runs[casino_id] = (now, newest)
+    return newest
+
+def get_precomputed_recommendation(casino_id, user_id, recommender_type, session=None, version=None):
+    if Config.PRECOMPUTED_MAX_AGE_SECONDS <= 0:
+        return None
+    
+    #no lookup per request for casinos without a recent precompute run
+    oldest = datetime.utcnow() - timedelta(seconds=Config.PRECOMPUTED_MAX_AGE_SECONDS)
+    newest = latest_precompute_run(casino_id)
+    if newest is None or newest < oldest:
+        return None
+    
+    with tenant_session(casino_id, session) as tenant:
+        try:
+            #a savepoint, a failed lookup must not expire what the caller already loaded
+            with tenant.begin_nested():
+                row = tenant.get(PrecomputedRecommendation, user_id)
+        except SQLAlchemyError:
+            return None
+        
+    if not row or row.recommender_type != recommender_type:
+        return None
+    
+    if row.generated_at < oldest:
+        return None
+    
+    #computed before a purchase the precompute worker did not see
+    if version is not None and row.coupons_count != version:
+        return None
+    
+    return row.recommendation
+
+def purchase_version(casino_id, user_id, session=None):
+    #coupons_count grows in the transaction that stores a purchase, whichever process ingested it
+    with tenant_session(casino_id, session) as tenant:
+        count = tenant.scalar(select(UserAffinity.coupons_count).where(UserAffinity.user_id == user_id))
+    return count or 0
+
+def purchase_versions(casino_id, user_ids, session=None):
+    #purchase_version of many users with one IN query, users without purchases are at 0
+    with tenant_session(casino_id, session) as tenant:
+        counts = dict(tenant.execute(select(UserAffinity.user_id, UserAffinity.coupons_count)
+                                     .where(UserAffinity.user_id.in_(user_ids))).all())
+    return {user_id: counts.get(user_id) or 0 for user_id in user_ids}
+
+def recommendation_generator(config, casino_id, user_id, session=None):
     recommendation_schema = config["recommendation_schema"]
     recommender_type = config["recommender_type"]
     
@@ -534,7 +615,14 @@ def recommendation_generator(config, casino_id, user_id):
        
     recommender_func = recommender_registry[recommender_type]
     
-    full_data = recommender_func(user_id=user_id, casino_id=casino_id)
+    version = purchase_version(casino_id, user_id, session=session)
+    full_data = recommendation_cache.get(casino_id, user_id, recommender_type, version)
+    if full_data is None:
+        full_data = get_precomputed_recommendation(casino_id, user_id, recommender_type, session=session,
+                                                   version=version)
+        if full_data is None:
+            full_data = recommender_func(user_id=user_id, casino_id=casino_id, session=session)
+        recommendation_cache.set(casino_id, user_id, recommender_type, full_data, version)
     
     recommendation = {}
         
@@ -567,9 +655,6 @@ def populate_db():
     for casino in created_casinos:
         casino_id = casino.id
 
-        
-        create_db_per_casino(casino_id)
-
         users = create_users(dummy_users, casino_id=casino_id)
         teams = create_teams(dummy_teams, casino_id=casino_id)
         events = create_events(dummy_events, casino_id=casino_id)
@@ -0,0 +1,214 @@
+import math
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+from app.config import Config
+from app.db_models_shared import PurchasedCoupon
+from app.coupon_events import latest_leg_id, written_up_to, follow_coupons
+from app.utils import KeyedLocks, get_casino_db_session
+
+#forward-decay weights are rebased once exp(rate * age) would exceed e**REBASE_EXPONENT
+REBASE_EXPONENT = 30.0
+#decayed scores below this are dropped at rebase time
+PRUNE_SCORE = 1e-3
+
+trending_scores = {}
+#held while a casino's scores are built, other casinos are never blocked by it
+rebuild_locks = KeyedLocks()
+
+def coupon_time(timestamp):
+    if not isinstance(timestamp, datetime):
+        try:
+            timestamp = datetime.fromisoformat(timestamp)
+        except (TypeError, ValueError):
+            return time.time()
+    #stored timestamps are naive UTC, .timestamp() alone would read them as local time
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+class DecayedCounter:
+    """Exponentially decayed counts in forward-decay form, with the top_n keys kept sorted."""
+
+    def __init__(self, half_life_seconds, top_n, landmark=None):
+        self.rate = math.log(2) / half_life_seconds
+        self.top_n = top_n
+        self.landmark = time.time() if landmark is None else landmark
+        self.weights = {}
+        self.top = []
+
+    def add(self, key, at, amount=1.0):
+        #decaying every key by the same factor never changes their order, so only the added key can move
+        exponent = self.rate * (at - self.landmark)
+        if exponent > REBASE_EXPONENT:
+            self.rebase(at)
+            exponent = 0.0
+
+        weight = self.weights.get(key, 0.0) + amount * math.exp(exponent)
+        self.weights[key] = weight
+
+        if key in self.top:
+            self.top.sort(key=self.weights.__getitem__, reverse=True)
+        elif len(self.top) < self.top_n:
+            self.top.append(key)
+            self.top.sort(key=self.weights.__getitem__, reverse=True)
+        elif weight > self.weights[self.top[-1]]:
+            self.top[-1] = key
+            self.top.sort(key=self.weights.__getitem__, reverse=True)
+
+    def rebase(self, at):
+        factor = math.exp(-self.rate * (at - self.landmark))
+        self.weights = {key: weight * factor for key, weight in self.weights.items() if weight * factor >= PRUNE_SCORE}
+        self.top = [key for key in self.top if key in self.weights]
+        self.landmark = at
+
+    def most_common(self, n=None, at=None):
+        at = time.time() if at is None else at
+        factor = math.exp(-self.rate * (at - self.landmark))
+        return [(key, self.weights[key] * factor) for key in self.top[:n]]
+
+    def __len__(self):
+        return len(self.weights)
+
+class TrendingScores:
+    """Decayed popularity of events and (sport, league) pairs of one casino."""
+
+    def __init__(self, casino_id, half_life_seconds=None, top_n=None):
+        half_life_seconds = half_life_seconds or Config.TRENDING_HALF_LIFE_HOURS * 3600
+        top_n = top_n or Config.TRENDING_TOP_N
+        self.casino_id = casino_id
+        self.events = DecayedCounter(half_life_seconds, top_n)
+        self.pairs = DecayedCounter(half_life_seconds, top_n)
+        self.lock = threading.Lock()
+        self.built_at = time.time()
+        #coupon_events id up to which coupons are counted, and when newer legs were last read
+        self.last_leg_id = 0
+        self.caught_up_at = self.built_at
+
+    def add_coupon(self, recommended_events, timestamp):
+        at = coupon_time(timestamp)
+        with self.lock:
+            for event in recommended_events or []:
+                sport, league = event.get("sport"), event.get("league")
+                if not sport or not league:
+                    continue
+                self.pairs.add((sport, league), at)
+                self.events.add((sport, league, event.get("home_team"), event.get("away_team")), at)
+
+    def top_events(self, n=None):
+        with self.lock:
+            return self.events.most_common(n)
+
+    def top_pairs(self, n=None):
+        with self.lock:
+            return self.pairs.most_common(n)
+
+    def is_stale(self):
+        return time.time() - self.built_at >= Config.TRENDING_REBUILD_SECONDS
+
+    def is_behind(self):
+        return time.time() - self.caught_up_at >= Config.TRENDING_CATCHUP_SECONDS
+
+    def stats(self):
+        with self.lock:
+            return {
+                "casino_id": self.casino_id,
+                "events": len(self.events),
+                "pairs": len(self.pairs),
+                "top_pairs": [[sport, league, round(score, 3)] for (sport, league), score in self.pairs.most_common(5)],
+                "seconds_since_build": round(time.time() - self.built_at, 3),
+            }
+
+def build_trending_scores(casino_id, session, batch_size=1000):
+    trending = TrendingScores(casino_id)
+    #coupons written while the build runs are left to the catch-up, so none is counted twice
+    trending.last_leg_id = latest_leg_id(session)
+    #older coupons would have decayed below PRUNE_SCORE anyway
+    cutoff = datetime.utcnow() - timedelta(days=Config.TRENDING_WINDOW_DAYS)
+    query = session.query(PurchasedCoupon.timestamp, PurchasedCoupon.recommended_events)\
+        .filter(PurchasedCoupon.timestamp >= cutoff, written_up_to(trending.last_leg_id))
+    for timestamp, recommended_events in query.yield_per(batch_size):
+        trending.add_coupon(recommended_events, timestamp)
+    return trending
+
+def rebuild_trending_scores(casino_id):
+    #runs in a background thread with its own session, requests keep the previous scores meanwhile
+    lock = rebuild_locks(casino_id)
+    if not lock.acquire(blocking=False):
+        return
+    try:
+        session = get_casino_db_session(casino_id)
+        try:
+            trending_scores[casino_id] = build_trending_scores(casino_id, session)
+        finally:
+            session.close()
+    except Exception as exc:
+        print(f"Trending rebuild error for casino {casino_id}: {exc}")
+    finally:
+        lock.release()
+
+def catch_up_trending_scores(casino_id):
+    #adds the coupons other processes wrote since the scores were built or last caught up
+    lock = rebuild_locks(casino_id)
+    if not lock.acquire(blocking=False):
+        return
+    try:
+        trending = trending_scores.get(casino_id)
+        if trending is None:
+            return
+        session = get_casino_db_session(casino_id)
+        try:
+            trending.last_leg_id = follow_coupons(session, trending.last_leg_id, trending.add_coupon)
+        finally:
+            session.close()
+    except Exception as exc:
+        print(f"Trending catch-up error for casino {casino_id}: {exc}")
+    finally:
+        lock.release()
+
+def start_rebuild(casino_id, target=rebuild_trending_scores):
+    if not rebuild_locks(casino_id).locked():
+        threading.Thread(target=target, args=(casino_id,), daemon=True).start()
+
+def get_trending_scores(casino_id, session):
+    trending = trending_scores.get(casino_id)
+
+    if trending is None:
+        #until the first build is done the casino has no trending keys and callers fill with random picks
+        trending = TrendingScores(casino_id)
+        start_rebuild(casino_id)
+    elif trending.is_stale():
+        start_rebuild(casino_id)
+    elif trending.is_behind():
+        #the Kafka consumer writes most coupons, the scores follow their coupon_events rows
+        trending.caught_up_at = time.time()
+        start_rebuild(casino_id, target=catch_up_trending_scores)
+
+    return trending
+
+def get_trending_stats(casino_id=None):
+    if casino_id is not None:
+        trending = trending_scores.get(casino_id)
+        return trending.stats() if trending else None
+    return [trending.stats() for trending in trending_scores.values()]
+
+def trending_positions(catalog, trending, limit):
+    #trending fixtures first, then events of trending (sport, league) pairs, then random events
+    positions = []
+    for (sport, league, home_team, away_team), _ in trending.top_events():
+        if len(positions) >= limit:
+            break
+        for position in catalog.fixture_positions(sport, league, home_team, away_team):
+            if position not in positions:
+                positions.append(position)
+
+    for (sport, league), _ in trending.top_pairs():
+        if len(positions) >= limit:
+            break
+        for position in catalog.pair_positions(sport, league, limit=limit + len(positions)):
+            if position not in positions and len(positions) < limit:
+                positions.append(position)
+
+    if len(positions) < limit:
+        positions.extend(catalog.random_positions(limit - len(positions), exclude=positions))
+    return positions[:limit]
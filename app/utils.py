@@ -1,27 +1,97 @@
 from datetime import datetime, timedelta
-import uuid, random
+from collections import OrderedDict
+import uuid, random, json, time, threading
 from faker import Faker
 from app import db
 from app.config import Config
 from app.db_models_shared import User
 from app.db_models_master import Casino
-from random import randint
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 import psycopg2
 from app.db_models_shared import SharedBase  
+from app.migrations import migrate_tenant_db, tenant_schema
 
 fake = Faker()
-db_engine_cache = {}
 cached_casino_ids = None
+template_ready = False
+template_lock = threading.Lock()
 cached_user_ids = None
 
+#ids used to be random numbers up to 1_000_000, sequences start above them
+ID_SEQUENCE_START = 1_000_001
+
+class KeyedLocks:
+    """One lock per key, created on first use; the shared lock only guards the dict."""
+
+    def __init__(self):
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, key):
+        with self.lock:
+            lock = self.locks.get(key)
+            if lock is None:
+                lock = self.locks[key] = threading.Lock()
+            return lock
+
+class IdAllocator:
+    """Ids of every table handed out from blocks reserved with one nextval, per database and per process."""
+
+    def __init__(self, block_size):
+        self.block_size = block_size
+        self.blocks = {}
+        self.increments = {}
+        #one lock per (database, sequence): a nextval or a first-use CREATE SEQUENCE only blocks callers of that table
+        self.locks = KeyedLocks()
+
+    def sequence_name(self, bind, table):
+        schema = tenant_schema(bind)
+        return f'"{schema}".{table}_id_blocks' if schema else f"{table}_id_blocks"
+
+    def ensure_sequence(self, bind, sequence):
+        #on its own connection, so the caller's transaction never rolls it back
+        with bind.connect() as connection:
+            connection.execute(text(f"CREATE SEQUENCE IF NOT EXISTS {sequence} AS BIGINT "
+                                    f"START WITH {ID_SEQUENCE_START} INCREMENT BY {self.block_size}"))
+            #a sequence created with another block size keeps its own increment
+            increment = connection.execute(text(f"SELECT seqincrement FROM pg_sequence WHERE seqrelid = '{sequence}'::regclass")).scalar()
+            connection.commit()
+        return increment
+
+    def reserve(self, session, key, sequence):
+        increment = self.increments.get(key)
+        if increment is None:
+            increment = self.ensure_sequence(session.get_bind(), sequence)
+            self.increments[key] = increment
+        #nextval is never rolled back, a block is never handed out twice
+        start = session.execute(text(f"SELECT nextval('{sequence}')")).scalar()
+        return [start, start + increment]
+
+    def next_ids(self, session, Model, count):
+        bind = session.get_bind()
+        sequence = self.sequence_name(bind, Model.__tablename__)
+        key = (str(bind.url), sequence)
+        ids = []
+        
+        with self.locks(key):
+            while len(ids) < count:
+                block = self.blocks.get(key)
+                if block is None or block[0] >= block[1]:
+                    block = self.reserve(session, key, sequence)
+                    self.blocks[key] = block
+                take = min(count - len(ids), block[1] - block[0])
+                ids.extend(range(block[0], block[0] + take))
+                block[0] += take
+        return ids
+
+id_allocator = IdAllocator(Config.ID_BLOCK_SIZE)
+
 def generate_unique_id(session, Model):
-    while True :
-        candidate_id = randint(1, 1_000_000)
-        exists = session.query(Model.id).filter_by(id=candidate_id).first()
-        if not exists:
-            return candidate_id
+    return id_allocator.next_ids(session, Model, 1)[0]
+
+def generate_unique_ids(session, Model, count):
+    return id_allocator.next_ids(session, Model, count)
         
 def get_random_casino_id():
     global cached_casino_ids 
@@ -61,10 +131,30 @@ def get_random_user_id(casino_id):
         print("No user IDs available.")
         return None
     
-def create_db_per_casino(casino_id):
-    db_name = f"casino_{casino_id}"
-    db_url = f"postgresql://{Config.POSTGRES_USER}:{Config.POSTGRES_PASSWORD}@{Config.POSTGRES_HOST}:{Config.POSTGRES_PORT}/{db_name}"
+def database_url(db_name):
+    return f"postgresql://{Config.POSTGRES_USER}:{Config.POSTGRES_PASSWORD}@{Config.POSTGRES_HOST}:{Config.POSTGRES_PORT}/{db_name}"
+
+def casino_db_url(casino_id):
+    return database_url(f"casino_{casino_id}")
+
+def casino_schema(casino_id):
+    return f"casino_{casino_id}"
+
+def schema_db_url():
+    return f"postgresql://{Config.POSTGRES_USER}:{Config.POSTGRES_PASSWORD}@{Config.POSTGRES_HOST}:{Config.POSTGRES_PORT}/{Config.TENANT_SCHEMA_DATABASE}"
 
+def create_schema_per_casino(casino_id):
+    schema = casino_schema(casino_id)
+    engine = schema_tenants.engine(casino_id)
+    
+    with engine.begin() as connection:
+        connection.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{schema}"'))
+    SharedBase.metadata.create_all(engine)
+    print(f"Schema {schema} and its tables created.")
+    
+    return schema
+
+def create_database(db_name, template=None):
     connection = psycopg2.connect(
         user=Config.POSTGRES_USER,
         password=Config.POSTGRES_PASSWORD,
@@ -77,7 +167,10 @@ def create_db_per_casino(casino_id):
     try:
         cursor = connection.cursor()
         try:
-            cursor.execute(f"CREATE DATABASE {db_name}")
+            if template:
+                cursor.execute(f"CREATE DATABASE {db_name} TEMPLATE {template}")
+            else:
+                cursor.execute(f"CREATE DATABASE {db_name}")
             print(f"Database {db_name} created successfully.")
         except psycopg2.errors.DuplicateDatabase:
             print(f"Database {db_name} already exists.")
@@ -85,27 +178,271 @@ def create_db_per_casino(casino_id):
             cursor.close()
     finally:
         connection.close()
+
+def ensure_template_database():
+    global template_ready
+    
+    with template_lock:
+        template = Config.TENANT_TEMPLATE_DATABASE
+        if template_ready:
+            return template
         
-    engine = create_engine(db_url)
-    SharedBase.metadata.create_all(engine)
-    print(f"Tables created for {db_name}.")
+        create_database(template)
+        engine = create_engine(database_url(template))
+        try:
+            #also brings a template built by an older release up to the current models
+            migrate_tenant_db(engine)
+        finally:
+            #copying a template fails while anyone is connected to it
+            engine.dispose()
+        print(f"Template database {template} is up to date.")
+        
+        template_ready = True
+        return template
+
+def create_db_per_casino(casino_id):
+    if Config.TENANCY_MODE == "schema":
+        return create_schema_per_casino(casino_id)
+    
+    db_name = f"casino_{casino_id}"
+    #a file level copy of the template, tables and indexes included
+    create_database(db_name, template=ensure_template_database())
         
     return db_name
 
+def checked_out(engine):
+    #only queue pools count checked out connections
+    checkedout = getattr(engine.pool, "checkedout", None)
+    return checkedout() if callable(checkedout) else 0
+
+class ConnectionBudgetExceeded(Exception):
+    """Raised when no casino engine went idle in time to open another one within the budget; worth retrying."""
+
+#how often a request waiting for room in the connection budget looks again
+BUDGET_POLL_SECONDS = 0.05
+
+class TenantEngineManager:
+    """Casino engines in LRU order, with per-casino pool sizes and a connection budget for the whole process."""
+
+    def __init__(self, pool_size, max_overflow, budget, idle_seconds, overrides=None, budget_wait_seconds=0):
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.budget = budget
+        self.idle_seconds = idle_seconds
+        self.budget_wait_seconds = budget_wait_seconds
+        self.overrides = {int(casino_id): value for casino_id, value in (overrides or {}).items()}
+        self.engines = OrderedDict()
+        self.sessionmakers = {}
+        self.last_used = {}
+        self.lock = threading.RLock()
+        self.created = 0
+        self.evictions = 0
+        self.idle_disposals = 0
+        self.budget_waits = 0
+        self.budget_refusals = 0
+
+    def pool_settings(self, casino_id):
+        #overrides are keyed by int, Kafka keys and headers carry the casino id as a string
+        override = self.overrides.get(int(casino_id), {})
+        return (override.get("pool_size", self.pool_size),
+                override.get("max_overflow", self.max_overflow))
+
+    def connections(self, casino_id):
+        #the most connections the engine of a casino can open
+        return sum(self.pool_settings(casino_id))
+
+    def reserved(self):
+        return sum(self.connections(casino_id) for casino_id in self.engines)
+
+    def engine(self, casino_id):
+        casino_id = int(casino_id)
+        needed = self.connections(casino_id)
+        if needed > self.budget:
+            self.budget_refusals += 1
+            raise ConnectionBudgetExceeded(f"Casino {casino_id} needs {needed} connections, "
+                                           f"more than the budget of {self.budget}")
+
+        deadline = None
+        while True:
+            with self.lock:
+                now = time.time()
+                engine = self.engines.get(casino_id)
+                if engine is None and self.make_room(needed):
+                    pool_size, max_overflow = self.pool_settings(casino_id)
+                    engine = create_engine(casino_db_url(casino_id), pool_size=pool_size, max_overflow=max_overflow)
+                    self.engines[casino_id] = engine
+                    self.created += 1
+
+                if engine is not None:
+                    self.engines.move_to_end(casino_id)
+                    self.last_used[casino_id] = now
+                    self.dispose_idle(now)
+                    return engine
+
+                #every engine has checked out connections, wait outside the lock for one of them to go idle
+                if deadline is None:
+                    deadline = time.monotonic() + self.budget_wait_seconds
+                    self.budget_waits += 1
+                if time.monotonic() >= deadline:
+                    self.budget_refusals += 1
+                    raise ConnectionBudgetExceeded(f"Connection budget of {self.budget} is in use by busy casino "
+                                                   f"engines, casino {casino_id} can retry later")
+            time.sleep(BUDGET_POLL_SECONDS)
+
+    def session(self, casino_id):
+        casino_id = int(casino_id)
+        engine = self.engine(casino_id)
+        with self.lock:
+            cached = self.sessionmakers.get(casino_id)
+            if cached is None or cached[0] is not engine:
+                cached = (engine, sessionmaker(bind=engine))
+                self.sessionmakers[casino_id] = cached
+        return cached[1]()
+
+    def make_room(self, needed):
+        #least recently used engines without checked out connections go first, busy ones are never disposed;
+        #False when only busy engines are left and they hold too much of the budget
+        while self.reserved() + needed > self.budget:
+            idle = [casino_id for casino_id, engine in self.engines.items() if not checked_out(engine)]
+            if not idle:
+                return False
+            self.dispose_engine(idle[0])
+            self.evictions += 1
+        return True
+
+    def dispose_idle(self, now):
+        for casino_id in list(self.engines):
+            if now - self.last_used.get(casino_id, now) < self.idle_seconds:
+                break
+            if checked_out(self.engines[casino_id]):
+                continue
+            self.dispose_engine(casino_id)
+            self.idle_disposals += 1
+
+    def dispose_engine(self, casino_id, close=True):
+        #connections still checked out are closed when they are returned to the disposed pool
+        engine = self.engines.pop(casino_id)
+        self.sessionmakers.pop(casino_id, None)
+        self.last_used.pop(casino_id, None)
+        engine.dispose(close=close)
+
+    def release(self, casino_id):
+        #closes the pool of a casino this process no longer serves
+        casino_id = int(casino_id)
+        with self.lock:
+            if casino_id in self.engines:
+                self.dispose_engine(casino_id)
+
+    def dispose_all(self, close=True):
+        with self.lock:
+            for casino_id in list(self.engines):
+                self.dispose_engine(casino_id, close=close)
+
+    def stats(self, casino_id=None):
+        with self.lock:
+            now = time.time()
+            tenants = []
+            for tenant_id, engine in self.engines.items():
+                if casino_id is not None and tenant_id != casino_id:
+                    continue
+                pool_size, max_overflow = self.pool_settings(tenant_id)
+                checkedin = getattr(engine.pool, "checkedin", None)
+                tenants.append({
+                    "casino_id": tenant_id,
+                    "pool_size": pool_size,
+                    "max_overflow": max_overflow,
+                    "checked_out": checked_out(engine),
+                    "checked_in": checkedin() if callable(checkedin) else 0,
+                    "seconds_since_use": round(now - self.last_used.get(tenant_id, now), 3),
+                })
+            return {
+                "mode": "database",
+                "engines": len(self.engines),
+                "reserved_connections": self.reserved(),
+                "connection_budget": self.budget,
+                "created": self.created,
+                "evictions": self.evictions,
+                "idle_disposals": self.idle_disposals,
+                "budget_waits": self.budget_waits,
+                "budget_refusals": self.budget_refusals,
+                "tenants": tenants,
+            }
+
+class SchemaTenantRouter:
+    """Casino schemas of one shared database, every casino engine is a view on the same connection pool."""
+
+    def __init__(self, pool_size, max_overflow):
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.shared = None
+        self.engines = {}
+        self.sessionmakers = {}
+        self.lock = threading.Lock()
+
+    def engine(self, casino_id):
+        casino_id = int(casino_id)
+        engine = self.engines.get(casino_id)
+        if engine is None:
+            with self.lock:
+                if self.shared is None:
+                    self.shared = create_engine(schema_db_url(), pool_size=self.pool_size, max_overflow=self.max_overflow)
+                #tables of the shared models are rendered as casino_<id>.<table>, the pool stays the shared one
+                engine = self.shared.execution_options(schema_translate_map={None: casino_schema(casino_id)})
+                self.sessionmakers[casino_id] = sessionmaker(bind=engine)
+                self.engines[casino_id] = engine
+        return engine
+
+    def session(self, casino_id):
+        casino_id = int(casino_id)
+        self.engine(casino_id)
+        return self.sessionmakers[casino_id]()
+
+    def release(self, casino_id):
+        #the pool is shared, only the casino's view on it is dropped
+        casino_id = int(casino_id)
+        with self.lock:
+            self.engines.pop(casino_id, None)
+            self.sessionmakers.pop(casino_id, None)
+
+    def dispose_all(self, close=True):
+        with self.lock:
+            if self.shared is not None:
+                self.shared.dispose(close=close)
+            self.shared = None
+            self.engines.clear()
+            self.sessionmakers.clear()
+
+    def stats(self, casino_id=None):
+        with self.lock:
+            pool = self.shared.pool if self.shared is not None else None
+            checkedin = getattr(pool, "checkedin", None)
+            return {
+                "mode": "schema",
+                "schemas": len(self.engines) if casino_id is None else int(casino_id in self.engines),
+                "pool_size": self.pool_size,
+                "max_overflow": self.max_overflow,
+                "checked_out": checked_out(self.shared) if self.shared is not None else 0,
+                "checked_in": checkedin() if callable(checkedin) else 0,
+            }
+
+tenant_engines = TenantEngineManager(Config.TENANT_POOL_SIZE,
+                                     Config.TENANT_MAX_OVERFLOW,
+                                     Config.TENANT_CONNECTION_BUDGET,
+                                     Config.TENANT_IDLE_SECONDS,
+                                     json.loads(Config.TENANT_POOL_OVERRIDES),
+                                     Config.TENANT_BUDGET_WAIT_SECONDS)
+schema_tenants = SchemaTenantRouter(Config.TENANT_SCHEMA_POOL_SIZE, Config.TENANT_SCHEMA_MAX_OVERFLOW)
+#casino_id -> engine, in LRU order
+db_engine_cache = tenant_engines.engines
+
+def tenant_router():
+    return schema_tenants if Config.TENANCY_MODE == "schema" else tenant_engines
+
 def get_casino_db_session(casino_id):
-    db_name = f"casino_{casino_id}"
-    db_url = f"postgresql://{Config.POSTGRES_USER}:{Config.POSTGRES_PASSWORD}@{Config.POSTGRES_HOST}:{Config.POSTGRES_PORT}/{db_name}"
-    
-    if casino_id not in db_engine_cache:
-        engine = create_engine(db_url)
-        db_engine_cache[casino_id] = engine
-    
-    engine = db_engine_cache[casino_id]
-    Session = sessionmaker(bind=engine)
-    return Session()
+    return tenant_router().session(casino_id)
 
 def random_begin_timestamp():
-    return (datetime.utcnow() - timedelta(days=random.randint(10, 30))).replace(microsecond=0).isoformat()
+    return (datetime.utcnow() + timedelta(hours=random.randint(1, 24 * 7))).replace(microsecond=0).isoformat()
 
 def random_end_timestamp(begin_time):
     begin_dt = datetime.fromisoformat(begin_time)
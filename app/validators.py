@@ -0,0 +1,172 @@
+import math
+from marshmallow import fields, validate, RAISE, EXCLUDE, ValidationError
+from marshmallow.utils import from_iso_datetime, missing
+from app.utils import uppercase_dict
+
+compiled_validators = {}
+
+class SlowPath(Exception):
+    """Raised by a compiled check when marshmallow has to decide about the record."""
+
+class Unsupported(Exception):
+    """Raised while compiling a schema feature that has no compiled check."""
+
+def string_check(value):
+    if type(value) is str:
+        return value.upper()
+    raise SlowPath
+
+def integer_check(value):
+    #same int() marshmallow's Integer calls, after uppercase_dict would have run
+    if value is True or value is False:
+        raise SlowPath
+    try:
+        return int(value.upper() if type(value) is str else value)
+    except (TypeError, ValueError, OverflowError):
+        raise SlowPath
+
+def float_check(value):
+    if value is True or value is False:
+        raise SlowPath
+    try:
+        number = float(value.upper() if type(value) is str else value)
+    except (TypeError, ValueError, OverflowError):
+        raise SlowPath
+    if math.isnan(number) or math.isinf(number):
+        raise SlowPath
+    return number
+
+def datetime_check(value):
+    if type(value) is not str:
+        raise SlowPath
+    try:
+        return from_iso_datetime(value.upper())
+    except (TypeError, AttributeError, ValueError):
+        raise SlowPath
+
+def passes(validator, value):
+    try:
+        return validator(value) is not False
+    except ValidationError:
+        return False
+
+def compile_validators(field):
+    #OneOf becomes a set lookup, any other validator runs as is
+    checks = []
+    for validator in field.validators:
+        if isinstance(validator, validate.OneOf):
+            choices = frozenset(validator.choices)
+            checks.append(lambda value, choices=choices: value in choices)
+        else:
+            checks.append(lambda value, validator=validator: passes(validator, value))
+    return checks
+
+def compile_field(field):
+    if field.data_key is not None or field.attribute is not None:
+        raise Unsupported(f"{field} is renamed")
+
+    if type(field) is fields.String:
+        check = string_check
+    elif type(field) is fields.Integer and not field.strict:
+        check = integer_check
+    elif type(field) is fields.Float and field.allow_nan is False and not field.as_string:
+        check = float_check
+    elif type(field) is fields.DateTime and field.format in (None, "iso"):
+        check = datetime_check
+    elif type(field) is fields.Nested and not (field.many or field.only or field.exclude or field.unknown):
+        nested = CompiledValidator(field.schema)
+        check = nested.check
+    elif type(field) is fields.List:
+        inner = compile_field(field.inner)
+        def check(value):
+            if type(value) is not list:
+                raise SlowPath
+            return [inner(item) for item in value]
+    else:
+        raise Unsupported(f"no compiled check for {field}")
+
+    validators = compile_validators(field)
+    allow_none = field.allow_none
+
+    def run(value):
+        if value is None:
+            if allow_none:
+                return None
+            raise SlowPath
+        value = check(value)
+        for validator in validators:
+            if not validator(value):
+                raise SlowPath
+        return value
+    return run
+
+class CompiledValidator:
+    """Normalizes and validates records in one pass with checks compiled from a marshmallow schema."""
+
+    def __init__(self, schema):
+        hooks = [hook for hooks in schema._hooks.values() for hook in hooks]
+        #marshmallow-sqlalchemy registers make_instance, which returns the data unchanged without load_instance
+        if any(hook[0] != "make_instance" for hook in hooks) or getattr(schema.opts, "load_instance", False):
+            raise Unsupported(f"{type(schema).__name__} has load hooks")
+        if schema.unknown not in (RAISE, EXCLUDE):
+            raise Unsupported(f"{type(schema).__name__} includes unknown fields")
+
+        self.schema = schema
+        self.exclude_unknown = schema.unknown == EXCLUDE
+        self.names = frozenset(schema.load_fields)
+        self.required = frozenset(name for name, field in schema.load_fields.items() if field.required)
+        self.defaults = {name: field.load_default for name, field in schema.load_fields.items()
+                         if not field.required and field.load_default is not missing}
+        self.checks = {name: compile_field(field) for name, field in schema.load_fields.items()}
+
+    def check(self, record):
+        if type(record) is not dict or not self.required.issubset(record):
+            raise SlowPath
+        if not self.exclude_unknown and not self.names.issuperset(record):
+            raise SlowPath
+
+        checks = self.checks
+        result = {name: checks[name](value) for name, value in record.items() if name in checks}
+        for name, default in self.defaults.items():
+            if name not in result:
+                result[name] = default() if callable(default) else default
+        return result
+
+    def load_many(self, records, session=None):
+        #returns (position, row) for the accepted records and (position, error) for the rejected ones
+        rows, errors = [], []
+        for position, record in enumerate(records):
+            try:
+                rows.append((position, self.check(record)))
+            except SlowPath:
+                #marshmallow decides every record the compiled checks are unsure about, with its own messages
+                schema_load(self.schema, record, position, session, rows, errors)
+        return rows, errors
+
+def schema_load(schema, record, position, session, rows, errors):
+    try:
+        kwargs = {"session": session} if session is not None else {}
+        rows.append((position, schema.load(uppercase_dict(record), **kwargs)))
+    except Exception as exc:
+        errors.append((position, exc))
+
+def compiled_validator(schema):
+    #None when the schema uses something the compiler does not know
+    key = type(schema)
+    if key not in compiled_validators:
+        try:
+            compiled_validators[key] = CompiledValidator(schema)
+        except Unsupported as exc:
+            print(f"Validation of {key.__name__} is not compiled: {exc}")
+            compiled_validators[key] = None
+    return compiled_validators[key]
+
+def load_batch(schema, records, session=None):
+    validator = compiled_validator(schema)
+    if validator is not None:
+        return validator.load_many(records, session=session)
+
+    rows, errors = [], []
+    for position, record in enumerate(records):
+        schema_load(schema, record, position, session, rows, errors)
+    return rows, errors
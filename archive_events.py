@@ -0,0 +1,38 @@
+import sys
+import time
+from app import create_app, db
+from app.config import Config
+from app.db_models_master import Casino
+from app.archive import archive_finished_events
+from app.utils import get_casino_db_session
+
+
+app = create_app()
+
+def archive_casinos(casino_ids):
+    for casino_id in casino_ids:
+        session = get_casino_db_session(casino_id)
+        try:
+            archived = archive_finished_events(session)
+            if archived:
+                print(f"Archived {archived} finished events of casino {casino_id}.")
+        except Exception as exc:
+            print(f"Archive error for casino {casino_id}: {exc}")
+            session.rollback()
+        finally:
+            session.close()
+
+if __name__ == "__main__":
+    loop = "--loop" in sys.argv
+    
+    with app.app_context():
+        while True:
+            casino_ids = [int(arg) for arg in sys.argv[1:] if arg != "--loop"]
+            if not casino_ids:
+                casino_ids = [row[0] for row in db.session.query(Casino.id).all()]
+                db.session.remove()
+            
+            archive_casinos(casino_ids)
+            if not loop:
+                break
+            time.sleep(Config.EVENT_ARCHIVE_INTERVAL_SECONDS)
@@ -0,0 +1,47 @@
+import sys
+import time
+from app.schemas import UserResponseSchema, EventSchema, PurchasedCouponSchema
+from app.utils import generate_dummy_users, generate_dummy_teams, generate_dummy_events, \
+generate_dummy_purchased_coupons, uppercase_dict
+from app.validators import load_batch
+
+
+def marshmallow_path(schema, records):
+    rows = []
+    for record in records:
+        try:
+            rows.append(schema.load(uppercase_dict(record)))
+        except Exception:
+            pass
+    return rows
+
+def compiled_path(schema, records):
+    rows, _ = load_batch(schema, records)
+    return [row for _, row in rows]
+
+def records_per_second(path, schema, records, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        accepted = path(schema, records)
+    return len(records) * rounds / (time.perf_counter() - started), len(accepted)
+
+def sample_records(n):
+    users = generate_dummy_users(n)
+    events = generate_dummy_events(generate_dummy_teams(30), n=n)
+    for i, record in enumerate(users + events):
+        record["id"] = i + 1
+    coupons, _ = generate_dummy_purchased_coupons(events, user_id=1, n=n)
+    for i, record in enumerate(coupons):
+        record["id"] = i + 1
+    return {"users": (UserResponseSchema(), users), "events": (EventSchema(), events),
+            "coupons": (PurchasedCouponSchema(), coupons)}
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    for kind, (schema, records) in sample_records(n).items():
+        slow, slow_accepted = records_per_second(marshmallow_path, schema, records, rounds)
+        fast, fast_accepted = records_per_second(compiled_path, schema, records, rounds)
+        print(f"{kind}: {len(records)} records, marshmallow {slow:,.0f}/s, compiled {fast:,.0f}/s "
+              f"({fast / slow:.1f}x), accepted {slow_accepted} / {fast_accepted}")
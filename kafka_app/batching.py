@@ -0,0 +1,303 @@
+import sys
+import json
+import time
+import threading
+from collections import defaultdict, Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from app.config import Config
+from app.utils import tenant_router
+
+#poll timeout while no batch is open, the linger clock starts with a batch's first message
+IDLE_POLL_SECONDS = 1.0
+
+class AdaptiveBatcher:
+    """Micro-batches bounded by messages, bytes and linger time, the message limit follows the write latency."""
+
+    def __init__(self, max_messages=None, min_messages=None, max_bytes=None, linger_ms=None, target_write_ms=None):
+        self.max_messages = max_messages or Config.KAFKA_BATCH_MAX_MESSAGES
+        self.min_messages = min(min_messages or Config.KAFKA_BATCH_MIN_MESSAGES, self.max_messages)
+        self.max_bytes = max_bytes or Config.KAFKA_BATCH_MAX_BYTES
+        self.linger = (Config.KAFKA_BATCH_LINGER_MS if linger_ms is None else linger_ms) / 1000
+        self.target_write = (target_write_ms or Config.KAFKA_BATCH_TARGET_WRITE_MS) / 1000
+        self.limit = self.min_messages
+        #(topic, partition) revoked by a rebalance callback that ran inside consumer.consume()
+        self.revoked = set()
+        self.flushes = Counter()
+        self.batches = 0
+        self.messages = 0
+        self.write_seconds = 0.0
+
+    def collect(self, consumer):
+        msgs, size = [], 0
+        deadline = None
+        while True:
+            if deadline is None:
+                timeout = IDLE_POLL_SECONDS
+            else:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    return msgs, size, "linger"
+
+            polled = consumer.consume(num_messages=self.limit - len(msgs), timeout=timeout)
+            if self.revoked:
+                #messages already read from revoked partitions belong to their next owner, the batch ends here
+                msgs = [msg for msg in msgs + polled if (msg.topic(), msg.partition()) not in self.revoked]
+                self.revoked = set()
+                return msgs, sum(len(msg.value() or b"") for msg in msgs), "rebalance"
+            if deadline is None:
+                if not polled:
+                    #lets the caller commit finished writes while the topic is quiet
+                    return msgs, size, "idle"
+                deadline = time.monotonic() + self.linger
+            for msg in polled:
+                msgs.append(msg)
+                size += len(msg.value() or b"")
+
+            if len(msgs) >= self.limit:
+                return msgs, size, "messages"
+            if size >= self.max_bytes:
+                return msgs, size, "bytes"
+
+    def revoke(self, partitions):
+        #called from the rebalance callbacks, which run on the polling thread
+        self.revoked.update(partitions)
+
+    def observe(self, count, size, reason, write_seconds):
+        self.batches += 1
+        self.messages += count
+        self.write_seconds += write_seconds
+        self.flushes[reason] += 1
+
+        previous = self.limit
+        if write_seconds > self.target_write:
+            #shrink to what the database wrote within the target
+            self.limit = max(self.min_messages, int(count * self.target_write / write_seconds))
+        elif reason == "messages":
+            #only a full batch means there is a backlog worth bigger batches
+            self.limit = min(self.max_messages, self.limit * 2)
+
+        print(f"Batch of {count} messages ({size} bytes) flushed by {reason}, "
+              f"written in {write_seconds * 1000:.0f} ms, limit {previous} -> {self.limit}")
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "messages": self.messages,
+            "mean_batch_size": round(self.messages / self.batches, 1) if self.batches else 0,
+            "mean_write_ms": round(self.write_seconds * 1000 / self.batches, 1) if self.batches else 0,
+            "flushes": dict(self.flushes),
+            "limit": self.limit,
+        }
+
+class OffsetTracker:
+    """Offsets handed to the writers per partition, commits stop below the lowest one not written yet."""
+
+    def __init__(self):
+        self.outstanding = defaultdict(deque)
+        self.written = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def add(self, partition, offset):
+        #a partition is read in order, so every deque stays sorted
+        with self.lock:
+            self.outstanding[partition].append(offset)
+
+    def complete(self, offsets):
+        with self.lock:
+            for partition, offset in offsets:
+                self.written[partition].add(offset)
+
+    def positions(self):
+        #next offset to read per advanced partition, every message before it has been written
+        advanced = {}
+        with self.lock:
+            for partition, queue in self.outstanding.items():
+                written = self.written[partition]
+                while queue and queue[0] in written:
+                    offset = queue.popleft()
+                    written.discard(offset)
+                    advanced[partition] = offset + 1
+        return advanced
+
+    def in_flight(self):
+        with self.lock:
+            return sum(len(queue) for queue in self.outstanding.values())
+
+    def forget(self, partitions):
+        #offsets of revoked partitions are re-read by their next owner from the last commit
+        with self.lock:
+            for partition in partitions:
+                self.outstanding.pop(partition, None)
+                self.written.pop(partition, None)
+
+class BatchWrite:
+    """A polled batch whose casino groups are written in parallel, it is done when the last group is written."""
+
+    def __init__(self, count, size, reason, groups):
+        self.count = count
+        self.size = size
+        self.reason = reason
+        self.pending = groups
+        self.started = time.monotonic()
+        #retries would read as a slow database, so a batch with a dead-lettered group is not observed
+        self.dead_lettered = False
+
+    def result(self):
+        return self.count, self.size, self.reason, time.monotonic() - self.started
+
+class CasinoWriters:
+    """Bounded pool of writer threads with one task in flight per casino, later groups of a casino queue behind it."""
+
+    def __init__(self, tracker, write, workers=None, dead_letter=None, retries=None, backoff_ms=None):
+        self.tracker = tracker
+        self.write = write
+        #dead_letter(cid, items, error) keeps a group that could not be written, so its offsets can be committed
+        self.dead_letter = dead_letter
+        self.retries = Config.KAFKA_WRITE_RETRIES if retries is None else retries
+        self.backoff = (Config.KAFKA_WRITE_BACKOFF_MS if backoff_ms is None else backoff_ms) / 1000
+        self.executor = ThreadPoolExecutor(max_workers=workers or Config.KAFKA_WRITER_WORKERS)
+        self.queues = {}
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.finished = []
+        self.dead_lettered = 0
+        self.error = None
+
+    def submit_batch(self, grouped, count, size, reason):
+        batch = BatchWrite(count, size, reason, len(grouped))
+        if not grouped:
+            with self.lock:
+                self.finished.append(batch.result())
+        for cid, (items, offsets) in grouped.items():
+            self.submit(cid, items, offsets, batch)
+
+    def submit(self, cid, items, offsets, batch=None):
+        with self.lock:
+            queue = self.queues.get(cid)
+            if queue is not None:
+                queue.append((items, offsets, batch))
+                return
+            self.queues[cid] = deque()
+        self.executor.submit(self.run, cid, items, offsets, batch)
+
+    def write_with_retries(self, cid, items):
+        #only this casino's worker waits out the backoff, the other casinos keep writing
+        for attempt in range(self.retries + 1):
+            try:
+                self.write(cid, items)
+                return None
+            except Exception as exc:
+                failed = exc
+                print(f"Write error for casino {cid} (attempt {attempt + 1}/{self.retries + 1}): {exc}",
+                      file=sys.stderr)
+            if attempt < self.retries:
+                time.sleep(self.backoff * 2 ** attempt)
+        return failed
+
+    def run(self, cid, items, offsets, batch):
+        #writes the casino's groups in arrival order, which keeps per-tenant order
+        while True:
+            failed = self.write_with_retries(cid, items)
+            dead_lettered = False
+            if failed is not None and self.dead_letter is not None:
+                try:
+                    self.dead_letter(cid, items, failed)
+                    dead_lettered, failed = True, None
+                except Exception as exc:
+                    print(f"Dead-letter error for casino {cid}: {exc}", file=sys.stderr)
+
+            with self.lock:
+                queue = self.queues[cid]
+                if failed is None:
+                    self.tracker.complete(offsets)
+                    if dead_lettered:
+                        self.dead_lettered += len(items)
+                    if batch is not None:
+                        batch.pending -= 1
+                        batch.dead_lettered = batch.dead_lettered or dead_lettered
+                        if not batch.pending and not batch.dead_lettered:
+                            self.finished.append(batch.result())
+                else:
+                    #without a dead-letter copy the offsets stay uncommitted and the consumer stops,
+                    #the casino's later groups are left to the next owner of the partition
+                    self.error = self.error or failed
+                    queue.clear()
+                self.changed.notify_all()
+
+                if not queue:
+                    del self.queues[cid]
+                    return
+                items, offsets, batch = queue.popleft()
+
+    def take_finished(self):
+        #(count, size, reason, seconds) of every batch written since the last call, failed or dead-lettered ones excluded
+        with self.lock:
+            finished, self.finished = self.finished, []
+        return finished
+
+    def wait_for_room(self, max_in_flight):
+        #stops reading while too many messages wait for slow tenants
+        with self.changed:
+            while self.error is None and self.tracker.in_flight() > max_in_flight:
+                self.changed.wait(timeout=1.0)
+
+    def drain(self):
+        with self.changed:
+            while self.queues:
+                self.changed.wait(timeout=1.0)
+
+    def raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def shutdown(self):
+        self.drain()
+        self.executor.shutdown()
+
+def group_messages(msgs, tracker):
+    #groups batches of data based on casino_id like a hashmap, with the (topic, partition) offset of every item
+    grouped_data = defaultdict(lambda: ([], []))
+    
+    for msg in msgs:
+        if msg.error():
+            print(f"Kafka message error: {msg.error()}", file=sys.stderr)
+            continue
+        
+        position = ((msg.topic(), msg.partition()), msg.offset())
+        tracker.add(*position)
+        
+        try:
+            data = json.loads(msg.value().decode("utf-8"))
+            headers = dict(msg.headers() or [])
+            casino_id = headers.get("casino_id")
+            
+            if isinstance(casino_id, bytes):
+                casino_id = casino_id.decode("utf-8")
+            
+            if not casino_id:
+                print("Missing casino_id header")
+                tracker.complete([position])
+                continue
+                                
+            print(f"Message consumed from topic {msg.topic()}: {data}")
+            items, offsets = grouped_data[casino_id]
+            items.append(data)
+            offsets.append(position)
+            
+        except json.JSONDecodeError:
+            print("Failed to decode message. Skipping.")
+            tracker.complete([position])
+    
+    return grouped_data
+
+def release_casinos(partition_casinos, revoked):
+    #pools stay open only for casinos that still come in on an assigned partition
+    released = set()
+    for partition in revoked:
+        released |= partition_casinos.pop(partition, set())
+    for casinos in partition_casinos.values():
+        released -= casinos
+    
+    for cid in released:
+        tenant_router().release(cid)
+    return released
@@ -1,78 +1,115 @@
 import sys
-import json
 import os
-from confluent_kafka import Consumer
+import json
+from confluent_kafka import Consumer, Producer, TopicPartition
 from app.services import create_events, create_purchased_coupons, create_users
+from app.config import Config
 from app import create_app
 from collections import defaultdict
+from kafka_app.batching import AdaptiveBatcher, OffsetTracker, CasinoWriters, group_messages, release_casinos
 
 topic = os.getenv("TOPIC_NAME", "coupons") 
 
 bootstrap_servers = os.getenv("BOOTSTRAP_SERVERS", "localhost:9092")
 app = create_app()
 
+dead_letter_producer = Producer({'bootstrap.servers': bootstrap_servers})
+
+def write_group(cid, items):
+    #a failed write raises so the writers retry it, the copies keep the polled items unchanged by validation
+    with app.app_context():
+        items = [dict(item) for item in items]
+        if topic == "events":
+            create_events(items, cid, raise_errors=True)
+        elif topic == "coupons":
+            create_purchased_coupons(items, cid, raise_errors=True)
+        elif topic == "users":
+            create_users(items, cid, raise_errors=True)
+
+def dead_letter(cid, items, error):
+    #the group's offsets are committed once this returns, so every copy must have reached the broker
+    for item in items:
+        dead_letter_producer.produce(
+            topic=topic + Config.KAFKA_DEAD_LETTER_SUFFIX,
+            key=str(cid).encode("utf-8"),
+            value=json.dumps(item, default=str).encode("utf-8"),
+            headers=[("casino_id", str(cid).encode("utf-8")), ("error", str(error).encode("utf-8"))])
+    if dead_letter_producer.flush(10) > 0:
+        raise RuntimeError(f"{len(items)} messages of casino {cid} were not delivered to the dead-letter topic")
+    print(f"Moved {len(items)} messages of casino {cid} to {topic}{Config.KAFKA_DEAD_LETTER_SUFFIX}: {error}",
+          file=sys.stderr)
+
+def commit_written(consumer, tracker, asynchronous=True):
+    positions = tracker.positions()
+    if positions:
+        consumer.commit(offsets=[TopicPartition(t, p, offset) for (t, p), offset in positions.items()],
+                        asynchronous=asynchronous)
+
 def consume_topic(topic):
     with app.app_context():
         consumer = Consumer({'bootstrap.servers': bootstrap_servers,
                              'group.id': f'{topic}-group',
                              'auto.offset.reset': 'earliest',
-                             'enable.auto.commit': False })
+                             'enable.auto.commit': False,
+                             #a rebalance only moves the partitions it has to, the rest keep their warm pools
+                             'partition.assignment.strategy': 'cooperative-sticky' })
+        
+        batcher = AdaptiveBatcher()
+        tracker = OffsetTracker()
+        writers = CasinoWriters(tracker, write_group, dead_letter=dead_letter)
+        partition_casinos = defaultdict(set)
+        
+        def on_assign(consumer, partitions):
+            print(f"Assigned partitions {[p.partition for p in partitions]} of topic {topic}")
+        
+        def hand_over(consumer, partitions, commit):
+            #the next owner starts from the committed offsets, so in-flight writes are finished first
+            writers.drain()
+            if commit:
+                commit_written(consumer, tracker, asynchronous=False)
+            revoked = [(p.topic, p.partition) for p in partitions]
+            #a collect in progress drops what it already read from these partitions
+            batcher.revoke(revoked)
+            tracker.forget(revoked)
+            released = release_casinos(partition_casinos, revoked)
+            print(f"Revoked partitions {[p.partition for p in partitions]} of topic {topic}, "
+                  f"released the pools of {len(released)} casinos")
         
-        consumer.subscribe([topic])
+        def on_revoke(consumer, partitions):
+            hand_over(consumer, partitions, commit=True)
+        
+        def on_lost(consumer, partitions):
+            #lost partitions already belong to another member, their offsets can no longer be committed
+            hand_over(consumer, partitions, commit=False)
+        
+        consumer.subscribe([topic], on_assign=on_assign, on_revoke=on_revoke, on_lost=on_lost)
         
         try:
             while True:
-                msgs = consumer.consume(num_messages=10, timeout=3.0)
-                if not msgs:
-                    continue
-                
-                batch_data = []
-                casino_ids = []
+                writers.raise_error()
+                writers.wait_for_room(Config.KAFKA_MAX_IN_FLIGHT_MESSAGES)
                 
-                for msg in msgs:
-                    
-                    if msg.error():
-                        print(f"Kafka message error: {msg.error()}", file=sys.stderr)
-                        continue
-                        
-                    try:
-                        data = json.loads(msg.value().decode("utf-8"))
-                        headers = dict(msg.headers() or [])
-                        casino_id = headers.get("casino_id")
-                        
-                        if isinstance(casino_id, bytes):
-                            casino_id = casino_id.decode("utf-8")
-                        
-                        if not casino_id:
-                            print("Missing casino_id header")
-                            continue
-                                            
-                        print(f"Message consumed from topic {topic}: {data}")
-                        
-                        batch_data.append(data)
-                        casino_ids.append(casino_id)
-                        
-                    except json.JSONDecodeError:
-                        print("Failed to decode message. Skipping.")
-                    
-                    #groups batches of data based on casino_id like a hashmap
-                grouped_data = defaultdict(list)
-                for data, cid in zip(batch_data, casino_ids):
-                    grouped_data[cid].append(data)
-                        
-                for cid, items in grouped_data.items():
-                    if topic == "events":
-                        create_events(items, cid)
-                    elif topic == "coupons":
-                        create_purchased_coupons(items, cid)
-                    elif topic == "users":
-                        create_users(items, cid)
+                msgs, size, reason = batcher.collect(consumer)
+                if msgs:
+                    grouped = group_messages(msgs, tracker)
+                    for cid, (items, offsets) in grouped.items():
+                        for partition, _ in offsets:
+                            partition_casinos[partition].add(cid)
+                    writers.submit_batch(grouped, len(msgs), size, reason)
+                #the limit adapts to each batch's own size and the time until its last casino group was written
+                for finished in writers.take_finished():
+                    batcher.observe(*finished)
     
-                consumer.commit()
+                commit_written(consumer, tracker)
                         
         except Exception as e:
             print(f"Consumer error: {e}", file=sys.stderr)
         finally:
+            writers.shutdown()
+            for finished in writers.take_finished():
+                batcher.observe(*finished)
+            commit_written(consumer, tracker, asynchronous=False)
+            print(f"Consumer batching stats: {batcher.stats()}, dead-lettered messages: {writers.dead_lettered}")
             consumer.close() 
 
 if __name__ == "__main__":
@@ -1,4 +1,5 @@
-from confluent_kafka.admin import AdminClient, NewTopic
+from confluent_kafka.admin import AdminClient, NewTopic, NewPartitions
+from app.config import Config
 import os
 import time
 
@@ -22,13 +23,20 @@ def create_topics():
             time.sleep(delay)
     
     topics_to_create = []
+    topics_to_grow = []
 
-    existing_topics = admin_client.list_topics(timeout=10).topics.keys()
+    existing_topics = admin_client.list_topics(timeout=10).topics
+    num_partitions = Config.KAFKA_NUM_PARTITIONS
     
     required_topics = ["coupons", "events", "users"]
+    #groups a consumer could not write after its retries, the broker does not auto-create topics
+    required_topics += [topic + Config.KAFKA_DEAD_LETTER_SUFFIX for topic in required_topics]
     for topic in required_topics:
         if topic not in existing_topics:
-            topics_to_create.append(NewTopic(topic, num_partitions=3, replication_factor=1))
+            topics_to_create.append(NewTopic(topic, num_partitions=num_partitions, replication_factor=1))
+        elif len(existing_topics[topic].partitions) < num_partitions:
+            #partitions can only be added, casinos keyed to the old partitions may move once
+            topics_to_grow.append(NewPartitions(topic, num_partitions))
     """
     if "coupons" not in existing_topics:
        topics_to_create.append(NewTopic("coupons", num_partitions=3, replication_factor=1))
@@ -48,6 +56,15 @@ def create_topics():
                 print(f"Failed to create topic {topic}: {e}")
     else:
         print("All topics already exist.")
+        
+    if topics_to_grow:
+        fs = admin_client.create_partitions(topics_to_grow)
+        for topic, f in fs.items():
+            try:
+                f.result()
+                print(f"Topic {topic} now has {num_partitions} partitions")
+            except Exception as e:
+                print(f"Failed to add partitions to topic {topic}: {e}")
 
 if __name__ == "__main__":
     create_topics()
\ No newline at end of file
@@ -52,8 +52,10 @@ def produce_messages(send_data):
     
                 for record in data:
                     value = json.dumps(record).encode('utf-8')
+                    #keyed by casino so all records of a casino land on one partition, in order
                     producer.produce(
                         topic=topic,
+                        key=str(casino_id).encode('utf-8'),
                         value=value,
                         headers=[("casino_id", str(casino_id).encode("utf-8"))],
                         callback=delivery_report
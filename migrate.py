@@ -0,0 +1,31 @@
+import sys
+from app import create_app, db
+from app.db_models_master import Casino
+from app.migrations import migrate_tenant_db, migrate_master_db, DuplicateUsersError
+from app.utils import get_casino_db_session
+
+
+app = create_app()
+
+if __name__ == "__main__":
+    with app.app_context():
+        widened = migrate_master_db(db.engine)
+        columns = ", ".join(f"{table}.{column}" for table, column in widened) or "none"
+        print(f"Migrated master database, converted columns: {columns}.")
+        
+        casino_ids = [int(arg) for arg in sys.argv[1:]]
+        if not casino_ids:
+            casino_ids = [row[0] for row in db.session.query(Casino.id).all()]
+        
+        for casino_id in casino_ids:
+            session = get_casino_db_session(casino_id)
+            try:
+                converted = migrate_tenant_db(session.get_bind())
+            except DuplicateUsersError as exc:
+                print(f"Casino {casino_id} was migrated without its unique users index: {exc}")
+                continue
+            finally:
+                session.close()
+                
+            columns = ", ".join(f"{table}.{column}" for table, column in converted) or "none"
+            print(f"Migrated casino {casino_id}, converted columns: {columns}.")
@@ -0,0 +1,27 @@
+import argparse
+from app import create_app, db
+from app.db_models_master import Casino
+from app.precompute import run_precompute
+
+
+app = create_app()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute recommendations for every user of a casino")
+    parser.add_argument("casino_id", type=int)
+    parser.add_argument("--recommender-type", help="defaults to the recommender configured for the casino")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--chunk-size", type=int)
+    args = parser.parse_args()
+    
+    with app.app_context():
+        recommender_type = args.recommender_type
+        if not recommender_type:
+            casino = db.session.get(Casino, args.casino_id)
+            if not casino or not casino.recommender_type:
+                raise SystemExit(f"Casino {args.casino_id} is not configured, pass --recommender-type")
+            recommender_type = casino.recommender_type
+        
+        summary = run_precompute(args.casino_id, recommender_type.lower(), workers=args.workers, chunk_size=args.chunk_size)
+        print(f"Precomputed {summary['written']} of {summary['users']} users for casino {args.casino_id} "
+              f"({summary['failed']} failed).")
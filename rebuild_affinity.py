@@ -0,0 +1,22 @@
+import sys
+from app import create_app, db
+from app.db_models_master import Casino
+from app.affinity import rebuild_user_affinities
+from app.utils import get_casino_db_session
+
+
+app = create_app()
+
+if __name__ == "__main__":
+    with app.app_context():
+        casino_ids = [int(arg) for arg in sys.argv[1:]]
+        if not casino_ids:
+            casino_ids = [row[0] for row in db.session.query(Casino.id).all()]
+        
+        for casino_id in casino_ids:
+            session = get_casino_db_session(casino_id)
+            try:
+                users = rebuild_user_affinities(session)
+                print(f"Rebuilt affinities of {users} users for casino {casino_id}.")
+            finally:
+                session.close()
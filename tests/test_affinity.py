@@ -0,0 +1,96 @@
+import unittest
+from unittest.mock import MagicMock
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+from app.affinity import new_user_affinity, apply_coupon, update_user_affinities, top_affinity_values, \
+    lock_user_affinities
+from app.db_models_shared import SharedBase, UserAffinity
+
+
+def leg(sport, league, country="SPAIN", home_team="TEAM1", away_team="TEAM2"):
+    return {"sport": sport, "league": league, "country": country,
+            "home_team": home_team, "away_team": away_team, "odd": 2.0}
+
+
+class TestApplyCoupon(unittest.TestCase):
+
+    def test_apply_coupon_counts_every_leg(self):
+        affinity = new_user_affinity(1)
+
+        apply_coupon(affinity, [leg("FOOTBALL", "LA LIGA"), leg("FOOTBALL", "NBA", country="USA")])
+        apply_coupon(affinity, [leg("BASKETBALL", "NBA", country="USA")])
+
+        self.assertEqual(affinity.sport_counts, {"FOOTBALL": 2, "BASKETBALL": 1})
+        self.assertEqual(affinity.country_counts, {"SPAIN": 1, "USA": 2})
+        self.assertEqual(affinity.league_counts, {"LA LIGA": 1, "NBA": 2})
+        self.assertEqual(affinity.coupons_count, 2)
+
+
+class TestAffinityReads(unittest.TestCase):
+
+    def test_top_affinity_values_skip_missing_values(self):
+        affinity = new_user_affinity(1)
+        apply_coupon(affinity, [leg("FOOTBALL", "LA LIGA", home_team=None),
+                                leg("FOOTBALL", "LA LIGA", home_team=None),
+                                leg("HANDBALL", "SEHA LEAGUE", home_team="TEAM9")])
+
+        top_values = top_affinity_values(affinity)
+
+        self.assertEqual(top_values["sport"], ["FOOTBALL", "HANDBALL"])
+        self.assertEqual(top_values["league"], ["LA LIGA", "SEHA LEAGUE"])
+        self.assertEqual(top_values["home_team"], ["TEAM9"])
+        self.assertEqual(top_affinity_values(None)["sport"], [])
+
+
+class TestUpdateUserAffinities(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        SharedBase.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_update_user_affinities_costs_three_statements(self):
+        existing = new_user_affinity(2)
+        apply_coupon(existing, [leg("HANDBALL", "SEHA LEAGUE")])
+        self.session.add(existing)
+        self.session.commit()
+        self.session.expunge_all()
+
+        statements = []
+        event.listen(self.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        coupons = [
+            {"user_id": 1, "timestamp": "2025-04-25T12:49:15", "recommended_events": [leg("FOOTBALL", "LA LIGA")]},
+            {"user_id": 1, "timestamp": "2025-04-26T12:49:15", "recommended_events": [leg("FOOTBALL", "LA LIGA")]},
+            {"user_id": 2, "timestamp": "2025-04-26T12:49:15", "recommended_events": []},
+        ]
+
+        affinities = update_user_affinities(self.session, coupons)
+        self.session.commit()
+
+        self.assertEqual(len(statements), 3)
+        self.assertIn("ON CONFLICT DO NOTHING", statements[0])
+        self.assertIn("ON CONFLICT (user_id) DO UPDATE", statements[2])
+        self.assertEqual(affinities[1].league_counts, {"LA LIGA": 2})
+        self.assertEqual(self.session.get(UserAffinity, 1).coupons_count, 2)
+        stored = self.session.get(UserAffinity, 2)
+        self.assertEqual(stored.coupons_count, 2)
+        self.assertEqual(stored.sport_counts, {"HANDBALL": 1})
+
+    def test_affinity_rows_are_locked_in_id_order(self):
+        session = MagicMock()
+        session.get_bind.return_value.dialect.name = "postgresql"
+
+        lock_user_affinities(session, {3, 1, 2})
+
+        inserted = session.execute.call_args_list[0].args[0].compile(dialect=postgresql.dialect()).params
+        self.assertEqual([inserted[f"user_id_m{i}"] for i in range(3)], [1, 2, 3])
+        locked = str(session.execute.call_args_list[-1].args[0].compile(dialect=postgresql.dialect()))
+        self.assertIn("ORDER BY users_affinity.user_id", locked)
+        self.assertIn("FOR UPDATE", locked)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.archive import archive_finished_events
+from app.db_models_shared import SharedBase, Event, ArchivedEvent, Team, event_teams
+
+
+def make_event(event_id, begin):
+    return Event(id=event_id, country="SPAIN", begin_timestamp=begin, end_timestamp=begin + timedelta(hours=1),
+                 league="LA LIGA", sport="FOOTBALL", odd=2.0, home_team="TEAM1", away_team="TEAM2")
+
+
+class TestArchiveFinishedEvents(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine("sqlite://")
+        SharedBase.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_finished_events_move_to_archive(self):
+        now = datetime(2025, 6, 1, 12, 0, 0)
+        team = Team(id=1, name="TEAM1", sport="FOOTBALL")
+        finished = [make_event(event_id, now - timedelta(days=event_id)) for event_id in (2, 3, 4)]
+        upcoming = make_event(10, now + timedelta(hours=2))
+        finished[0].teams.append(team)
+        upcoming.teams.append(team)
+        self.session.add_all(finished + [upcoming])
+        self.session.commit()
+
+        archived = archive_finished_events(self.session, now=now, batch_size=2)
+
+        self.assertEqual(archived, 3)
+        self.assertEqual([row[0] for row in self.session.query(Event.id).all()], [10])
+        self.assertEqual(sorted(row[0] for row in self.session.query(ArchivedEvent.id).all()), [2, 3, 4])
+        self.assertEqual(self.session.query(event_teams).count(), 1)
+        self.assertIsNotNone(self.session.get(ArchivedEvent, 2).archived_at)
+        self.assertEqual(archive_finished_events(self.session, now=now), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
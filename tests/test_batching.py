@@ -0,0 +1,359 @@
+import json
+import time
+import threading
+import unittest
+from unittest.mock import patch, MagicMock
+from kafka_app.batching import AdaptiveBatcher, OffsetTracker, CasinoWriters, group_messages, release_casinos
+
+PARTITION = ("coupons", 0)
+
+
+def message(offset, casino_id=b"7", value=None, partition=0, error=None):
+    msg = MagicMock()
+    msg.error.return_value = error
+    msg.topic.return_value = "coupons"
+    msg.partition.return_value = partition
+    msg.offset.return_value = offset
+    msg.value.return_value = json.dumps({"offset": offset}).encode() if value is None else value
+    msg.headers.return_value = [("casino_id", casino_id)] if casino_id is not None else []
+    return msg
+
+class FakeConsumer:
+    """Hands out scripted polls, an empty poll waits out its timeout like a quiet topic."""
+
+    def __init__(self, polls, rebalances=None):
+        self.polls = list(polls)
+        self.requested = []
+        #poll number -> callback run inside that consume(), like librdkafka serving a rebalance
+        self.rebalances = rebalances or {}
+
+    def consume(self, num_messages, timeout):
+        self.requested.append(num_messages)
+        rebalance = self.rebalances.get(len(self.requested))
+        if rebalance is not None:
+            rebalance()
+        polled = self.polls.pop(0) if self.polls else []
+        if not polled:
+            time.sleep(max(timeout, 0))
+        return polled[:num_messages]
+
+
+class TestAdaptiveBatcher(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch("builtins.print")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.batcher = AdaptiveBatcher(max_messages=8, min_messages=2, max_bytes=1000, linger_ms=20,
+                                       target_write_ms=100)
+
+    def test_full_batches_double_the_limit_up_to_the_maximum(self):
+        for expected in (4, 8, 8):
+            self.batcher.observe(self.batcher.limit, 100, "messages", 0.01)
+            self.assertEqual(self.batcher.limit, expected)
+
+    def test_batches_flushed_by_linger_or_bytes_keep_the_limit(self):
+        self.batcher.observe(1, 100, "linger", 0.01)
+        self.batcher.observe(2, 1000, "bytes", 0.01)
+
+        self.assertEqual(self.batcher.limit, 2)
+        self.assertEqual(self.batcher.stats()["flushes"], {"linger": 1, "bytes": 1})
+
+    def test_slow_writes_shrink_the_limit_to_the_target(self):
+        self.batcher.limit = 8
+
+        self.batcher.observe(8, 100, "messages", 0.2)
+        self.assertEqual(self.batcher.limit, 4)
+
+        self.batcher.observe(4, 100, "messages", 10.0)
+        self.assertEqual(self.batcher.limit, 2)
+
+    def test_a_full_batch_is_flushed_at_the_limit(self):
+        consumer = FakeConsumer([[message(0), message(1), message(2)]])
+
+        msgs, size, reason = self.batcher.collect(consumer)
+
+        self.assertEqual((len(msgs), reason), (2, "messages"))
+        self.assertEqual(consumer.requested, [2])
+
+    def test_a_partial_batch_is_flushed_after_the_linger_time(self):
+        consumer = FakeConsumer([[message(0)]])
+
+        started = time.monotonic()
+        msgs, size, reason = self.batcher.collect(consumer)
+
+        self.assertEqual((len(msgs), reason), (1, "linger"))
+        self.assertGreaterEqual(time.monotonic() - started, 0.02)
+        self.assertEqual(consumer.requested[1], 1)
+
+    def test_large_messages_flush_by_bytes(self):
+        consumer = FakeConsumer([[message(0, value=b"x" * 1200)]])
+
+        msgs, size, reason = self.batcher.collect(consumer)
+
+        self.assertEqual((len(msgs), size, reason), (1, 1200, "bytes"))
+
+    @patch("kafka_app.batching.IDLE_POLL_SECONDS", 0.01)
+    def test_a_quiet_topic_returns_an_empty_batch(self):
+        self.assertEqual(self.batcher.collect(FakeConsumer([])), ([], 0, "idle"))
+
+    @patch("builtins.print")
+    def test_a_revoke_during_a_collect_drops_the_revoked_partitions(self, mock_print):
+        other = ("coupons", 1)
+        self.batcher.limit = 8
+        consumer = FakeConsumer([[message(0), message(0, partition=1)], [message(1, partition=1)]],
+                                rebalances={2: lambda: self.batcher.revoke([PARTITION])})
+
+        msgs, size, reason = self.batcher.collect(consumer)
+
+        self.assertEqual(reason, "rebalance")
+        self.assertEqual([(msg.partition(), msg.offset()) for msg in msgs], [(1, 0), (1, 1)])
+        self.assertEqual(size, sum(len(msg.value()) for msg in msgs))
+        tracker = OffsetTracker()
+        self.assertEqual(set(group_messages(msgs, tracker)), {"7"})
+        tracker.complete([(other, 0), (other, 1)])
+        self.assertEqual(tracker.positions(), {other: 2})
+        self.assertEqual(self.batcher.revoked, set())
+
+
+
+class TestOffsetTracker(unittest.TestCase):
+
+    def test_only_the_contiguous_written_prefix_is_committed(self):
+        tracker = OffsetTracker()
+        for offset in range(4):
+            tracker.add(PARTITION, offset)
+
+        tracker.complete([(PARTITION, 1), (PARTITION, 2)])
+        self.assertEqual(tracker.positions(), {})
+
+        tracker.complete([(PARTITION, 0)])
+        self.assertEqual(tracker.positions(), {PARTITION: 3})
+        self.assertEqual(tracker.in_flight(), 1)
+
+    def test_partitions_advance_independently(self):
+        tracker = OffsetTracker()
+        other = ("coupons", 1)
+        tracker.add(PARTITION, 5)
+        tracker.add(other, 9)
+
+        tracker.complete([(other, 9)])
+
+        self.assertEqual(tracker.positions(), {other: 10})
+
+    def test_forgotten_partitions_are_no_longer_tracked(self):
+        tracker = OffsetTracker()
+        other = ("coupons", 1)
+        tracker.add(PARTITION, 0)
+        tracker.add(other, 0)
+        tracker.complete([(PARTITION, 0)])
+
+        tracker.forget([PARTITION])
+        tracker.complete([(other, 0)])
+
+        self.assertEqual(tracker.positions(), {other: 1})
+        self.assertEqual(tracker.in_flight(), 0)
+
+
+class TestCasinoWriters(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch("builtins.print")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tracker = OffsetTracker()
+        for offset in range(3):
+            self.tracker.add(PARTITION, offset)
+
+    def test_out_of_order_completion_commits_the_prefix(self):
+        release = threading.Event()
+
+        def write(cid, items):
+            if cid == 1:
+                release.wait(timeout=5)
+
+        writers = CasinoWriters(self.tracker, write, workers=2)
+        writers.submit(1, ["a"], [(PARTITION, 0)])
+        writers.submit(2, ["b"], [(PARTITION, 1)])
+        with writers.changed:
+            while 2 in writers.queues:
+                writers.changed.wait(timeout=1.0)
+
+        self.assertEqual(self.tracker.positions(), {})
+        release.set()
+        writers.shutdown()
+        self.assertEqual(self.tracker.positions(), {PARTITION: 2})
+
+    def test_a_failing_casino_does_not_hold_back_healthy_casinos(self):
+        other = ("coupons", 1)
+        tracker = OffsetTracker()
+        for partition, offset in ((PARTITION, 0), (other, 0), (other, 1)):
+            tracker.add(partition, offset)
+        failing = threading.Event()
+        release = threading.Event()
+        attempts, dead_lettered = [], []
+
+        def write(cid, items):
+            if cid == 1:
+                attempts.append(items)
+                failing.set()
+                raise RuntimeError("connection lost")
+
+        def dead_letter(cid, items, error):
+            release.wait(timeout=5)
+            dead_lettered.append((cid, items, str(error)))
+
+        writers = CasinoWriters(tracker, write, workers=2, dead_letter=dead_letter, retries=2, backoff_ms=1)
+        writers.submit(1, ["a"], [(PARTITION, 0)])
+        failing.wait(timeout=5)
+        writers.submit(2, ["b"], [(other, 0)])
+        writers.submit(2, ["c"], [(other, 1)])
+        with writers.changed:
+            while 2 in writers.queues:
+                writers.changed.wait(timeout=1.0)
+
+        self.assertEqual(tracker.positions(), {other: 2})
+        release.set()
+        writers.shutdown()
+        self.assertEqual(attempts, [["a"]] * 3)
+        self.assertEqual(dead_lettered, [(1, ["a"], "connection lost")])
+        self.assertEqual(tracker.positions(), {PARTITION: 1})
+        self.assertEqual(writers.dead_lettered, 1)
+        writers.raise_error()
+
+    def test_a_write_that_succeeds_on_a_retry_is_committed(self):
+        attempts = []
+
+        def write(cid, items):
+            attempts.append(items)
+            if len(attempts) == 1:
+                raise RuntimeError("connection lost")
+
+        dead_letter = MagicMock()
+        writers = CasinoWriters(self.tracker, write, workers=2, dead_letter=dead_letter, retries=1, backoff_ms=1)
+        writers.submit(1, ["a"], [(PARTITION, 0)])
+        writers.shutdown()
+
+        self.assertEqual(attempts, [["a"], ["a"]])
+        self.assertEqual(self.tracker.positions(), {PARTITION: 1})
+        dead_letter.assert_not_called()
+
+    def test_without_a_dead_letter_copy_a_failed_group_blocks_the_commit(self):
+        written = []
+
+        def write(cid, items):
+            if items == ["a"]:
+                raise RuntimeError("connection lost")
+            written.append(items)
+
+        dead_letter = MagicMock(side_effect=RuntimeError("broker down"))
+        writers = CasinoWriters(self.tracker, write, workers=2, dead_letter=dead_letter, retries=0)
+        writers.submit(1, ["a"], [(PARTITION, 0)])
+        writers.submit(2, ["b"], [(PARTITION, 1)])
+        writers.shutdown()
+
+        self.assertEqual(written, [["b"]])
+        self.assertEqual(self.tracker.positions(), {})
+        with self.assertRaises(RuntimeError):
+            writers.raise_error()
+
+    def test_groups_of_a_casino_are_written_in_order_and_dropped_after_a_failure(self):
+        started = threading.Event()
+        release = threading.Event()
+        written = []
+
+        def write(cid, items):
+            if items == ["a"]:
+                started.set()
+                release.wait(timeout=5)
+            written.append(items)
+            if items == ["b"]:
+                raise RuntimeError("connection lost")
+
+        writers = CasinoWriters(self.tracker, write, workers=2, retries=0)
+        writers.submit(1, ["a"], [(PARTITION, 0)])
+        started.wait(timeout=5)
+        writers.submit(1, ["b"], [(PARTITION, 1)])
+        writers.submit(1, ["c"], [(PARTITION, 2)])
+        release.set()
+        writers.shutdown()
+
+        self.assertEqual(written, [["a"], ["b"]])
+        self.assertEqual(self.tracker.positions(), {PARTITION: 1})
+
+    def test_a_batch_is_reported_with_its_own_latency_once_its_last_group_is_written(self):
+        release = threading.Event()
+
+        def write(cid, items):
+            if cid == 2:
+                release.wait(timeout=5)
+
+        writers = CasinoWriters(self.tracker, write, workers=2)
+        writers.submit_batch({1: (["a"], [(PARTITION, 0)]), 2: (["b"], [(PARTITION, 1)])}, 2, 64, "messages")
+        with writers.changed:
+            while 1 in writers.queues:
+                writers.changed.wait(timeout=1.0)
+
+        self.assertEqual(writers.take_finished(), [])
+        release.set()
+        writers.shutdown()
+        (finished,) = writers.take_finished()
+        self.assertEqual(finished[:3], (2, 64, "messages"))
+        self.assertGreater(finished[3], 0)
+
+    def test_failed_batches_are_never_reported(self):
+        def write(cid, items):
+            raise RuntimeError("connection lost")
+
+        for dead_letter in (None, MagicMock()):
+            writers = CasinoWriters(self.tracker, write, workers=2, dead_letter=dead_letter, retries=0)
+            writers.submit_batch({1: (["a"], [(PARTITION, 0)])}, 1, 32, "linger")
+            writers.submit_batch({}, 1, 3, "linger")
+            writers.shutdown()
+
+            self.assertEqual([finished[:3] for finished in writers.take_finished()], [(1, 3, "linger")])
+
+class TestGroupMessages(unittest.TestCase):
+
+    @patch("builtins.print")
+    def test_messages_are_grouped_by_casino_with_their_offsets(self, mock_print):
+        tracker = OffsetTracker()
+        msgs = [message(0, b"7"), message(1, b"8"), message(2, None), message(3, b"7", value=b"{"),
+                message(4, "7")]
+
+        grouped = group_messages(msgs, tracker)
+
+        self.assertEqual(dict(grouped), {
+            "7": ([{"offset": 0}, {"offset": 4}], [(PARTITION, 0), (PARTITION, 4)]),
+            "8": ([{"offset": 1}], [(PARTITION, 1)]),
+        })
+        #unreadable messages are done as soon as they are skipped
+        tracker.complete([(PARTITION, 0), (PARTITION, 1)])
+        self.assertEqual(tracker.positions(), {PARTITION: 4})
+
+    @patch("builtins.print")
+    def test_kafka_errors_are_not_tracked(self, mock_print):
+        tracker = OffsetTracker()
+
+        grouped = group_messages([message(0, error="broker down")], tracker)
+
+        self.assertEqual(dict(grouped), {})
+        self.assertEqual(tracker.in_flight(), 0)
+
+
+class TestReleaseCasinos(unittest.TestCase):
+
+    @patch("kafka_app.batching.tenant_router")
+    def test_only_casinos_without_an_assigned_partition_are_released(self, mock_router):
+        other = ("coupons", 1)
+        partition_casinos = {PARTITION: {"7", "8"}, other: {"8", "9"}}
+
+        released = release_casinos(partition_casinos, [PARTITION])
+
+        self.assertEqual(released, {"7"})
+        self.assertEqual(partition_casinos, {other: {"8", "9"}})
+        mock_router.return_value.release.assert_called_once_with("7")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+from unittest.mock import patch, MagicMock
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.bulk import insert_ignoring_conflicts, uniform_rows, upsert_rows
+from app.db_models_shared import SharedBase, Team, User
+
+
+class TestInsertIgnoringConflicts(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine("sqlite://")
+        SharedBase.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_conflicting_rows_are_skipped(self):
+        insert_ignoring_conflicts(self.session, Team.__table__, [{"id": 1, "name": "ARSENAL", "sport": "FOOTBALL"}])
+
+        inserted = insert_ignoring_conflicts(self.session, Team.__table__, [
+            {"id": 2, "name": "ARSENAL", "sport": "FOOTBALL"},
+            {"id": 3, "name": "CHELSEA", "sport": "FOOTBALL"},
+            {"id": 4, "name": "CHELSEA", "sport": "FOOTBALL"},
+            {"id": 1, "name": "FULHAM", "sport": "FOOTBALL"},
+        ])
+
+        self.assertEqual(sorted(inserted), [3])
+        self.assertEqual(self.session.query(Team).count(), 2)
+
+    @patch("app.bulk.Config")
+    def test_large_batches_are_written_in_chunks(self, MockConfig):
+        MockConfig.BULK_INSERT_CHUNK_SIZE = 2
+        MockConfig.BULK_COPY_THRESHOLD = 1000
+        rows = [{"id": i, "name": f"TEAM{i}", "sport": "FOOTBALL"} for i in range(5)]
+
+        with patch.object(self.session, "execute", wraps=self.session.execute) as execute:
+            inserted = insert_ignoring_conflicts(self.session, Team.__table__, rows)
+
+        self.assertEqual(sorted(inserted), [0, 1, 2, 3, 4])
+        self.assertEqual(execute.call_count, 3)
+
+    def test_upsert_updates_existing_rows_and_inserts_new_ones(self):
+        insert_ignoring_conflicts(self.session, Team.__table__, [{"id": 1, "name": "ARSENAL", "sport": "FOOTBALL"}])
+
+        upsert_rows(self.session, Team.__table__, [{"id": 1, "name": "FULHAM", "sport": "FOOTBALL"},
+                                                   {"id": 2, "name": "CHELSEA", "sport": "FOOTBALL"}], ["id"])
+
+        self.assertEqual(self.session.query(Team.id, Team.name, Team.sport).order_by(Team.id).all(),
+                         [(1, "FULHAM", "FOOTBALL"), (2, "CHELSEA", "FOOTBALL")])
+
+    def test_absent_optional_fields_become_null(self):
+        keys, rows = uniform_rows([{"id": 1, "name": "A"}, {"id": 2, "surname": "B"}])
+
+        self.assertEqual(keys, ["id", "name", "surname"])
+        self.assertEqual(rows[1], {"id": 2, "name": None, "surname": "B"})
+
+    def test_empty_batch_runs_no_statement(self):
+        session = MagicMock()
+
+        self.assertEqual(insert_ignoring_conflicts(session, User.__table__, []), [])
+        session.execute.assert_not_called()
+
+    @patch("app.bulk.Config")
+    def test_postgres_copies_large_batches_through_a_staging_table(self, MockConfig):
+        MockConfig.BULK_COPY_THRESHOLD = 2
+        session = MagicMock()
+        session.get_bind.return_value.dialect.name = "postgresql"
+        session.get_bind.return_value.get_execution_options.return_value = {}
+        session.execute.return_value.scalars.return_value = [7]
+        cursor = session.connection.return_value.connection.cursor.return_value
+
+        inserted = insert_ignoring_conflicts(session, Team.__table__, [
+            {"id": 7, "name": "ARSENAL", "sport": "FOOTBALL"},
+            {"id": 8, "name": None, "sport": "FOOTBALL"},
+        ])
+
+        copy_sql, buffer = cursor.copy_expert.call_args.args
+        self.assertIn('COPY staging_teams ("id", "name", "sport") FROM STDIN', copy_sql)
+        self.assertEqual(buffer.getvalue().splitlines(), ["7,ARSENAL,FOOTBALL", "8,\\N,FOOTBALL"])
+        statements = [str(call.args[0]) for call in session.execute.call_args_list]
+        self.assertIn("ON CONFLICT DO NOTHING", statements[-1])
+        self.assertIn("INSERT INTO teams", statements[-1])
+        self.assertEqual(inserted, [7])
+
+
+if __name__ == '__main__':
+    unittest.main()
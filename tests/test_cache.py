@@ -0,0 +1,72 @@
+import unittest
+from unittest.mock import patch
+from app.cache import RecommendationCache
+
+
+class TestRecommendationCache(unittest.TestCase):
+
+    def test_get_returns_cached_value_until_ttl(self):
+        cache = RecommendationCache(ttl_seconds=10, max_entries=10)
+
+        with patch("app.cache.time.time", return_value=100):
+            cache.set(1, 42, "inference", {"user_id": 42})
+            self.assertEqual(cache.get(1, 42, "inference"), {"user_id": 42})
+
+        with patch("app.cache.time.time", return_value=111):
+            self.assertIsNone(cache.get(1, 42, "inference"))
+
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["expirations"]), (1, 1, 1))
+
+    def test_recommender_type_is_part_of_the_key(self):
+        cache = RecommendationCache(ttl_seconds=10, max_entries=10)
+        cache.set(1, 42, "inference", {"user_id": 42})
+
+        self.assertIsNone(cache.get(1, 42, "dynamic"))
+
+    def test_lru_eviction_per_casino(self):
+        cache = RecommendationCache(ttl_seconds=10, max_entries=2)
+        cache.set(1, 1, "static", "a")
+        cache.set(1, 2, "static", "b")
+        cache.get(1, 1, "static")
+        cache.set(1, 3, "static", "c")
+        cache.set(2, 1, "static", "d")
+
+        self.assertIsNone(cache.get(1, 2, "static"))
+        self.assertEqual(cache.get(1, 1, "static"), "a")
+        self.assertEqual(cache.get(2, 1, "static"), "d")
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_invalidate_users_and_whole_casino(self):
+        cache = RecommendationCache(ttl_seconds=10, max_entries=10)
+        for user_id in (1, 2, 3):
+            cache.set(7, user_id, "static", user_id)
+
+        cache.invalidate(7, [1, 1])
+        self.assertIsNone(cache.get(7, 1, "static"))
+        self.assertEqual(cache.get(7, 2, "static"), 2)
+
+        cache.invalidate(7)
+        self.assertIsNone(cache.get(7, 3, "static"))
+        self.assertEqual(cache.stats()["invalidations"], 3)
+
+    def test_newer_version_drops_the_entry(self):
+        cache = RecommendationCache(ttl_seconds=10, max_entries=10)
+        cache.set(1, 42, "static", "a", version=3)
+
+        self.assertEqual(cache.get(1, 42, "static", version=3), "a")
+        self.assertIsNone(cache.get(1, 42, "static", version=4))
+        self.assertIsNone(cache.get(1, 42, "static", version=3))
+        self.assertEqual(cache.stats()["invalidations"], 1)
+
+    def test_per_casino_overrides(self):
+        cache = RecommendationCache(ttl_seconds=10, max_entries=10, overrides={"5": {"ttl_seconds": 0}})
+        cache.set(5, 1, "static", "a")
+        cache.set(6, 1, "static", "b")
+
+        self.assertIsNone(cache.get(5, 1, "static"))
+        self.assertEqual(cache.get(6, 1, "static"), "b")
+
+
+if __name__ == '__main__':
+    unittest.main()
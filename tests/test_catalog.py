@@ -0,0 +1,216 @@
+import unittest
+from unittest.mock import patch, MagicMock
+from datetime import datetime, timedelta
+import numpy as np
+from app.catalog import EventCatalog, CatalogRow, event_catalogs, get_event_catalog, refresh_event_catalog, \
+get_catalog_stats
+
+
+def make_rows():
+    return [
+        CatalogRow(10, "SPAIN", "LA LIGA", "FOOTBALL", 2.65, "TEAM1", "TEAM2"),
+        CatalogRow(11, "USA", "NBA", "BASKETBALL", 2.85, "TEAM3", "TEAM4"),
+        CatalogRow(12, "SPAIN", "LA LIGA", "FOOTBALL", 3.10, "TEAM2", "TEAM1"),
+        CatalogRow(13, "FRANCE", "LIDL STARLIGUE", "HANDBALL", 3.15, "TEAM5", "TEAM6"),
+    ]
+
+
+class TestEventCatalog(unittest.TestCase):
+
+    def test_filter_positions_by_columns(self):
+        catalog = EventCatalog(1, make_rows())
+
+        self.assertEqual(catalog.filter_positions(sport="FOOTBALL", league="LA LIGA"), [0, 2])
+        self.assertEqual(catalog.filter_positions(limit=1, sport="FOOTBALL"), [0])
+        self.assertEqual(catalog.filter_positions(sport="CRICKET"), [])
+        self.assertEqual(catalog.filter_positions(limit=2, exclude=[0, 1]), [2, 3])
+
+    def test_event_data_decodes_interned_columns(self):
+        catalog = EventCatalog(1, make_rows())
+
+        self.assertEqual(catalog.event_data(1), {
+            "country": "USA",
+            "league": "NBA",
+            "home_team": "TEAM3",
+            "away_team": "TEAM4",
+            "sport": "BASKETBALL",
+            "odd": 2.85
+        })
+
+    def test_sport_league_pairs(self):
+        catalog = EventCatalog(1, make_rows())
+
+        self.assertEqual(sorted(catalog.sport_league_pairs()), [
+            ("BASKETBALL", "NBA"),
+            ("FOOTBALL", "LA LIGA"),
+            ("HANDBALL", "LIDL STARLIGUE")
+        ])
+
+    def test_pair_index_follows_appends(self):
+        rows = make_rows()
+        catalog = EventCatalog(1, rows[:2])
+
+        self.assertEqual(catalog.pair_positions("FOOTBALL", "LA LIGA"), [0])
+        catalog.patch(rows[2:])
+        self.assertEqual(catalog.pair_positions("FOOTBALL", "LA LIGA"), [0, 2])
+        self.assertEqual(catalog.pair_positions("FOOTBALL", "LA LIGA", limit=1), [0])
+        self.assertEqual(catalog.pair_positions("FOOTBALL", "NBA"), [])
+
+    def test_random_positions_come_from_the_fill_pool(self):
+        catalog = EventCatalog(1, make_rows())
+
+        self.assertEqual(sorted(catalog.fill_pool), [0, 1, 2, 3])
+        self.assertEqual(sorted(catalog.random_positions(2, exclude=[1, 3])), [0, 2])
+        self.assertEqual(len(catalog.random_positions(10)), 4)
+        self.assertEqual(catalog.random_positions(0), [])
+
+    def test_top_positions_ignore_rows_appended_after_scoring(self):
+        rows = make_rows()
+        catalog = EventCatalog(1, rows[:2])
+        scores = np.array([1.0, 2.0], dtype=np.float32)
+
+        catalog.patch(rows[2:])
+
+        self.assertEqual(catalog.top_positions(scores, 4).tolist(), [1, 0])
+
+    def test_patch_skips_known_ids(self):
+        catalog = EventCatalog(1, make_rows()[:2])
+
+        added = catalog.patch(make_rows())
+
+        self.assertEqual(added, 2)
+        self.assertEqual(catalog.ids.tolist(), [10, 11, 12, 13])
+        self.assertEqual(catalog.refreshes, 1)
+
+    def test_sync_fetches_only_missing_rows(self):
+        rows = make_rows()
+        catalog = EventCatalog(1, rows[:2])
+
+        mock_session = MagicMock()
+        mock_session.query.return_value.filter.return_value.all.side_effect = [
+            [(row.id, row.odd, None, None) for row in rows], rows[2:]]
+
+        catalog.sync(mock_session)
+
+        self.assertEqual(len(catalog), 4)
+        self.assertEqual(mock_session.query.return_value.filter.call_count, 2)
+
+    def test_sync_replaces_changed_rows_and_retires_vanished_ones(self):
+        rows = make_rows()
+        catalog = EventCatalog(1, rows)
+        moved = rows[1]._replace(odd=1.5)
+
+        mock_session = MagicMock()
+        mock_session.query.return_value.filter.return_value.all.side_effect = [
+            [(10, 2.65, None, None), (11, 1.5, None, None), (12, 3.10, None, None)], [moved]]
+
+        catalog.sync(mock_session)
+
+        self.assertEqual(catalog.live_count(), 3)
+        self.assertEqual(catalog.id_positions, {10: 0, 12: 2, 11: 4})
+        self.assertEqual(catalog.event_data(4)["odd"], 1.5)
+        self.assertEqual(catalog.filter_positions(), [0, 2, 4])
+        self.assertEqual(sorted(catalog.fill_pool), [0, 2, 4])
+        self.assertNotIn((catalog.code_of("sport", "HANDBALL"), catalog.code_of("league", "LIDL STARLIGUE")),
+                         catalog.pair_index)
+
+    def test_finished_events_are_retired_in_place(self):
+        now = datetime.utcnow()
+        rows = make_rows()
+        rows[0] = rows[0]._replace(begin_timestamp=now - timedelta(hours=2), end_timestamp=now - timedelta(hours=1))
+        rows[1] = rows[1]._replace(begin_timestamp=now, end_timestamp=now + timedelta(hours=1))
+        catalog = EventCatalog(1, rows)
+
+        self.assertTrue(catalog.has_finished_events())
+        self.assertEqual(catalog.retire_finished(), 1)
+
+        self.assertFalse(catalog.has_finished_events())
+        self.assertEqual(catalog.pair_positions("FOOTBALL", "LA LIGA"), [2])
+        self.assertEqual(catalog.top_positions(np.array([9, 1, 2, 3]), 2).tolist(), [3, 2])
+        self.assertEqual(catalog.stats()["events"], 3)
+
+    def test_stats(self):
+        catalog = EventCatalog(1, make_rows())
+        stats = catalog.stats()
+
+        self.assertEqual(stats["events"], 4)
+        self.assertEqual(stats["vocabulary_sizes"]["league"], 3)
+        self.assertGreater(stats["nbytes"], 0)
+
+
+class TestGetEventCatalog(unittest.TestCase):
+
+    def setUp(self):
+        event_catalogs.clear()
+
+    def test_get_event_catalog_loads_once(self):
+        mock_session = MagicMock()
+        mock_session.query.return_value.filter.return_value.all.return_value = make_rows()
+
+        catalog = get_event_catalog(7, mock_session)
+        again = get_event_catalog(7, mock_session)
+
+        self.assertIs(catalog, again)
+        self.assertEqual(mock_session.query.return_value.filter.return_value.all.call_count, 1)
+        self.assertEqual(get_catalog_stats(7)["events"], 4)
+
+    @patch("app.catalog.Config.EVENT_CATALOG_SYNC_SECONDS", 0)
+    def test_get_event_catalog_syncs_when_stale(self):
+        mock_session = MagicMock()
+        mock_session.query.return_value.filter.return_value.all.return_value = make_rows()[:2]
+        get_event_catalog(7, mock_session)
+
+        with patch.object(EventCatalog, "sync") as mock_sync:
+            get_event_catalog(7, mock_session)
+            mock_sync.assert_called_once_with(mock_session)
+
+    def test_get_event_catalog_retires_finished_events_without_a_reload(self):
+        now = datetime.utcnow()
+        rows = make_rows()
+        rows[0] = rows[0]._replace(begin_timestamp=now - timedelta(hours=2), end_timestamp=now - timedelta(hours=1))
+        catalog = EventCatalog(7, rows)
+        event_catalogs[7] = catalog
+        mock_session = MagicMock()
+
+        self.assertIs(get_event_catalog(7, mock_session), catalog)
+        self.assertEqual(catalog.filter_positions(), [1, 2, 3])
+        mock_session.query.assert_not_called()
+
+    @patch("app.catalog.COMPACT_MIN_RETIRED", 2)
+    def test_get_event_catalog_compacts_once_retired_positions_dominate(self):
+        now = datetime.utcnow()
+        finished = {"begin_timestamp": now - timedelta(hours=2), "end_timestamp": now - timedelta(hours=1)}
+        rows = [row._replace(**finished) if row.id != 13 else row for row in make_rows()]
+        catalog = EventCatalog(7, rows)
+        event_catalogs[7] = catalog
+
+        mock_session = MagicMock()
+        mock_session.query.return_value.filter.return_value.all.return_value = rows[3:]
+        served = get_event_catalog(7, mock_session)
+
+        self.assertIs(served, catalog)
+        self.assertIsNot(event_catalogs[7], catalog)
+        self.assertEqual(event_catalogs[7].ids.tolist(), [13])
+
+    def test_patch_skips_finished_and_far_future_events(self):
+        now = datetime.utcnow()
+        rows = make_rows()
+        rows[1] = rows[1]._replace(begin_timestamp=now - timedelta(hours=3), end_timestamp=now - timedelta(hours=1))
+        rows[2] = rows[2]._replace(begin_timestamp=now + timedelta(days=365), end_timestamp=now + timedelta(days=365))
+        rows[3] = rows[3]._replace(begin_timestamp=now + timedelta(hours=1), end_timestamp=now + timedelta(hours=2))
+        catalog = EventCatalog(7)
+
+        self.assertEqual(catalog.patch(rows), 2)
+        self.assertEqual(catalog.ids.tolist(), [10, 13])
+        self.assertFalse(catalog.has_finished_events())
+
+    def test_refresh_event_catalog_patches_loaded_catalog_only(self):
+        self.assertEqual(refresh_event_catalog(7, make_rows()), 0)
+
+        event_catalogs[7] = EventCatalog(7, make_rows()[:1])
+        self.assertEqual(refresh_event_catalog(7, make_rows()), 3)
+        self.assertIsNone(get_catalog_stats(8))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import os
+import json
+import tempfile
+import unittest
+from unittest.mock import patch
+import numpy as np
+from app.catalog import EventCatalog, CatalogRow
+from app.collaborative import build_interactions, train_als, save_model, load_collaborative_model, \
+collaborative_models
+
+
+def leg(sport, league, home_team, away_team):
+    return {"sport": sport, "league": league, "home_team": home_team, "away_team": away_team}
+
+
+FOOTBALL = leg("FOOTBALL", "LA LIGA", "REAL MADRID", "BARCELONA")
+BASKETBALL = leg("BASKETBALL", "NBA", "LAKERS", "CELTICS")
+
+
+class TestBuildInteractions(unittest.TestCase):
+
+    def test_build_interactions_counts_items_per_user(self):
+        rows = [(7, [FOOTBALL, FOOTBALL]), (9, [BASKETBALL]), (7, None)]
+
+        interactions, user_ids, items = build_interactions(rows)
+
+        self.assertEqual(user_ids, [7, 9])
+        self.assertEqual(interactions.shape, (2, 8))
+        self.assertEqual(interactions[0, items.index("LEAGUE:LA LIGA")], 2)
+        self.assertEqual(interactions[0, items.index("TEAM:BARCELONA")], 2)
+        self.assertEqual(interactions[1, items.index("SPORT:BASKETBALL")], 1)
+        self.assertEqual(interactions[1, items.index("SPORT:FOOTBALL")], 0)
+
+
+class TestTrainAls(unittest.TestCase):
+
+    def test_users_score_their_own_items_higher(self):
+        rows = [(1, [FOOTBALL] * 3), (2, [FOOTBALL] * 2), (3, [BASKETBALL] * 3), (4, [BASKETBALL])]
+        interactions, user_ids, items = build_interactions(rows)
+
+        user_factors, item_factors = train_als(interactions, factors=4, iterations=10, regularization=0.1, alpha=10)
+        scores = user_factors @ item_factors.T
+
+        football, basketball = items.index("LEAGUE:LA LIGA"), items.index("LEAGUE:NBA")
+        self.assertGreater(scores[0, football], scores[0, basketball])
+        self.assertGreater(scores[3, basketball], scores[3, football])
+
+
+class TestCollaborativeModel(unittest.TestCase):
+
+    def setUp(self):
+        collaborative_models.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.patcher = patch("app.collaborative.Config.COLLABORATIVE_MODEL_DIR", self.directory.name)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.directory.cleanup()
+
+    def test_load_returns_none_without_model(self):
+        self.assertIsNone(load_collaborative_model(1))
+
+    def test_saved_model_is_memory_mapped_and_scores_catalog(self):
+        rows = [(5, [FOOTBALL] * 3), (2, [BASKETBALL] * 3)]
+        interactions, user_ids, items = build_interactions(rows)
+        user_factors, item_factors = train_als(interactions, factors=4, iterations=10, regularization=0.1, alpha=10)
+        save_model(1, user_ids, items, user_factors, item_factors)
+
+        model = load_collaborative_model(1)
+
+        self.assertIsInstance(model.user_factors, np.memmap)
+        self.assertEqual(list(model.user_ids), [2, 5])
+        self.assertIsNone(model.user_row(3))
+        self.assertIs(load_collaborative_model(1), model)
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name, "casino_1", "model.json")))
+
+        catalog = EventCatalog(1, [
+            CatalogRow(10, "USA", "NBA", "BASKETBALL", 1.5, "LAKERS", "CELTICS"),
+            CatalogRow(11, "SPAIN", "LA LIGA", "FOOTBALL", 2.0, "REAL MADRID", "BARCELONA"),
+            CatalogRow(12, "ITALY", "SERIE A", "TENNIS", 2.0, "UNKNOWN1", "UNKNOWN2"),
+        ])
+        scores = model.score_events(5, catalog)
+
+        self.assertEqual(scores.shape, (3,))
+        self.assertGreater(scores[1], scores[0])
+        self.assertEqual(scores[2], 0.0)
+        self.assertIsNone(model.score_events(3, catalog))
+
+    def train(self, rows):
+        interactions, user_ids, items = build_interactions(rows)
+        user_factors, item_factors = train_als(interactions, factors=4, iterations=2, regularization=0.1, alpha=10)
+        return save_model(1, user_ids, items, user_factors, item_factors)
+
+    def test_retrain_switches_versions_through_the_pointer(self):
+        first = self.train([(5, [FOOTBALL])])
+        model = load_collaborative_model(1)
+        second = self.train([(5, [FOOTBALL]), (6, [BASKETBALL])])
+        third = self.train([(7, [BASKETBALL])])
+
+        reloaded = load_collaborative_model(1)
+
+        self.assertIsNot(reloaded, model)
+        self.assertEqual(model.version, first)
+        self.assertEqual(reloaded.version, third)
+        self.assertEqual(list(reloaded.user_ids), [7])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.directory.name, "casino_1"))),
+                         sorted([second, third, "model.json"]))
+
+    def test_models_saved_before_versioning_still_load(self):
+        directory = os.path.join(self.directory.name, "casino_1")
+        os.makedirs(directory)
+        np.save(os.path.join(directory, "user_ids.npy"), np.array([4], dtype=np.int64))
+        np.save(os.path.join(directory, "user_factors.npy"), np.ones((1, 2), dtype=np.float32))
+        np.save(os.path.join(directory, "item_factors.npy"), np.ones((1, 2), dtype=np.float32))
+        with open(os.path.join(directory, "model.json"), "w") as file:
+            json.dump({"items": ["SPORT:FOOTBALL"], "trained_at": "2025-01-01T00:00:00"}, file)
+
+        model = load_collaborative_model(1)
+
+        self.assertIsNone(model.version)
+        self.assertEqual(model.user_row(4), 0)
+        self.assertEqual(model.item_index, {"SPORT:FOOTBALL": 0})
+
+    def test_item_codes_follow_the_catalog_generation(self):
+        self.train([(5, [FOOTBALL])])
+        model = load_collaborative_model(1)
+        rows = [CatalogRow(11, "SPAIN", "LA LIGA", "FOOTBALL", 2.0, "REAL MADRID", "BARCELONA")]
+        first, second = EventCatalog(1, rows), EventCatalog(1, rows[::-1])
+
+        self.assertIs(model.item_codes(first, "league"), model.item_codes(first, "league"))
+        self.assertIsNot(model.item_codes(second, "league"), model.item_codes(first, "league"))
+        self.assertEqual(len(model.code_maps), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
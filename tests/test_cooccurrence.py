@@ -0,0 +1,197 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from datetime import datetime
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.catalog import EventCatalog, CatalogRow
+from app.cooccurrence import CooccurrenceMatrix, build_cooccurrence_matrix, get_cooccurrence_matrix, \
+cooccurrence_matrices, rebuild_cooccurrence_matrix, rebuild_locks, catch_up_cooccurrence_matrix
+from app.coupon_events import record_coupon_events
+from app.db_models_shared import SharedBase, PurchasedCoupon
+
+
+def leg(league, home_team, away_team):
+    return {"sport": "FOOTBALL", "league": league, "home_team": home_team, "away_team": away_team}
+
+
+LA_LIGA = leg("LA LIGA", "REAL MADRID", "BARCELONA")
+SERIE_A = leg("SERIE A", "JUVENTUS", "MILAN")
+NBA = leg("NBA", "LAKERS", "CELTICS")
+
+
+def catalog():
+    return EventCatalog(1, [
+        CatalogRow(10, "USA", "NBA", "BASKETBALL", 1.5, "LAKERS", "CELTICS"),
+        CatalogRow(11, "ITALY", "SERIE A", "FOOTBALL", 2.0, "JUVENTUS", "MILAN"),
+        CatalogRow(12, "GERMANY", "BUNDESLIGA", "FOOTBALL", 2.0, "BAYERN", "DORTMUND"),
+    ])
+
+
+class TestCooccurrenceMatrix(unittest.TestCase):
+
+    def test_pairs_are_counted_symmetrically(self):
+        cooccurrence = CooccurrenceMatrix(1)
+        cooccurrence.add_coupon([LA_LIGA, SERIE_A])
+        cooccurrence.add_coupon([LA_LIGA, SERIE_A, NBA])
+
+        scores = cooccurrence.item_scores([leg("LA LIGA", None, None)])
+        index = cooccurrence.item_index
+
+        self.assertEqual(scores[index["LEAGUE:SERIE A"]], 2)
+        self.assertEqual(scores[index["LEAGUE:NBA"]], 1)
+        self.assertEqual(scores[index["LEAGUE:LA LIGA"]], 0)
+        self.assertEqual((cooccurrence.matrix != cooccurrence.matrix.T).nnz, 0)
+        self.assertEqual(cooccurrence.stats()["pending"], 0)
+
+    def test_matrix_grows_with_later_coupons(self):
+        cooccurrence = CooccurrenceMatrix(1)
+        cooccurrence.add_coupon([LA_LIGA, SERIE_A])
+        cooccurrence.item_scores([LA_LIGA])
+        cooccurrence.add_coupon([LA_LIGA, NBA])
+
+        scores = cooccurrence.item_scores([LA_LIGA])
+
+        self.assertEqual(cooccurrence.matrix.shape, (9, 9))
+        self.assertEqual(cooccurrence.matrix.indices.dtype, np.int32)
+        self.assertGreater(scores[cooccurrence.item_index["TEAM:LAKERS"]], 0)
+
+    def test_score_events_ranks_co_picked_events(self):
+        cooccurrence = CooccurrenceMatrix(1)
+        cooccurrence.add_coupon([LA_LIGA, SERIE_A])
+        cooccurrence.add_coupon([LA_LIGA, SERIE_A])
+        cooccurrence.add_coupon([LA_LIGA, NBA])
+
+        scores = cooccurrence.score_events([LA_LIGA], catalog())
+
+        self.assertGreater(scores[1], scores[0])
+        self.assertGreater(scores[0], 0)
+        self.assertEqual(scores[2], 0)
+        self.assertIsNone(cooccurrence.score_events([leg("EREDIVISIE", "AJAX", "PSV")], catalog()))
+
+
+class TestCooccurrenceCache(unittest.TestCase):
+
+    def setUp(self):
+        cooccurrence_matrices.clear()
+        self.session = MagicMock()
+        self.session.query.return_value.filter.return_value.yield_per.return_value = [([LA_LIGA, NBA],)]
+        self.session.query.return_value.scalar.return_value = 0
+        patcher = patch("app.cooccurrence.get_casino_db_session", return_value=self.session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch("app.cooccurrence.threading.Thread")
+    def test_first_request_builds_in_the_background(self, MockThread):
+        cooccurrence = get_cooccurrence_matrix(1, MagicMock())
+
+        self.assertIsNone(cooccurrence.score_events([LA_LIGA], catalog()))
+        MockThread.assert_called_once_with(target=rebuild_cooccurrence_matrix, args=(1,), daemon=True)
+
+        rebuild_cooccurrence_matrix(1)
+        built = get_cooccurrence_matrix(1, MagicMock())
+        self.assertGreater(built.item_scores([LA_LIGA])[built.item_index["LEAGUE:NBA"]], 0)
+        self.session.close.assert_called_once()
+
+    def test_rebuild_reads_a_bounded_window(self):
+        build_cooccurrence_matrix(1, self.session)
+
+        (window, written), _ = self.session.query.return_value.filter.call_args
+        self.assertIn("purchased_coupons.timestamp >=", str(window))
+        self.assertIn("NOT (EXISTS", str(written))
+
+    @patch("app.cooccurrence.threading.Thread")
+    @patch("app.cooccurrence.Config.COOCCURRENCE_CATCHUP_SECONDS", 0)
+    def test_a_loaded_matrix_is_caught_up_in_the_background(self, MockThread):
+        rebuild_cooccurrence_matrix(1)
+        cooccurrence = cooccurrence_matrices[1]
+
+        self.assertIs(get_cooccurrence_matrix(1, MagicMock()), cooccurrence)
+        MockThread.assert_called_once_with(target=catch_up_cooccurrence_matrix, args=(1,), daemon=True)
+
+    @patch("app.cooccurrence.threading.Thread")
+    @patch("app.cooccurrence.Config.COOCCURRENCE_REBUILD_SECONDS", 0)
+    def test_stale_matrix_is_served_while_it_is_rebuilt(self, MockThread):
+        rebuild_cooccurrence_matrix(1)
+        first = cooccurrence_matrices[1]
+
+        self.assertIs(get_cooccurrence_matrix(1, MagicMock()), first)
+        MockThread.return_value.start.assert_called_once()
+
+        rebuild_cooccurrence_matrix(1)
+        self.assertIsNot(cooccurrence_matrices[1], first)
+
+    def test_one_rebuild_per_casino_at_a_time(self):
+        with rebuild_locks(1):
+            rebuild_cooccurrence_matrix(1)
+            rebuild_cooccurrence_matrix(2)
+
+        self.assertNotIn(1, cooccurrence_matrices)
+        self.assertIn(2, cooccurrence_matrices)
+
+    def test_item_codes_are_rebuilt_for_a_new_catalog(self):
+        cooccurrence = CooccurrenceMatrix(1)
+        cooccurrence.add_coupon([LA_LIGA, NBA])
+        first, second = catalog(), catalog()
+
+        codes = cooccurrence.item_codes(first, "league", 6)
+        self.assertIs(cooccurrence.item_codes(first, "league", 6), codes)
+        self.assertIsNot(cooccurrence.item_codes(second, "league", 6), codes)
+        self.assertEqual(len(cooccurrence.code_maps), 1)
+
+
+class TestCooccurrenceCatchUp(unittest.TestCase):
+
+    def setUp(self):
+        cooccurrence_matrices.clear()
+        engine = create_engine("sqlite://", poolclass=StaticPool)
+        SharedBase.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+        self.session = Session()
+        patcher = patch("app.cooccurrence.get_casino_db_session", side_effect=lambda casino_id: Session())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.add_coupons(1, [LA_LIGA, NBA])
+
+    def tearDown(self):
+        self.session.close()
+
+    def add_coupons(self, coupon_id, *coupons):
+        #stands in for the Kafka consumer writing coupons from another process
+        rows = [PurchasedCoupon(id=coupon_id + i, user_id=7, stake=5.0, timestamp=datetime.utcnow(),
+                                recommended_events=legs) for i, legs in enumerate(coupons)]
+        self.session.add_all(rows)
+        record_coupon_events(self.session, rows)
+        self.session.commit()
+
+    def test_coupons_written_elsewhere_are_added_once(self):
+        rebuild_cooccurrence_matrix(1)
+        cooccurrence = cooccurrence_matrices[1]
+        self.add_coupons(2, [LA_LIGA, SERIE_A], [LA_LIGA, NBA])
+
+        catch_up_cooccurrence_matrix(1)
+        catch_up_cooccurrence_matrix(1)
+
+        scores = cooccurrence.item_scores([leg("LA LIGA", None, None)])
+        self.assertEqual(scores[cooccurrence.item_index["LEAGUE:NBA"]], 2)
+        self.assertEqual(scores[cooccurrence.item_index["LEAGUE:SERIE A"]], 1)
+        self.assertEqual(cooccurrence.last_leg_id, 6)
+
+    def test_coupons_written_during_a_build_are_left_to_the_catch_up(self):
+        session = self.session
+        with patch("app.cooccurrence.latest_leg_id", return_value=2):
+            self.add_coupons(2, [LA_LIGA, SERIE_A])
+            cooccurrence = build_cooccurrence_matrix(1, session)
+        self.assertNotIn("LEAGUE:SERIE A", cooccurrence.item_index)
+
+        cooccurrence_matrices[1] = cooccurrence
+        catch_up_cooccurrence_matrix(1)
+
+        scores = cooccurrence.item_scores([leg("LA LIGA", None, None)])
+        self.assertEqual(scores[cooccurrence.item_index["LEAGUE:SERIE A"]], 1)
+        self.assertEqual(scores[cooccurrence.item_index["LEAGUE:NBA"]], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
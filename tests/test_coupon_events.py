@@ -0,0 +1,69 @@
+import unittest
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.coupon_events import record_coupon_events, user_sport_league_counts, coupon_event_rows, coupons_after, \
+latest_leg_id
+from app.db_models_shared import SharedBase, PurchasedCoupon, CouponEvent
+
+
+def leg(sport, league, country="SPAIN"):
+    return {"sport": sport, "league": league, "country": country, "home_team": "TEAM1", "away_team": "TEAM2"}
+
+
+class TestCouponEvents(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine("sqlite://")
+        SharedBase.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+
+        now = datetime.utcnow()
+        coupons = [
+            PurchasedCoupon(id=1, user_id=7, stake=5.0, timestamp=now - timedelta(days=1),
+                            recommended_events=[leg("FOOTBALL", "LA LIGA"), leg("FOOTBALL", "SERIE A")]),
+            PurchasedCoupon(id=2, user_id=7, stake=5.0, timestamp=now - timedelta(days=2),
+                            recommended_events=[leg("FOOTBALL", "LA LIGA"), leg("BASKETBALL", "NBA", "USA")]),
+            PurchasedCoupon(id=3, user_id=7, stake=5.0, timestamp=now - timedelta(days=60),
+                            recommended_events=[leg("BASKETBALL", "NBA", "USA")] * 3),
+            PurchasedCoupon(id=4, user_id=8, stake=5.0, timestamp=now,
+                            recommended_events=[leg("HANDBALL", "SEHA LEAGUE")]),
+        ]
+        self.session.add_all(coupons)
+        self.written = record_coupon_events(self.session, coupons)
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_every_leg_becomes_a_row(self):
+        self.assertEqual(self.written, 8)
+        self.assertEqual(self.session.query(CouponEvent).filter_by(coupon_id=3).count(), 3)
+
+    def test_user_sport_league_counts(self):
+        counts = user_sport_league_counts(self.session, 7, 30)
+
+        self.assertEqual(counts, {("FOOTBALL", "LA LIGA"): 2, ("FOOTBALL", "SERIE A"): 1, ("BASKETBALL", "NBA"): 1})
+        self.assertEqual(user_sport_league_counts(self.session, 9, 30), {})
+
+    def test_missing_leg_values_are_stored_as_null(self):
+        rows = coupon_event_rows(1, 7, datetime(2025, 6, 1), [{"sport": "FOOTBALL", "league": ""}])
+
+        self.assertEqual(rows[0]["league"], None)
+        self.assertEqual(rows[0]["home_team"], None)
+
+    def test_coupons_after_never_splits_the_last_coupon(self):
+        last_id, coupons = coupons_after(self.session, 0, 6)
+
+        self.assertEqual(last_id, 4)
+        self.assertEqual([len(legs) for _, legs in coupons], [2, 2])
+        self.assertEqual(coupons[0][1][1], leg("FOOTBALL", "SERIE A"))
+
+        last_id, coupons = coupons_after(self.session, last_id, 6)
+        self.assertEqual((last_id, [len(legs) for _, legs in coupons]), (8, [3, 1]))
+        self.assertEqual(coupons_after(self.session, last_id, 6), (8, []))
+        self.assertEqual(latest_leg_id(self.session), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
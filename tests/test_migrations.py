@@ -0,0 +1,71 @@
+import unittest
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+from app.migrations import pending_timestamp_columns, pending_bigint_columns, add_unique_users_index, \
+    DuplicateUsersError
+
+
+class TestPendingTimestampColumns(unittest.TestCase):
+
+    def test_only_string_timestamp_columns_are_pending(self):
+        engine = create_engine("sqlite://")
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TABLE purchased_coupons (id INTEGER PRIMARY KEY, timestamp VARCHAR(30))"))
+            connection.execute(text("CREATE TABLE events (id INTEGER PRIMARY KEY, begin_timestamp DATETIME, "
+                                    "end_timestamp VARCHAR(30))"))
+
+        self.assertEqual(pending_timestamp_columns(engine),
+                         [("purchased_coupons", "timestamp"), ("events", "end_timestamp")])
+
+    def test_only_integer_id_columns_are_pending(self):
+        engine = create_engine("sqlite://")
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY)"))
+            connection.execute(text("CREATE TABLE teams (id BIGINT PRIMARY KEY)"))
+
+        self.assertEqual(pending_bigint_columns(engine), [("users", "id")])
+
+    def test_schema_tenants_are_inspected_in_their_schema(self):
+        engine = create_engine("sqlite://", poolclass=StaticPool)
+        with engine.begin() as connection:
+            connection.execute(text("ATTACH DATABASE ':memory:' AS casino_1"))
+            connection.execute(text("CREATE TABLE casino_1.purchased_coupons (id INTEGER PRIMARY KEY, timestamp VARCHAR(30))"))
+
+        tenant = engine.execution_options(schema_translate_map={None: "casino_1"})
+
+        self.assertEqual(pending_timestamp_columns(engine), [])
+        self.assertEqual(pending_timestamp_columns(tenant), [("purchased_coupons", "timestamp")])
+
+
+class TestAddUniqueUsersIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine("sqlite://", poolclass=StaticPool)
+        with self.engine.begin() as connection:
+            connection.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY, name VARCHAR(50), surname VARCHAR(50))"))
+            connection.execute(text("INSERT INTO users VALUES (1, 'JOHN', 'DOE'), (2, 'JANE', 'DOE')"))
+
+    def index_names(self):
+        with self.engine.connect() as connection:
+            return [row[1] for row in connection.execute(text("PRAGMA index_list(users)"))]
+
+    def test_index_is_created_when_users_are_unique(self):
+        add_unique_users_index(self.engine)
+        add_unique_users_index(self.engine)
+
+        self.assertEqual(self.index_names(), ["uq_users_name_surname"])
+
+    def test_duplicates_are_reported_and_no_index_is_created(self):
+        with self.engine.begin() as connection:
+            connection.execute(text("INSERT INTO users VALUES (3, 'JOHN', 'DOE'), (4, 'JOHN', 'DOE'), (5, 'JANE', 'DOE')"))
+
+        with self.assertRaises(DuplicateUsersError) as raised:
+            add_unique_users_index(self.engine)
+
+        self.assertEqual(raised.exception.duplicates, [("JOHN", "DOE", 3), ("JANE", "DOE", 2)])
+        self.assertIn("JOHN DOE (3 rows)", str(raised.exception))
+        self.assertEqual(self.index_names(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+from unittest.mock import patch, MagicMock
+from app.precompute import precompute_chunk, write_precomputed, iter_user_id_chunks
+
+
+class TestPrecomputeChunk(unittest.TestCase):
+
+    @patch("app.precompute.purchase_versions", return_value={1: 4, 2: 0, 3: 0})
+    @patch("app.precompute.get_casino_db_session")
+    @patch("app.precompute.recommender_registry", new_callable=dict)
+    def test_precompute_chunk_skips_failing_users(self, mock_registry, mock_get_session, mock_versions):
+        def recommender(user_id, casino_id, session=None):
+            self.assertIs(session, mock_get_session.return_value)
+            if user_id == 2:
+                raise ValueError("User 2 not found")
+            return {"user_id": user_id, "recommended_events": []}
+
+        mock_registry["inference"] = recommender
+
+        rows, failed = precompute_chunk(7, "inference", [1, 2, 3])
+
+        self.assertEqual(failed, 1)
+        self.assertEqual([row["user_id"] for row in rows], [1, 3])
+        self.assertEqual(rows[0]["recommender_type"], "inference")
+        self.assertEqual(rows[0]["recommendation"], {"user_id": 1, "recommended_events": []})
+        #the purchase version read before computing is stored with the row
+        self.assertEqual([row["coupons_count"] for row in rows], [4, 0])
+        mock_versions.assert_called_once_with(7, [1, 2, 3], session=mock_get_session.return_value)
+        mock_get_session.return_value.rollback.assert_called_once()
+        mock_get_session.return_value.close.assert_called_once()
+
+
+class TestWritePrecomputed(unittest.TestCase):
+
+    def test_write_precomputed_replaces_rows_in_one_insert(self):
+        mock_session = MagicMock()
+        rows = [{"user_id": 1}, {"user_id": 2}]
+
+        written = write_precomputed(mock_session, rows)
+
+        self.assertEqual(written, 2)
+        mock_session.query.return_value.filter.return_value.delete.assert_called_once()
+        self.assertEqual(mock_session.execute.call_count, 1)
+        self.assertEqual(mock_session.execute.call_args[0][1], rows)
+        mock_session.commit.assert_called_once()
+
+    def test_write_precomputed_without_rows(self):
+        mock_session = MagicMock()
+
+        self.assertEqual(write_precomputed(mock_session, []), 0)
+        mock_session.execute.assert_not_called()
+
+
+class TestIterUserIdChunks(unittest.TestCase):
+
+    def test_iter_user_id_chunks(self):
+        mock_session = MagicMock()
+        mock_session.query.return_value.execution_options.return_value = iter([(1,), (2,), (3,)])
+
+        self.assertEqual(list(iter_user_id_chunks(mock_session, 2)), [[1, 2], [3]])
+        mock_session.query.return_value.execution_options.assert_called_once_with(yield_per=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
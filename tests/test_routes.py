@@ -1,9 +1,11 @@
 import unittest
+import json
 from unittest.mock import patch, MagicMock
 from flask import Flask
 from app.routes import main, CONFIGS
 from marshmallow import ValidationError
 from app import create_app
+from app.utils import ConnectionBudgetExceeded
 
 class TestRoutes(unittest.TestCase):
     def setUp(self):
@@ -139,6 +141,9 @@ class TestRoutes(unittest.TestCase):
         self.assertEqual(json_data["user_id"], user_id)
         self.assertEqual(json_data["bet"], 48.06)
         self.assertEqual(len(json_data["events"]), 3)
+        mock_recommendation_generator.assert_called_once_with(CONFIGS[casino_id], casino_id, user_id, session=mock_session)
+        mock_db_session.get.assert_not_called()
+        mock_session.close.assert_called_once()
         
     def test_recommend_casino_header_not_being_int(self):
         response = self.client.get(
@@ -239,4 +244,81 @@ class TestCreateCouponsRoute(unittest.TestCase):
         response = self.client.get("/purchase/123", headers={"Casino-ID": "abc"})
         self.assertEqual(response.status_code, 400)
         self.assertEqual(response.json, {"error": "Casino-ID must be an integer"})
-        
\ No newline at end of file
+
+    @patch("app.routes.get_casino_db_session", side_effect=ConnectionBudgetExceeded("Connection budget of 80 is in use"))
+    def test_a_full_connection_budget_asks_the_client_to_retry(self, mock_get_session):
+        response = self.client.get("/purchase/123", headers={"Casino-ID": "566550"})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        self.assertEqual(response.json, {"error": "Connection budget of 80 is in use"})
+        
+class TestRecommendBatchRoute(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.register_blueprint(main)
+        self.client = self.app.test_client()
+        self.headers = {"Casino-ID": "566550"}
+        CONFIGS[566550] = {
+            "recommender_type": "static",
+            "recommendation_schema": {"events": {"type": "list", "source_field": "recommended_events"}}
+        }
+
+    def tearDown(self):
+        CONFIGS.pop(566550, None)
+
+    @patch("app.routes.recommendation_generator")
+    @patch("app.routes.get_casino_db_session")
+    def test_recommend_batch_streams_one_line_per_user(self, mock_get_session, mock_recommendation_generator):
+        mock_session = MagicMock()
+        mock_session.query.return_value.filter.return_value.all.return_value = [(1,), (2,), (3,)]
+        mock_get_session.return_value = mock_session
+
+        def generator_side_effect(config, casino_id, user_id, session=None):
+            if user_id == 3:
+                raise ValueError("No available events in the system.")
+            return {"events": [], "user_id": user_id}
+
+        mock_recommendation_generator.side_effect = generator_side_effect
+
+        response = self.client.post("/recommend/batch", json={"user_ids": [1, 2, 3, 4, "x"]}, headers=self.headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+        self.assertEqual([line["user_id"] for line in lines], [1, 2, 3, 4, "x"])
+        self.assertEqual(lines[0]["recommendation"], {"events": [], "user_id": 1})
+        self.assertEqual(lines[2]["error"], "No available events in the system.")
+        self.assertEqual(lines[3]["error"], "User not found")
+        self.assertEqual(lines[4]["error"], "user_id must be an integer")
+        self.assertEqual(mock_session.query.call_count, 1)
+        mock_recommendation_generator.assert_any_call(CONFIGS[566550], 566550, 1, session=mock_session)
+        mock_session.rollback.assert_called_once()
+        mock_session.expunge_all.assert_called_once()
+        mock_session.close.assert_called_once()
+
+    @patch("app.routes.Config")
+    @patch("app.routes.recommendation_generator")
+    @patch("app.routes.get_casino_db_session")
+    def test_recommend_batch_expunges_after_each_chunk(self, mock_get_session, mock_recommendation_generator, MockConfig):
+        MockConfig.RECOMMEND_BATCH_MAX_USERS = 100
+        MockConfig.RECOMMEND_BATCH_CHUNK_SIZE = 2
+        mock_session = MagicMock()
+        mock_session.query.return_value.filter.return_value.all.return_value = [(1,), (2,), (3,), (4,), (5,)]
+        mock_get_session.return_value = mock_session
+        mock_recommendation_generator.return_value = {"events": []}
+
+        response = self.client.post("/recommend/batch", json={"user_ids": [1, 2, 3, 4, 5]}, headers=self.headers)
+
+        self.assertEqual(len(response.get_data(as_text=True).splitlines()), 5)
+        self.assertEqual(mock_session.expunge_all.call_count, 3)
+
+    def test_recommend_batch_requires_user_ids(self):
+        response = self.client.post("/recommend/batch", json={}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json, {"error": "user_ids must be a non-empty list"})
+
+    def test_recommend_batch_missing_casino_header(self):
+        response = self.client.post("/recommend/batch", json={"user_ids": [1]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json, {"error": "Casino-ID header is required"})
@@ -0,0 +1,126 @@
+import unittest
+import random
+import numpy as np
+from types import SimpleNamespace
+from app.scoring import EventScoringEngine, top_k_indices, stream_top_events, score_event
+
+
+def reference_scores(events, user, top_values):
+    score_list = []
+    for event in events:
+        score = 0
+        if event.country in user.country:
+            score += 1
+        if event.sport in user.favorite_sport:
+            score += 1
+        if event.country in top_values["country"][:1]:
+            score += 2
+        elif event.country in top_values["country"][1:2]:
+            score += 1
+        if event.sport in top_values["sport"][:1]:
+            score += 2
+        elif event.sport in top_values["sport"][1:2]:
+            score += 1
+        if event.league in top_values["league"][:1]:
+            score += 3
+        elif event.league in top_values["league"][1:2]:
+            score += 2
+        if event.home_team in top_values["home_team"][:1]:
+            score += 4
+        elif event.home_team in top_values["home_team"][1:2]:
+            score += 3
+        if event.away_team in top_values["away_team"][:1]:
+            score += 4
+        elif event.away_team in top_values["away_team"][1:2]:
+            score += 3
+        score_list.append((event, score))
+    return score_list
+
+
+def make_event(event_id, rng):
+    return SimpleNamespace(id=event_id,
+                           country=rng.choice(["USA", "SPAIN", "FRANCE", "US"]),
+                           league=rng.choice(["NBA", "LA LIGA", "EUROLEAGUE", "SEHA LEAGUE"]),
+                           sport=rng.choice(["FOOTBALL", "BASKETBALL", "HANDBALL"]),
+                           odd=round(rng.uniform(1.5, 3.5), 2),
+                           home_team=rng.choice(["TEAM1", "TEAM2", "TEAM3", "TEAM4"]),
+                           away_team=rng.choice(["TEAM1", "TEAM2", "TEAM3", "TEAM4"]))
+
+
+class TestTopKIndices(unittest.TestCase):
+
+    def test_top_k_indices_keeps_original_order_on_ties(self):
+        scores = np.array([1, 5, 3, 5, 3, 0])
+
+        self.assertEqual(top_k_indices(scores, 3).tolist(), [1, 3, 2])
+        self.assertEqual(top_k_indices(scores, 10).tolist(), [1, 3, 2, 4, 0, 5])
+        self.assertEqual(top_k_indices(scores, 0).tolist(), [])
+
+
+class TestEventScoringEngine(unittest.TestCase):
+
+    def test_top_events_match_reference_ladder(self):
+        rng = random.Random(7)
+        user = SimpleNamespace(country="USA", favorite_sport="FOOTBALL")
+        top_values = {
+            "country": ["SPAIN", "FRANCE"],
+            "sport": ["BASKETBALL"],
+            "league": ["NBA", "LA LIGA"],
+            "home_team": ["TEAM2", "TEAM3"],
+            "away_team": ["TEAM1"]
+        }
+
+        for size in (1, 5, 50, 500):
+            events = [make_event(i, rng) for i in range(size)]
+            engine = EventScoringEngine(events)
+
+            expected = sorted(reference_scores(events, user, top_values), key=lambda x: x[-1], reverse=True)
+
+            self.assertEqual(engine.score(user, top_values).tolist(),
+                             [score for _, score in reference_scores(events, user, top_values)])
+
+            for event_limit in (1, 3, 10):
+                result = engine.top_events(user, top_values, event_limit)
+                self.assertEqual(result, [{
+                    "country": e.country,
+                    "league": e.league,
+                    "home_team": e.home_team,
+                    "away_team": e.away_team,
+                    "sport": e.sport,
+                    "odd": e.odd
+                } for e, _ in expected[:event_limit]])
+
+    def test_stream_top_events_match_vectorized_scorer(self):
+        rng = random.Random(11)
+        user = SimpleNamespace(country="USA", favorite_sport="FOOTBALL")
+        top_values = {
+            "country": ["SPAIN"],
+            "sport": ["BASKETBALL", "HANDBALL"],
+            "league": ["NBA", "LA LIGA"],
+            "home_team": ["TEAM2", "TEAM3"],
+            "away_team": ["TEAM1"]
+        }
+
+        for size in (0, 1, 5, 50, 500):
+            events = [make_event(i, rng) for i in range(size)]
+            engine = EventScoringEngine(events)
+
+            self.assertEqual([score_event(event, user, top_values) for event in events],
+                             engine.score(user, top_values).tolist())
+            for event_limit in (0, 1, 3, 10):
+                self.assertEqual(stream_top_events(iter(events), user, top_values, event_limit),
+                                 engine.top_events(user, top_values, event_limit))
+
+    def test_append_interns_values_and_grows_columns(self):
+        rng = random.Random(3)
+        engine = EventScoringEngine([make_event(0, rng)])
+        engine.append([make_event(i, rng) for i in range(1, 200)])
+
+        self.assertEqual(len(engine), 200)
+        self.assertEqual(engine.ids.tolist(), list(range(200)))
+        self.assertLessEqual(len(engine.vocabularies["league"]), 4)
+        self.assertEqual(engine.code_of("league", "MISSING"), -1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,10 +2,24 @@ import unittest
 from unittest.mock import patch, MagicMock
 from app.services import create_teams, create_users, create_events, recommendation_generator,\
 create_casinos, create_user_profile, create_purchased_coupons, register_recommendation, recommender_registry,\
-get_all_sport_league_tuples, dynamic_recommendation, inference_score_recommendation, populate_db
+get_all_sport_league_tuples, dynamic_recommendation, inference_score_recommendation, populate_db, \
+get_precomputed_recommendation, collaborative_recommendation, cooccurrence_recommendation, \
+cold_start_pairs, provision_casinos, latest_precompute_run, precompute_runs
+from app.catalog import event_catalogs
+from app.affinity import new_user_affinity, apply_coupon
+from app.cache import recommendation_cache
+from app.scoring import top_k_indices
 from marshmallow import ValidationError
 from datetime import datetime
 import json
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.event import listen
+from app.db_models_shared import SharedBase, User, Team, Event, UserProfile, PurchasedCoupon, CouponEvent, \
+UserAffinity, PrecomputedRecommendation
 
 
 class TestCreateUserProfile(unittest.TestCase):
@@ -38,268 +52,128 @@ class TestCreateUserProfile(unittest.TestCase):
 
         
         
-class TestCreateTeams(unittest.TestCase):
-    
-     @patch('app.services.uppercase_dict')
-     @patch('app.services.generate_unique_id')
-     @patch('app.services.get_casino_db_session')
-     @patch('app.services.Team')
-     @patch('app.services.TeamSchema')     
-     def test_create_teams(self, MockTeamSchema, MockTeam, mock_get_session, mock_generate_id,
-                           mock_uppercase_dict):
-         
-         casino_id = 23341
-         team_data_list = [
-           {
-            'name': 'Team1479550626201', 
-            'sport': "football"
-           },
-           {
-            'name': 'Team2008486497112', 
-            'sport': "basketball"
-           }
-         ]
-         
-         mock_generate_id.side_effect = [917918, 702249]
-         
-         mock_session = MagicMock()
-         mock_get_session.return_value = mock_session
-         
-         team_data_upper_1 = {
-             'id': 917918,
-             'name': 'TEAM1479550626201', 
-             'sport': "FOOTBALL"
-         }
-         team_data_upper_2 = {
-             'id': 702249,
-             'name': 'TEAM2008486497112', 
-             'sport': "BASKETBALL"
-         }
-         
-         mock_uppercase_dict.side_effect = [team_data_upper_1, team_data_upper_2]
-         
-         mock_schema = MagicMock()
-         mock_schema.load.side_effect = [team_data_upper_1, team_data_upper_2]
-         MockTeamSchema.return_value = mock_schema
-         
-         mock_team1 = MagicMock(id=917918)
-         mock_team2 = MagicMock(id=702249)
-         MockTeam.side_effect = [mock_team1, mock_team2]
-         
-         mock_session.query().filter().first.return_value = None
-         
-         teams = create_teams(team_data_list, casino_id=casino_id)  
-         
-         MockTeamSchema.return_value = mock_schema
-         
-         self.assertEqual(teams, [mock_team1, mock_team2])
-         self.assertEqual(mock_schema.load.call_count, 2)
-         self.assertEqual(mock_session.add.call_count, 2)
-         mock_session.add.assert_any_call(mock_team1)
-         mock_session.add.assert_any_call(mock_team2)
-         self.assertTrue(mock_session.commit.called)
-     
-     @patch('app.services.uppercase_dict')
-     @patch('app.services.generate_unique_id')
-     @patch('app.services.get_casino_db_session')
-     @patch('app.services.Team')
-     @patch('app.services.TeamSchema')
-     def test_create_teams_with_validation_error(self, MockTeamSchema, MockTeam, mock_get_session, mock_generate_id,
-                                                 mock_uppercase_dict):
-         team_data_list = [
-             {'name': 'Team1479550626201',
-              'sport': "football"},
-             {'bad_data': True}  
-         ]
-         
-         mock_generate_id.side_effect = [917918, 999999]
+class TenantDbTestCase(unittest.TestCase):
+    """Runs the bulk writers against an in-memory SQLite casino database."""
 
-         mock_session = MagicMock()
-         mock_get_session.return_value = mock_session
-         
-         mock_session.query.return_value.filter.return_value.first.return_value = None
-         
-         team_data_upper_1 = {
-             'id': 917918,
-             'name': 'TEAM1479550626201',
-             'sport': "FOOTBALL"
-         }
-         
-         team_data_upper_2 = {'bad_data': True}
-         
-         mock_uppercase_dict.side_effect = [team_data_upper_1, team_data_upper_2]
-         
-         mock_schema = MagicMock()
-         mock_schema.load.side_effect = [
-             team_data_upper_1,
-             ValidationError("Invalid team data")
-         ]
-          
-         MockTeamSchema.return_value = mock_schema
-         
-         mock_team = MagicMock()
-         mock_team.id = 917918
-         MockTeam.return_value = mock_team
-         
-         with patch('builtins.print') as mock_print:
-             teams = create_teams(team_data_list,  casino_id=784672)
-             printed_calls = [call.args[0] for call in mock_print.call_args_list]
-             self.assertTrue(
-                 any("Validation error for team" in msg and "Invalid team data" in msg for msg in printed_calls),
-                 f"Expected error message not found in: {printed_calls}"
-            )
-         self.assertEqual(teams, [mock_team])
-         self.assertEqual(mock_schema.load.call_count, 2)
-         self.assertEqual(mock_session.add.call_count, 1)
-         self.assertEqual(mock_session.flush.call_count, 0)
-         self.assertTrue(mock_session.commit.called)
+    def setUp(self):
+        self.engine = create_engine("sqlite://", poolclass=StaticPool)
+        SharedBase.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        self.next_id = 1000
+
+        def next_ids(session, Model, count):
+            ids = list(range(self.next_id, self.next_id + count))
+            self.next_id += count
+            return ids
+
+        patchers = [
+            patch('app.services.get_casino_db_session', side_effect=lambda casino_id: self.Session()),
+            patch('app.services.generate_unique_ids', side_effect=next_ids),
+            patch('builtins.print'),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.session = self.Session()
+        self.addCleanup(self.session.close)
+
+
+class TestCreateTeams(TenantDbTestCase):
+
+    def test_create_teams(self):
+        team_data_list = [
+            {'name': 'Team1479550626201', 'sport': "football"},
+            {'name': 'Team2008486497112', 'sport': "basketball"}
+        ]
+
+        teams = create_teams(team_data_list, casino_id=23341)
+
+        self.assertEqual([(t.id, t.name, t.sport) for t in teams],
+                         [(1000, 'TEAM1479550626201', 'FOOTBALL'), (1001, 'TEAM2008486497112', 'BASKETBALL')])
+        self.assertEqual(self.session.query(Team).count(), 2)
+
+    def test_create_teams_skips_duplicates_and_invalid_rows(self):
+        create_teams([{'name': 'Arsenal', 'sport': 'football'}], casino_id=1)
+
+        teams = create_teams([{'name': 'Arsenal', 'sport': 'football'},
+                              {'name': 'Chelsea', 'sport': 'football'},
+                              {'name': 'Chelsea', 'sport': 'football'},
+                              {'bad_data': True}], casino_id=1)
+
+        self.assertEqual([t.name for t in teams], ['CHELSEA'])
+        self.assertEqual(sorted(name for name, in self.session.query(Team.name)), ['ARSENAL', 'CHELSEA'])
+
+    def test_create_teams_with_validation_error(self):
+        with patch('app.services.TeamSchema') as MockTeamSchema:
+            MockTeamSchema.return_value.load.side_effect = [
+                {'id': 1000, 'name': 'TEAM1479550626201', 'sport': 'FOOTBALL'},
+                ValidationError("Invalid team data")
+            ]
+            with patch('builtins.print') as mock_print:
+                teams = create_teams([{'name': 'Team1479550626201', 'sport': "football"}, {'bad_data': True}],
+                                     casino_id=784672)
+            printed_calls = [call.args[0] for call in mock_print.call_args_list]
+
+        self.assertTrue(any("Validation error for team" in msg and "Invalid team data" in msg for msg in printed_calls),
+                        f"Expected error message not found in: {printed_calls}")
+        self.assertEqual([t.id for t in teams], [1000])
          
          
-class TestCreateUsers(unittest.TestCase):
+class TestCreateUsers(TenantDbTestCase):
 
-    @patch('app.services.uppercase_dict')
-    @patch('app.services.create_user_profile')
-    @patch('app.services.generate_unique_id')
-    @patch('app.services.get_casino_db_session')
-    @patch('app.services.User')
-    @patch('app.services.UserResponseSchema')
-    def test_create_users(self, MockUserResponseSchema, MockUser, mock_get_session, mock_generate_id,
-                          mock_create_profile, mock_uppercase_dict):
-        
-        casino_id = 23341
+    user_data = {'birth_year': 1995, 'currency': 'USD', 'country': 'USA', 'gender': 'OTHER',
+                 'timestamp': '2025-04-25T08:11:11.663775', 'favorite_sport': 'football'}
+
+    def test_create_users(self):
         user_data_list = [
-            {'birth_year': 1995,
-             'currency': 'USD', 
-             'country': 'USA', 
-             'gender': 'OTHER', 
-             'timestamp': '2025-04-25T08:11:11.663775', 
-             'favorite_sport': 'football'
-             },
-            {'birth_year': 1961, 
-             'currency': 'EUR', 
-             'country': 'Australia', 
-             'gender': 'FEMALE', 
-             'timestamp': '2025-04-25T08:11:11.663906', 
-             'favorite_sport': 'basketball'
-             }
+            dict(self.user_data, name='John', surname='Doe'),
+            {'birth_year': 1961, 'currency': 'EUR', 'country': 'Australia', 'gender': 'FEMALE',
+             'timestamp': '2025-04-25T08:11:11.663906', 'favorite_sport': 'basketball',
+             'name': 'Jane', 'surname': 'Roe'}
         ]
-            
-        mock_generate_id.side_effect = [917918, 702249]
-        
-        mock_session = MagicMock()
-        mock_get_session.return_value = mock_session
-        
-        user_data_upper_1 = {
-            'id': 917918,
-            'birth_year': 1995,
-            'currency': 'USD',
-            'country': 'USA',
-            'gender': 'OTHER',
-            'timestamp': '2025-04-25T08:11:11.663775',
-            'favorite_sport': 'FOOTBALL'
-        }
-        user_data_upper_2 = {
-            'id': 702249,
-            'birth_year': 1961,
-            'currency': 'EUR',
-            'country': 'AUSTRALIA',
-            'gender': 'FEMALE',
-            'timestamp': '2025-04-25T08:11:11.663906',
-            'favorite_sport': 'BASKETBALL'
-        }
-        
-        mock_uppercase_dict.side_effect = [user_data_upper_1, user_data_upper_2]
 
-        mock_schema = MagicMock()
-        mock_schema.load.side_effect = [user_data_upper_1, user_data_upper_2]
-        MockUserResponseSchema.return_value = mock_schema
-        
-        mock_user1 = MagicMock(id=917918)
-        mock_user2 = MagicMock(id=702249)
-        MockUser.side_effect = [mock_user1, mock_user2]
-        
-        mock_session.query().filter().first.return_value = None
-        
-        users = create_users(user_data_list, casino_id=casino_id)  
-        
-        self.assertEqual(users, [mock_user1, mock_user2])
-        self.assertEqual(mock_schema.load.call_count, 2)
-        self.assertEqual(mock_session.add.call_count, 2)
-        self.assertEqual(mock_session.flush.call_count, 2)
-        self.assertTrue(mock_session.commit.called)
+        users = create_users(user_data_list, casino_id=23341)
 
-        self.assertEqual(mock_create_profile.call_count, 2)
-        mock_create_profile.assert_any_call(917918, session=mock_session)
-        mock_create_profile.assert_any_call(702249, session=mock_session)
-    
-    @patch('app.services.uppercase_dict')
-    @patch('app.services.create_user_profile')
-    @patch('app.services.generate_unique_id')
-    @patch('app.services.get_casino_db_session')
-    @patch('app.services.User')
-    @patch('app.services.UserResponseSchema')
-    def test_create_users_with_validation_error(self, MockUserResponseSchema, MockUser, mock_get_session, mock_generate_id,
-                                                mock_create_profile, mock_uppercase_dict):
-             
-        user_data_list = [
-            {'birth_year': 1995, 
-             'currency': 'USD', 
-             'country': 'USA', 
-             'gender': 'OTHER',
-             'timestamp': '2025-04-25T08:11:11.663775', 
-             'favorite_sport': 'football'},
-            {'bad_data': True}
-        ]
-        
-        mock_generate_id.side_effect = [917918, 999999]
+        self.assertEqual([(u.id, u.name, u.country, u.favorite_sport) for u in users],
+                         [(1000, 'JOHN', 'USA', 'FOOTBALL'), (1001, 'JANE', 'AUSTRALIA', 'BASKETBALL')])
+        profiles = self.session.query(UserProfile.user_id, UserProfile.purchases_at_last_update).order_by(UserProfile.user_id)
+        self.assertEqual(profiles.all(), [(1000, 0), (1001, 0)])
 
-        mock_session = MagicMock()
-        mock_get_session.return_value = mock_session
-        
-        mock_session.query.return_value.filter.return_value.first.return_value = None
-        
-        user_data_upper_1 = {
-            'id': 917918,
-            'birth_year': 1995,
-            'currency': 'USD',
-            'country': 'USA',
-            'gender': 'OTHER',
-            'timestamp': '2025-04-25T08:11:11.663775',
-            'favorite_sport': 'FOOTBALL'
-        }
-        
-        user_data_upper_2 = {'bad_data': True}
-        
-        mock_uppercase_dict.side_effect = [user_data_upper_1, user_data_upper_2]
-        
-        mock_schema = MagicMock()
-        mock_schema.load.side_effect = [
-            user_data_upper_1,
-            ValidationError("Invalid user data")
-        ]
-        
-        MockUserResponseSchema.return_value = mock_schema
-        
-        mock_user = MagicMock()
-        mock_user.id = 917918
-        MockUser.return_value = mock_user
-        
+    def test_create_users_skips_duplicate_names(self):
+        create_users([dict(self.user_data, name='John', surname='Doe')], casino_id=1)
+
+        users = create_users([dict(self.user_data, name='john', surname='doe'),
+                              dict(self.user_data, name='John', surname='Smith'),
+                              dict(self.user_data, name='John', surname='Smith')], casino_id=1)
+
+        self.assertEqual([(u.name, u.surname) for u in users], [('JOHN', 'SMITH')])
+        self.assertEqual(self.session.query(User).count(), 2)
+        self.assertEqual(self.session.query(UserProfile).count(), 2)
+
+    def test_create_users_with_validation_error(self):
         with patch('builtins.print') as mock_print:
-            users = create_users(user_data_list,  casino_id=784672)
-     
-            printed_calls = [call.args[0] for call in mock_print.call_args_list]
-            self.assertTrue(
-                any("Validation error for user" in msg and "Invalid user data" in msg for msg in printed_calls),
-                f"Expected error message not found in: {printed_calls}"
-            )
-                          
-        self.assertEqual(users, [mock_user])
-        self.assertEqual(mock_schema.load.call_count, 2)
-        self.assertEqual(mock_session.add.call_count, 1)
-        self.assertEqual(mock_session.flush.call_count, 1)
-        self.assertTrue(mock_session.commit.called)
-        
-        mock_create_profile.assert_called_once_with(917918, session=mock_session)
+            users = create_users([dict(self.user_data, name='John', surname='Doe'),
+                                  dict(self.user_data, currency='BTC')], casino_id=784672)
+        printed_calls = [call.args[0] for call in mock_print.call_args_list]
+
+        self.assertTrue(any("Validation error for user" in msg and "currency" in msg for msg in printed_calls),
+                        f"Expected error message not found in: {printed_calls}")
+        self.assertEqual([u.id for u in users], [1000])
+        self.assertEqual(self.session.query(UserProfile.user_id).scalar(), 1000)
+
+    def test_nothing_is_returned_when_the_write_fails(self):
+        with patch('app.services.insert_ignoring_conflicts', side_effect=SQLAlchemyError("connection lost")):
+            users = create_users([dict(self.user_data, name='John', surname='Doe')], casino_id=1)
+
+        self.assertEqual(users, [])
+        self.assertEqual(self.session.query(User).count(), 0)
+
+    def test_the_consumer_gets_the_write_error(self):
+        with patch('app.services.insert_ignoring_conflicts', side_effect=SQLAlchemyError("connection lost")):
+            with self.assertRaises(SQLAlchemyError):
+                create_users([dict(self.user_data, name='John', surname='Doe')], casino_id=1, raise_errors=True)
+
+        self.assertEqual(self.session.query(User).count(), 0)
         
 class TestCreateCasinos(unittest.TestCase):
 
@@ -435,216 +309,135 @@ class TestCreateCasinos(unittest.TestCase):
         mock_create_db.assert_called_once_with(123)
         self.assertTrue(mock_session.commit.called)
 
-class TestCreateEvents(unittest.TestCase):
-
-    @patch('app.services.uppercase_dict')
-    @patch('app.services.generate_unique_id')
-    @patch('app.services.get_casino_db_session')
-    @patch('app.services.Event')
-    @patch('app.services.EventSchema')
-    @patch('app.services.Team')
-    def test_create_events(self, MockTeam, MockEventSchema, MockEvent, mock_get_session, mock_generate_id,
-                           mock_uppercase_dict):
-        casino_id = 23341
-        event_data_list = [
-            {'home_team_id': 601225, 
-             'away_team_id': 494044, 
-             'sport': 'football',
-             'begin_timestamp': '2025-03-28T08:11:11', 
-             'end_timestamp': '2025-03-28T09:11:11',
-             'country': 'USA', 
-             'league': 'NBA', 
-             'odd': 2.5}
-        ]
-        
-        mock_generate_id.return_value = 12345
-        
-        mock_session = MagicMock()
-        mock_get_session.return_value = mock_session
-        
-        event_data_upper = {
-          'id': 12345,
-          'sport': 'FOOTBALL',
-          'league': 'PREMIER LEAGUE',
-          'home_team': 'ARSENAL',
-          'away_team': 'CHELSEA',
-          'country': 'ENGLAND',
-          'timestamp': '2025-06-15T18:00:00',
-          'odd': 2.5
-        }
-        mock_uppercase_dict.return_value = event_data_upper
+    @patch('app.services.create_db_per_casino')
+    def test_provision_casinos_reports_every_casino(self, mock_create_db):
+        def create_db(casino_id):
+            if casino_id == 2:
+                raise RuntimeError("template is being accessed by other users")
+            return f"casino_{casino_id}"
+        mock_create_db.side_effect = create_db
 
-        mock_schema = MagicMock()
-        mock_schema.load.return_value = event_data_upper
-        MockEventSchema.return_value = mock_schema
-        
-        mock_event = MagicMock()
-        mock_event.home_team = 'ARSENAL'
-        mock_event.away_team = 'CHELSEA'
-        mock_event.teams = []
-        MockEvent.return_value = mock_event
+        with patch('builtins.print'):
+            statuses = provision_casinos([1, 2, 3], workers=2)
 
-        mock_home_team = MagicMock()
-        mock_away_team = MagicMock()
-        
-        mock_session.query.return_value.filter_by.side_effect = [
-           MagicMock(first=MagicMock(return_value=mock_home_team)),
-           MagicMock(first=MagicMock(return_value=mock_away_team))
-       ]
-        
-        events = create_events(event_data_list, casino_id=casino_id)
+        self.assertEqual([status["casino_id"] for status in statuses], [1, 2, 3])
+        self.assertEqual([status["status"] for status in statuses], ["ready", "failed", "ready"])
+        self.assertEqual(statuses[1]["error"], "template is being accessed by other users")
 
+class TestCreateEvents(TenantDbTestCase):
 
-        self.assertEqual(events, [mock_event])
-        self.assertEqual(mock_generate_id.call_count, 1)
-        self.assertEqual(mock_schema.load.call_count, 1)
-        self.assertEqual(mock_session.add.call_count, 1)
-        self.assertEqual(mock_event.teams, [mock_home_team, mock_away_team])
-        self.assertTrue(mock_session.commit.called)
-        self.assertTrue(mock_session.close.called)
-        
-        @patch('app.services.uppercase_dict')
-        @patch('app.services.generate_unique_id')
-        @patch('app.services.get_casino_db_session')
-        @patch('app.services.Event')
-        @patch('app.services.EventSchema')
-        def test_create_events_validation_error(self, MockEventSchema, MockEvent, mock_get_session, 
-                                                mock_generate_id, mock_uppercase_dict):
-            event_data_list = [{'invalid': 'data'}]
-    
-            mock_generate_id.return_value = 54321
-            mock_session = MagicMock()
-            mock_get_session.return_value = mock_session
-    
-            mock_uppercase_dict.return_value = {'invalid': 'DATA'}
-    
-            mock_schema = MagicMock()
-            mock_schema.load.side_effect = ValidationError("Invalid event data")
-            MockEventSchema.return_value = mock_schema
-    
-            with patch('builtins.print') as mock_print:
-                events = create_events(event_data_list, casino_id=222)
-    
-                mock_print.assert_called_once_with(
-                    "Validation error for event {'invalid': 'data'}: Invalid event data"
-                )
-    
-            self.assertEqual(events, [])
-            self.assertTrue(mock_session.commit.called)
-            self.assertTrue(mock_session.close.called)
+    def event_data(self, home_team, away_team):
+        return {'sport': 'football', 'league': 'Premier League', 'country': 'England', 'odd': 2.5,
+                'home_team': home_team, 'away_team': away_team,
+                'begin_timestamp': '2025-06-15T18:00:00', 'end_timestamp': '2025-06-15T20:00:00'}
 
-class TestCreatePurchasedCoupons(unittest.TestCase):
+    @patch('app.services.refresh_event_catalog')
+    def test_create_events(self, mock_refresh):
+        create_teams([{'name': 'Arsenal', 'sport': 'football'}, {'name': 'Chelsea', 'sport': 'football'}], casino_id=1)
 
-    @patch("app.services.uppercase_dict")
-    @patch("app.services.generate_unique_id")
-    @patch("app.services.get_casino_db_session")
-    @patch("app.services.PurchasedCouponSchema")
-    @patch("app.services.PurchasedCoupon")
-    @patch("app.services.UserProfile")
-    def test_create_purchased_coupons(self, MockUserProfile, MockPurchasedCoupon, MockPurchasedCouponSchema,
-                                      mock_get_session,mock_generate_id,mock_uppercase_dict,):
-        
-        coupon_data_list = [
-            {
-                'user_id': 917918,
-                'stake': 37.81,
-                'timestamp': '2025-04-25T12:49:15.399950',
-                'recommended_events': [],
-            },
-            {
-                'user_id': 836245,
-                'stake': 20.46,
-                'timestamp': '2025-04-25T12:49:15.399950',
-                'recommended_events': [],
-            }
-        ]
-        
-        mock_generate_id.side_effect = [555111, 555222]
-        mock_session = MagicMock()
-        mock_get_session.return_value = mock_session
-        
-        mock_profile_1 = MagicMock(purchases_at_last_update=5)
-        mock_profile_2 = MagicMock(purchases_at_last_update=2)
-        mock_session.query().filter_by().first.side_effect = [mock_profile_1, mock_profile_2]
-        
-        coupon_data_upper_1 = {
-            "id": 555111,
-            'user_id': 917918,
-            'stake': 37.81,
-            'timestamp': '2025-04-25T12:49:15.399950',
-            'recommended_events': [],
-        }
-        coupon_data_upper_2 = {
-            "id": 555222,
-            'user_id': 836245,
-            'stake': 20.46,
-            'timestamp': '2025-04-25T12:49:15.399950',
-            'recommended_events': [],
-        }
-        
-        mock_uppercase_dict.side_effect = [coupon_data_upper_1, coupon_data_upper_2]
+        events = create_events([self.event_data('Arsenal', 'Chelsea'), self.event_data('Arsenal', 'Fulham')],
+                               casino_id=1)
 
-        mock_schema = MagicMock()
-        mock_schema.load.side_effect = [coupon_data_upper_1, coupon_data_upper_2]
-        MockPurchasedCouponSchema.return_value = mock_schema
-    
-        mock_coupon_1 = MagicMock(id=555111)
-        mock_coupon_2 = MagicMock(id=555222)
-        MockPurchasedCoupon.side_effect = [mock_coupon_1, mock_coupon_2]
-    
-        coupons = create_purchased_coupons(coupon_data_list, casino_id=123456)
+        self.assertEqual([(e.home_team, e.away_team) for e in events], [('ARSENAL', 'CHELSEA'), ('ARSENAL', 'FULHAM')])
+        stored = self.session.get(Event, events[0].id)
+        self.assertEqual(sorted(team.name for team in stored.teams), ['ARSENAL', 'CHELSEA'])
+        self.assertEqual([team.name for team in self.session.get(Event, events[1].id).teams], ['ARSENAL'])
 
-        self.assertEqual(coupons, [mock_coupon_1, mock_coupon_2])
-        self.assertEqual(mock_schema.load.call_count, 2)
-        self.assertEqual(mock_session.add.call_count, 2)
-        self.assertTrue(mock_session.commit.called)
-        self.assertEqual(mock_profile_1.purchases_at_last_update, 6)
-        self.assertEqual(mock_profile_2.purchases_at_last_update, 3)
-        mock_session.close.assert_called_once()
-        mock_generate_id.assert_any_call(mock_session, MockPurchasedCoupon)
+        rows = mock_refresh.call_args.args[1]
+        self.assertEqual([row.id for row in rows], [e.id for e in events])
 
-    @patch("app.services.uppercase_dict")
-    @patch("app.services.generate_unique_id")
-    @patch("app.services.get_casino_db_session")
-    @patch("app.services.PurchasedCouponSchema")
-    @patch("app.services.PurchasedCoupon")
-    @patch("app.services.UserProfile")
-    def test_create_purchased_coupons_exception_handling(self, MockUserProfile, MockPurchasedCoupon, MockPurchasedCouponSchema,
-                                                         mock_get_session,mock_generate_id,mock_uppercase_dict,):
-        coupon_data_list = [
-            {
-                'user_id': 789,
-                'stake': 20.0,
-                'timestamp': '2025-12-31T23:59:59',
-                'recommended_events': []
-            }
-        ]
+    @patch('app.services.refresh_event_catalog')
+    def test_create_events_validation_error(self, mock_refresh):
+        with patch('builtins.print') as mock_print:
+            events = create_events([{'invalid': 'data'}], casino_id=222)
 
-        mock_session = MagicMock()
-        mock_get_session.return_value = mock_session
-        
-        mock_session.query.return_value.filter_by.return_value.first.return_value = None
-        
-        mock_query = MagicMock()
-        mock_query.filter_by.return_value.first.return_value = None
-        mock_session.query.return_value = mock_query
+        self.assertTrue(mock_print.call_args.args[0].startswith("Validation error for event {'invalid': 'data', 'id': 1000}"))
+        self.assertEqual(events, [])
+        self.assertEqual(mock_refresh.call_args.args[1], [])
 
-        mock_schema = MagicMock()
-        mock_schema.load.side_effect = Exception("Validation error")
-        MockPurchasedCouponSchema.return_value = mock_schema
+class TestCreatePurchasedCoupons(TenantDbTestCase):
 
+    def setUp(self):
+        super().setUp()
+        user_data = {'birth_year': 1995, 'currency': 'USD', 'country': 'USA', 'gender': 'OTHER',
+                     'timestamp': '2025-04-25T08:11:11.663775', 'favorite_sport': 'football'}
+        users = create_users([dict(user_data, name='John', surname='Doe'), dict(user_data, name='Jane', surname='Roe')],
+                             casino_id=1)
+        self.user_ids = [u.id for u in users]
+
+    def coupon(self, user_id, league='La Liga'):
+        return {'user_id': user_id, 'stake': 20.0, 'timestamp': '2025-04-25T12:49:15.399950',
+                'recommended_events': [{'sport': 'football', 'league': league, 'country': 'Spain',
+                                        'home_team': 'Team1', 'away_team': 'Team2', 'odd': 2.0}]}
+
+    def test_create_purchased_coupons(self):
+        john, jane = self.user_ids
+
+        coupons = create_purchased_coupons([self.coupon(john), self.coupon(jane), self.coupon(john, 'Serie A')],
+                                           casino_id=1)
+
+        self.assertEqual([c.user_id for c in coupons], [john, jane, john])
+        self.assertEqual(self.session.query(PurchasedCoupon).count(), 3)
+        self.assertEqual(self.session.query(CouponEvent).filter_by(user_id=john).count(), 2)
+        counts = self.session.query(UserProfile.user_id, UserProfile.purchases_at_last_update).order_by(UserProfile.user_id)
+        self.assertEqual(counts.all(), [(john, 2), (jane, 1)])
+        self.assertEqual(self.session.get(UserAffinity, john).league_counts, {'LA LIGA': 1, 'SERIE A': 1})
+
+    def test_purchase_drops_the_precomputed_row(self):
+        john, jane = self.user_ids
+        for user_id in self.user_ids:
+            self.session.add(PrecomputedRecommendation(user_id=user_id, recommender_type="inference",
+                                                       recommendation={}, generated_at=datetime.utcnow()))
+        self.session.commit()
+
+        create_purchased_coupons([self.coupon(john)], casino_id=1)
+
+        self.assertEqual([row.user_id for row in self.session.query(PrecomputedRecommendation)], [jane])
+
+    def test_a_failed_id_allocation_rolls_back_and_closes_the_session(self):
+        session = MagicMock()
+        with patch('app.services.get_casino_db_session', return_value=session), \
+                patch('app.services.generate_unique_ids', side_effect=SQLAlchemyError("sequence missing")):
+            coupons = create_purchased_coupons([self.coupon(self.user_ids[0])], casino_id=1)
+
+        self.assertEqual(coupons, [])
+        session.rollback.assert_called_once()
+        session.close.assert_called_once()
+
+    def test_a_failed_write_raises_for_the_consumer(self):
+        john, jane = self.user_ids
+
+        with patch('app.services.record_coupon_events', side_effect=SQLAlchemyError("connection lost")):
+            self.assertEqual(create_purchased_coupons([self.coupon(john)], casino_id=1), [])
+            with self.assertRaises(SQLAlchemyError):
+                create_purchased_coupons([self.coupon(jane)], casino_id=1, raise_errors=True)
+
+        self.assertEqual(self.session.query(PurchasedCoupon).count(), 0)
+
+    def test_a_batch_costs_a_constant_number_of_statements(self):
+        statements = []
+        listen(self.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        john, jane = self.user_ids
+
+        create_purchased_coupons([self.coupon(john), self.coupon(jane)], casino_id=1)
+        small = len(statements)
+        del statements[:]
+        create_purchased_coupons([self.coupon(user_id) for user_id in self.user_ids * 10], casino_id=1)
+
+        self.assertEqual(len(statements), small)
+        counts = self.session.query(UserProfile.purchases_at_last_update).order_by(UserProfile.user_id)
+        self.assertEqual([count for count, in counts], [11, 11])
+
+    def test_create_purchased_coupons_exception_handling(self):
         with patch("builtins.print") as mock_print:
-            create_purchased_coupons(coupon_data_list, casino_id=12345)
-    
-            printed_calls = [call.args[0] for call in mock_print.call_args_list]
-            self.assertTrue(
-                any("User profile not found for user_id 789" in msg for msg in printed_calls),
-                f"Expected error message not found in: {printed_calls}"
-            )
+            coupons = create_purchased_coupons([self.coupon(789), {'user_id': self.user_ids[0]}], casino_id=12345)
+        printed_calls = [call.args[0] for call in mock_print.call_args_list]
 
-        mock_session.commit.assert_not_called()
-        mock_session.rollback.assert_not_called()
-        mock_session.close.assert_called_once()
+        self.assertTrue(any("User profile not found for user_id 789" in msg for msg in printed_calls),
+                        f"Expected error message not found in: {printed_calls}")
+        self.assertTrue(any("Validation error for coupon" in msg and "stake" in msg for msg in printed_calls))
+        self.assertEqual(coupons, [])
+        self.assertEqual(self.session.query(PurchasedCoupon).count(), 0)
 
 class TestRegisterRecommendation(unittest.TestCase):
 
@@ -672,7 +465,7 @@ class TestGetAllSportLeagueTuples(unittest.TestCase):
     def test_get_all_sport_league_tuples_returns_expected_list(self, mock_get_session):
         mock_session = MagicMock()
         mock_query = MagicMock()
-        mock_query.distinct.return_value.all.return_value = [
+        mock_query.filter.return_value.distinct.return_value.all.return_value = [
             ('football', 'premier league'),
             ('basketball', 'nba')
         ]
@@ -689,6 +482,9 @@ class TestGetAllSportLeagueTuples(unittest.TestCase):
  
 class TestDynamicRecommendation(unittest.TestCase):
     
+    def setUp(self):
+        event_catalogs.clear()
+    
     @patch("app.services.get_casino_db_session")
     @patch("app.services.random.uniform", return_value=25.5)
     @patch("app.services.datetime")
@@ -702,22 +498,37 @@ class TestDynamicRecommendation(unittest.TestCase):
         
         mock_user = MagicMock()
         mock_user.favorite_sport = "FOOTBALL"
-        mock_session.query().get.return_value = mock_user
+        mock_session.get.return_value = mock_user
         
         
-        mock_event1 = MagicMock(country="FRANCE", 
+        mock_event1 = MagicMock(id=1,
+                                country="FRANCE", 
                                 league="LA LIGA", 
                                 home_team="TEAM49384", 
                                 away_team="TEAM07890", 
                                 sport="FOOTBALL", 
-                                odd=2.0)
-        mock_event2 = MagicMock(country="GERMANY", 
+                                odd=2.0,
+                                begin_timestamp=None,
+                                end_timestamp=None)
+        mock_event2 = MagicMock(id=2,
+                                country="GERMANY", 
                                 league="BUNDESLIGA", 
                                 home_team="Team394809", 
                                 away_team="Team987656", 
                                 sport="FOOTBALL", 
-                                odd=2.5)
-        mock_session.query().filter_by().limit().all.return_value = [mock_event1, mock_event2]
+                                odd=2.5,
+                                begin_timestamp=None,
+                                end_timestamp=None)
+        mock_event3 = MagicMock(id=3,
+                                country="USA", 
+                                league="NBA", 
+                                home_team="TEAM11111", 
+                                away_team="TEAM22222", 
+                                sport="BASKETBALL", 
+                                odd=1.8,
+                                begin_timestamp=None,
+                                end_timestamp=None)
+        mock_session.query().filter().all.return_value = [mock_event3, mock_event1, mock_event2]
         
         result = dynamic_recommendation(user_id = 123, casino_id = 123, event_limit=2)
         
@@ -748,16 +559,30 @@ class TestDynamicRecommendation(unittest.TestCase):
     def test_dynamic_recommendation_user_not_found(self, mock_get_session):
         mock_session = MagicMock()
         mock_get_session.return_value = mock_session
-        mock_session.query().get.return_value = None
+        mock_session.get.return_value = None
 
         with self.assertRaises(ValueError) as context:
             dynamic_recommendation(user_id=123, casino_id=234)
 
         self.assertIn("User 123 not found", str(context.exception))
         mock_session.close.assert_called_once()
+
+    @patch("app.services.get_casino_db_session")
+    def test_dynamic_recommendation_borrows_the_request_session(self, mock_get_session):
+        mock_session = MagicMock()
+        mock_session.get.return_value = None
+
+        with self.assertRaises(ValueError):
+            dynamic_recommendation(user_id=123, casino_id=234, session=mock_session)
+
+        mock_get_session.assert_not_called()
+        mock_session.close.assert_not_called()
         
 class TestInferenceScoreRecommendation(unittest.TestCase):
 
+    def setUp(self):
+        event_catalogs.clear()
+
     @patch("app.services.random.uniform", return_value=25.5)
     @patch("app.services.datetime")
     @patch("app.services.get_casino_db_session")
@@ -773,8 +598,8 @@ class TestInferenceScoreRecommendation(unittest.TestCase):
         mock_user.country = "FRANCE"
         mock_user.favorite_sport = "FOOTBALL"
 
-        mock_coupon = MagicMock()
-        mock_coupon.recommended_events = [
+        affinity = new_user_affinity(123)
+        apply_coupon(affinity, [
             {
                 "country": "FRANCE",
                 "league": "LA LIGA",
@@ -791,31 +616,24 @@ class TestInferenceScoreRecommendation(unittest.TestCase):
                 "sport": "FOOTBALL",
                 "odd": 2.5
             }
-        ]
+        ])
+        mock_session.get.side_effect = lambda model, key: mock_user if model.__name__ == "User" else affinity
 
         mock_event = MagicMock()
         mock_event.id = 1
         mock_event.country = "FRANCE"
-        mock_event.begin_timestamp = "2025-01-10T12:00:00"
-        mock_event.end_timestamp = "2025-01-10T14:00:00"
+        mock_event.begin_timestamp = datetime(2025, 1, 10, 12, 0, 0)
+        mock_event.end_timestamp = datetime(2025, 1, 10, 14, 0, 0)
         mock_event.league = "LA LIGA"
         mock_event.sport = "FOOTBALL"
         mock_event.odd = 2.0
         mock_event.home_team = "TEAM49384"
         mock_event.away_team = "TEAM07890"
 
-        def query_side_effect(model):
-            if model.__name__ == "User":
+        def query_side_effect(model, *columns):
+            if columns:
                 mock_query = MagicMock()
-                mock_query.filter_by.return_value.first.return_value = mock_user
-                return mock_query
-            elif model.__name__ == "PurchasedCoupon":
-                mock_query = MagicMock()
-                mock_query.filter_by.return_value.options.return_value.all.return_value = [mock_coupon]
-                return mock_query
-            elif model.__name__ == "Event":
-                mock_query = MagicMock()
-                mock_query.all.return_value = [mock_event]
+                mock_query.filter.return_value.all.return_value = [mock_event]
                 return mock_query
             return MagicMock()
 
@@ -838,10 +656,53 @@ class TestInferenceScoreRecommendation(unittest.TestCase):
 
         mock_session.close.assert_called_once()  
 
+    @patch("app.services.Config.INFERENCE_SCORE_MODE", "stream")
+    @patch("app.services.get_event_catalog")
+    @patch("app.services.get_casino_db_session")
+    def test_inference_score_recommendation_stream_mode(self, mock_get_session, mock_get_catalog):
+        mock_session = MagicMock()
+        mock_get_session.return_value = mock_session
+
+        mock_user = MagicMock()
+        mock_user.country = "SPAIN"
+        mock_user.favorite_sport = "FOOTBALL"
+        mock_session.get.side_effect = lambda model, key: mock_user if model.__name__ == "User" else None
+
+        rows = [
+            MagicMock(country="USA", league="NBA", sport="BASKETBALL", odd=1.8, home_team="T1", away_team="T2"),
+            MagicMock(country="SPAIN", league="LA LIGA", sport="FOOTBALL", odd=2.2, home_team="T3", away_team="T4"),
+        ]
+
+        def query_side_effect(model, *columns):
+            mock_query = MagicMock()
+            if columns:
+                mock_query.filter.return_value.order_by.return_value.execution_options.return_value = iter(rows)
+            return mock_query
+
+        mock_session.query.side_effect = query_side_effect
+
+        result = inference_score_recommendation(user_id=123, casino_id=456, event_limit=1)
+
+        self.assertEqual(result["recommended_events"], [{
+            "country": "SPAIN",
+            "league": "LA LIGA",
+            "home_team": "T3",
+            "away_team": "T4",
+            "sport": "FOOTBALL",
+            "odd": 2.2
+        }])
+        mock_get_catalog.assert_not_called()
+        mock_session.close.assert_called_once()
+
 class TestRecommendationGenerator(unittest.TestCase):
 
+    def setUp(self):
+        recommendation_cache.clear()
+
+    @patch("app.services.purchase_version", return_value=0)
+    @patch("app.services.get_precomputed_recommendation", return_value=None)
     @patch("app.services.recommender_registry", new_callable=dict)
-    def test_recommendation_generator_valid_config(self, mock_registry):
+    def test_recommendation_generator_valid_config(self, mock_registry, mock_get_precomputed, mock_purchase_version):
 
         mock_func = MagicMock(return_value={"sport": "FOOTBALL"})
         mock_registry["mock_recommender"] = mock_func
@@ -857,7 +718,203 @@ class TestRecommendationGenerator(unittest.TestCase):
      
         self.assertIn("sport", recommendation)
         self.assertEqual(recommendation["sport"], "FOOTBALL")
-        mock_func.assert_called_once_with(user_id=42, casino_id=1)
+        mock_func.assert_called_once_with(user_id=42, casino_id=1, session=None)
+
+    @patch("app.services.purchase_version", return_value=0)
+    @patch("app.services.get_precomputed_recommendation", return_value=None)
+    @patch("app.services.recommender_registry", new_callable=dict)
+    def test_recommendation_generator_passes_the_request_session(self, mock_registry, mock_get_precomputed, mock_purchase_version):
+        mock_func = MagicMock(return_value={"sport": "FOOTBALL"})
+        mock_registry["mock_recommender"] = mock_func
+        config = {"recommender_type": "mock_recommender", "recommendation_schema": {"sport": "string"}}
+        mock_session = MagicMock()
+
+        recommendation_generator(config=config, casino_id=1, user_id=45, session=mock_session)
+
+        mock_get_precomputed.assert_called_once_with(1, 45, "mock_recommender", session=mock_session, version=0)
+        mock_func.assert_called_once_with(user_id=45, casino_id=1, session=mock_session)
+
+    @patch("app.services.purchase_version", return_value=0)
+    @patch("app.services.get_precomputed_recommendation", return_value=None)
+    @patch("app.services.recommender_registry", new_callable=dict)
+    def test_recommendation_generator_serves_cached_output(self, mock_registry, mock_get_precomputed, mock_purchase_version):
+        mock_func = MagicMock(return_value={"sport": "FOOTBALL"})
+        mock_registry["mock_recommender"] = mock_func
+        config = {"recommender_type": "mock_recommender", "recommendation_schema": {"sport": "string"}}
+
+        recommendation_generator(config=config, casino_id=1, user_id=43)
+        recommendation_generator(config=config, casino_id=1, user_id=43)
+        self.assertEqual(mock_func.call_count, 1)
+
+        recommendation_cache.invalidate(1, [43])
+        recommendation_generator(config=config, casino_id=1, user_id=43)
+        self.assertEqual(mock_func.call_count, 2)
+
+        #a purchase stored by another process only shows up as a new version
+        mock_purchase_version.return_value = 1
+        recommendation_generator(config=config, casino_id=1, user_id=43)
+        recommendation_generator(config=config, casino_id=1, user_id=43)
+        self.assertEqual(mock_func.call_count, 3)
+
+    @patch("app.services.purchase_version", return_value=0)
+    @patch("app.services.get_precomputed_recommendation", return_value={"sport": "HANDBALL"})
+    @patch("app.services.recommender_registry", new_callable=dict)
+    def test_recommendation_generator_serves_precomputed_output(self, mock_registry, mock_get_precomputed, mock_purchase_version):
+        mock_func = MagicMock(return_value={"sport": "FOOTBALL"})
+        mock_registry["mock_recommender"] = mock_func
+        config = {"recommender_type": "mock_recommender", "recommendation_schema": {"sport": "string"}}
+
+        recommendation = recommendation_generator(config=config, casino_id=1, user_id=44)
+
+        self.assertEqual(recommendation["sport"], "HANDBALL")
+        mock_func.assert_not_called()
+        mock_get_precomputed.assert_called_once_with(1, 44, "mock_recommender", session=None, version=0)
+
+class TestGetPrecomputedRecommendation(unittest.TestCase):
+
+    @patch("app.services.latest_precompute_run", return_value=datetime.utcnow())
+    @patch("app.services.get_casino_db_session")
+    def test_returns_fresh_row_of_the_same_recommender(self, mock_get_session, mock_latest_run):
+        mock_session = MagicMock()
+        mock_session.get.return_value = MagicMock(recommender_type="inference",
+                                                  recommendation={"user_id": 1},
+                                                  generated_at=datetime.utcnow())
+        mock_get_session.return_value = mock_session
+
+        self.assertEqual(get_precomputed_recommendation(1, 1, "inference"), {"user_id": 1})
+        self.assertIsNone(get_precomputed_recommendation(1, 1, "dynamic"))
+        mock_session.close.assert_called()
+
+    @patch("app.services.latest_precompute_run", return_value=datetime.utcnow())
+    @patch("app.services.get_casino_db_session")
+    def test_ignores_stale_rows(self, mock_get_session, mock_latest_run):
+        mock_session = MagicMock()
+        mock_session.get.return_value = MagicMock(recommender_type="inference",
+                                                  recommendation={"user_id": 1},
+                                                  generated_at=datetime(2020, 1, 1))
+        mock_get_session.return_value = mock_session
+
+        self.assertIsNone(get_precomputed_recommendation(1, 1, "inference"))
+
+    @patch("app.services.latest_precompute_run", return_value=datetime.utcnow())
+    def test_ignores_rows_computed_before_a_later_purchase(self, mock_latest_run):
+        mock_session = MagicMock()
+        mock_session.get.return_value = MagicMock(recommender_type="inference", recommendation={"user_id": 1},
+                                                  generated_at=datetime.utcnow(), coupons_count=3)
+
+        self.assertEqual(get_precomputed_recommendation(1, 1, "inference", session=mock_session, version=3),
+                         {"user_id": 1})
+        self.assertIsNone(get_precomputed_recommendation(1, 1, "inference", session=mock_session, version=4))
+
+    @patch("app.services.latest_precompute_run", return_value=None)
+    def test_skips_the_lookup_without_a_precompute_run(self, mock_latest_run):
+        mock_session = MagicMock()
+
+        self.assertIsNone(get_precomputed_recommendation(1, 1, "inference", session=mock_session))
+        mock_session.get.assert_not_called()
+
+    @patch("app.services.latest_precompute_run", return_value=datetime.utcnow())
+    def test_failed_lookup_leaves_the_request_session_alone(self, mock_latest_run):
+        mock_session = MagicMock()
+        mock_session.get.side_effect = SQLAlchemyError("no such table")
+
+        self.assertIsNone(get_precomputed_recommendation(1, 1, "inference", session=mock_session))
+        mock_session.begin_nested.assert_called_once()
+        mock_session.rollback.assert_not_called()
+
+class TestLatestPrecomputeRun(unittest.TestCase):
+
+    def setUp(self):
+        precompute_runs.clear()
+
+    @patch("app.services.get_casino_db_session")
+    def test_checked_once_per_interval(self, mock_get_session):
+        generated_at = datetime(2025, 1, 1)
+        mock_get_session.return_value.scalar.return_value = generated_at
+
+        self.assertEqual(latest_precompute_run(1), generated_at)
+        self.assertEqual(latest_precompute_run(1), generated_at)
+        mock_get_session.return_value.scalar.assert_called_once()
+        mock_get_session.return_value.close.assert_called_once()
+
+    @patch("app.services.get_casino_db_session")
+    def test_missing_table_means_no_run(self, mock_get_session):
+        mock_get_session.return_value.scalar.side_effect = SQLAlchemyError("no such table")
+
+        self.assertIsNone(latest_precompute_run(1))
+
+class TestCollaborativeRecommendation(unittest.TestCase):
+
+    @patch("app.services.inference_score_recommendation")
+    @patch("app.services.load_collaborative_model")
+    def test_falls_back_without_model(self, mock_load_model, mock_inference_score):
+        mock_load_model.return_value = None
+        mock_inference_score.return_value = {"user_id": 1}
+
+        self.assertEqual(collaborative_recommendation(user_id=1, casino_id=1, event_limit=2), {"user_id": 1})
+        mock_inference_score.assert_called_once_with(1, 1, event_limit=2, session=None)
+
+    @patch("app.services.get_event_catalog")
+    @patch("app.services.get_casino_db_session")
+    @patch("app.services.load_collaborative_model")
+    def test_returns_highest_scored_events(self, mock_load_model, mock_get_session, mock_get_catalog):
+        mock_model = MagicMock()
+        mock_model.user_row.return_value = 0
+        mock_model.score_events.return_value = np.array([0.1, 0.9, 0.5], dtype=np.float32)
+        mock_load_model.return_value = mock_model
+        mock_catalog = MagicMock()
+        mock_catalog.event_data.side_effect = lambda position: {"position": position}
+        mock_catalog.top_positions.side_effect = top_k_indices
+        mock_get_catalog.return_value = mock_catalog
+
+        result = collaborative_recommendation(user_id=1, casino_id=1, event_limit=2)
+
+        self.assertEqual(result["recommended_events"], [{"position": 1}, {"position": 2}])
+        mock_get_session.return_value.close.assert_called_once()
+
+class TestCooccurrenceRecommendation(unittest.TestCase):
+
+    @patch("app.services.inference_score_recommendation")
+    @patch("app.services.get_cooccurrence_matrix")
+    @patch("app.services.get_event_catalog")
+    @patch("app.services.recent_picks")
+    @patch("app.services.get_casino_db_session")
+    def test_falls_back_without_recent_picks(self, mock_get_session, mock_recent_picks, mock_get_catalog,
+                                             mock_get_matrix, mock_inference_score):
+        mock_recent_picks.return_value = []
+        mock_inference_score.return_value = {"user_id": 1}
+
+        self.assertEqual(cooccurrence_recommendation(user_id=1, casino_id=1), {"user_id": 1})
+        mock_get_matrix.return_value.score_events.assert_not_called()
+        mock_get_session.return_value.close.assert_called_once()
+
+    @patch("app.services.get_cooccurrence_matrix")
+    @patch("app.services.get_event_catalog")
+    @patch("app.services.recent_picks")
+    @patch("app.services.get_casino_db_session")
+    def test_returns_highest_scored_events(self, mock_get_session, mock_recent_picks, mock_get_catalog,
+                                           mock_get_matrix):
+        mock_recent_picks.return_value = [{"league": "LA LIGA"}]
+        mock_get_matrix.return_value.score_events.return_value = np.array([3.0, 0.0, 5.0], dtype=np.float32)
+        mock_get_catalog.return_value.event_data.side_effect = lambda position: {"position": position}
+        mock_get_catalog.return_value.top_positions.side_effect = top_k_indices
+
+        result = cooccurrence_recommendation(user_id=1, casino_id=1, event_limit=2)
+
+        self.assertEqual(result["recommended_events"], [{"position": 2}, {"position": 0}])
+
+class TestColdStartPairs(unittest.TestCase):
+
+    @patch("app.services.get_trending_scores")
+    def test_trending_pairs_come_first_and_random_pairs_fill(self, mock_get_trending):
+        mock_get_trending.return_value.top_pairs.return_value = [(("FOOTBALL", "LA LIGA"), 2.0),
+                                                                 (("BASKETBALL", "NBA"), 1.0)]
+        mock_catalog = MagicMock()
+        mock_catalog.sport_league_pairs.return_value = [("FOOTBALL", "LA LIGA"), ("HANDBALL", "SEHA LEAGUE")]
+
+        pairs = cold_start_pairs(1, MagicMock(), mock_catalog, 3, exclude=[("BASKETBALL", "NBA")])
+
+        self.assertEqual(pairs, [("FOOTBALL", "LA LIGA"), ("HANDBALL", "SEHA LEAGUE")])
         
 class TestPopulateDB(unittest.TestCase):
 
@@ -912,7 +969,8 @@ class TestPopulateDB(unittest.TestCase):
         self.assertEqual(mock_create_users.call_count, 2)
         self.assertEqual(mock_create_teams.call_count, 2)
         self.assertEqual(mock_create_events.call_count, 2)
-        self.assertEqual(mock_create_db.call_count, 2)
+        #create_casinos already provisioned the casino databases
+        mock_create_db.assert_not_called()
          
 if __name__ == '__main__':
     unittest.main()
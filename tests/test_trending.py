@@ -0,0 +1,155 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from app.catalog import EventCatalog, CatalogRow
+from datetime import datetime, timezone
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.trending import DecayedCounter, TrendingScores, get_trending_scores, trending_positions, \
+trending_scores, rebuild_trending_scores, rebuild_locks, coupon_time, catch_up_trending_scores
+from app.coupon_events import record_coupon_events
+from app.db_models_shared import SharedBase, PurchasedCoupon
+
+
+HOUR = 3600
+
+
+def leg(sport, league, home_team="TEAM1", away_team="TEAM2"):
+    return {"sport": sport, "league": league, "home_team": home_team, "away_team": away_team}
+
+
+class TestDecayedCounter(unittest.TestCase):
+
+    def test_scores_halve_every_half_life(self):
+        counter = DecayedCounter(HOUR, top_n=5, landmark=0)
+        counter.add("A", 0)
+
+        self.assertAlmostEqual(counter.most_common(at=HOUR)[0][1], 0.5)
+        self.assertAlmostEqual(counter.most_common(at=2 * HOUR)[0][1], 0.25)
+
+    def test_recent_picks_outrank_older_ones(self):
+        counter = DecayedCounter(HOUR, top_n=5, landmark=0)
+        counter.add("OLD", 0)
+        counter.add("OLD", 0)
+        counter.add("NEW", 2 * HOUR)
+
+        self.assertEqual([key for key, _ in counter.most_common(at=2 * HOUR)], ["NEW", "OLD"])
+
+    def test_top_list_is_bounded_and_exact(self):
+        counter = DecayedCounter(HOUR, top_n=2, landmark=0)
+        for key, times in (("A", 3), ("B", 2), ("C", 1)):
+            for _ in range(times):
+                counter.add(key, 0)
+        self.assertEqual([key for key, _ in counter.most_common()], ["A", "B"])
+
+        for _ in range(3):
+            counter.add("C", 0)
+        self.assertEqual([key for key, _ in counter.most_common()], ["C", "A"])
+
+    def test_rebase_keeps_scores_and_prunes_faded_keys(self):
+        counter = DecayedCounter(HOUR, top_n=5, landmark=0)
+        counter.add("FADED", 0)
+        counter.add("A", 43 * HOUR)
+        counter.add("A", 48 * HOUR)
+
+        self.assertEqual(counter.landmark, 48 * HOUR)
+        self.assertNotIn("FADED", counter.weights)
+        self.assertAlmostEqual(counter.most_common(at=48 * HOUR)[0][1], 1 + 2 ** -5)
+
+
+class TestTrendingScores(unittest.TestCase):
+
+    def setUp(self):
+        trending_scores.clear()
+
+    def test_add_coupon_counts_events_and_pairs(self):
+        trending = TrendingScores(1, half_life_seconds=HOUR, top_n=5)
+        trending.add_coupon([leg("FOOTBALL", "LA LIGA"), leg("FOOTBALL", "LA LIGA", "TEAM3", "TEAM4")],
+                            "2025-04-25T12:49:15")
+
+        self.assertEqual(trending.top_pairs()[0][0], ("FOOTBALL", "LA LIGA"))
+        self.assertEqual(len(trending.top_events()), 2)
+
+    def test_coupons_written_elsewhere_are_caught_up_once(self):
+        engine = create_engine("sqlite://", poolclass=StaticPool)
+        SharedBase.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+        session = Session()
+        self.addCleanup(session.close)
+
+        def add_coupon(coupon_id, legs):
+            #stands in for the Kafka consumer writing a coupon from another process
+            coupon = PurchasedCoupon(id=coupon_id, user_id=7, stake=5.0, timestamp=datetime.utcnow(),
+                                     recommended_events=legs)
+            session.add(coupon)
+            record_coupon_events(session, [coupon])
+            session.commit()
+
+        add_coupon(1, [leg("FOOTBALL", "LA LIGA")])
+        with patch("app.trending.get_casino_db_session", side_effect=lambda casino_id: Session()):
+            rebuild_trending_scores(1)
+            trending = trending_scores[1]
+            add_coupon(2, [leg("BASKETBALL", "NBA")])
+            add_coupon(3, [leg("BASKETBALL", "NBA", "TEAM3", "TEAM4")])
+            catch_up_trending_scores(1)
+            catch_up_trending_scores(1)
+
+        self.assertEqual(trending.top_pairs()[0][0], ("BASKETBALL", "NBA"))
+        self.assertAlmostEqual(trending.top_pairs()[0][1], 2, places=2)
+        self.assertEqual(trending.last_leg_id, 3)
+
+    @patch("app.trending.threading.Thread")
+    @patch("app.trending.Config.TRENDING_CATCHUP_SECONDS", 0)
+    def test_loaded_scores_are_caught_up_in_the_background(self, MockThread):
+        trending_scores[1] = trending = TrendingScores(1)
+
+        self.assertIs(get_trending_scores(1, MagicMock()), trending)
+        MockThread.assert_called_once_with(target=catch_up_trending_scores, args=(1,), daemon=True)
+
+    @patch("app.trending.threading.Thread")
+    def test_scores_are_built_off_the_request_path(self, MockThread):
+        request_session = MagicMock()
+
+        trending = get_trending_scores(1, request_session)
+
+        self.assertEqual(trending.top_pairs(), [])
+        request_session.query.assert_not_called()
+        MockThread.assert_called_once_with(target=rebuild_trending_scores, args=(1,), daemon=True)
+
+    @patch("app.trending.threading.Thread")
+    @patch("app.trending.Config.TRENDING_REBUILD_SECONDS", 0)
+    def test_stale_scores_are_served_while_rebuilt(self, MockThread):
+        trending_scores[1] = stale = TrendingScores(1)
+
+        self.assertIs(get_trending_scores(1, MagicMock()), stale)
+        MockThread.return_value.start.assert_called_once()
+
+        #a rebuild already running for the casino is not started twice
+        with rebuild_locks(1):
+            rebuild_trending_scores(1)
+            get_trending_scores(1, MagicMock())
+        self.assertIs(trending_scores[1], stale)
+        MockThread.return_value.start.assert_called_once()
+
+    def test_naive_timestamps_are_utc(self):
+        expected = datetime(2025, 4, 25, 12, tzinfo=timezone.utc).timestamp()
+
+        self.assertEqual(coupon_time(datetime(2025, 4, 25, 12)), expected)
+        self.assertEqual(coupon_time("2025-04-25T12:00:00"), expected)
+        self.assertEqual(coupon_time("2025-04-25T14:00:00+02:00"), expected)
+
+    def test_trending_positions_prefer_fixtures_then_pairs(self):
+        catalog = EventCatalog(1, [
+            CatalogRow(10, "USA", "NBA", "BASKETBALL", 1.5, "LAKERS", "CELTICS"),
+            CatalogRow(11, "SPAIN", "LA LIGA", "FOOTBALL", 2.0, "TEAM1", "TEAM2"),
+            CatalogRow(12, "SPAIN", "LA LIGA", "FOOTBALL", 2.0, "TEAM3", "TEAM4"),
+        ])
+        trending = TrendingScores(1, half_life_seconds=HOUR, top_n=5)
+        trending.add_coupon([leg("FOOTBALL", "LA LIGA", "TEAM3", "TEAM4")], "2025-04-25T12:49:15")
+
+        self.assertEqual(trending_positions(catalog, trending, 2), [2, 1])
+        self.assertEqual(sorted(trending_positions(catalog, trending, 3)), [0, 1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
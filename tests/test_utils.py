@@ -1,9 +1,14 @@
 import unittest
+import threading
 from unittest.mock import patch, MagicMock
-from app.utils import generate_unique_id, get_random_casino_id, get_random_user_id, create_db_per_casino, \
-db_engine_cache, get_casino_db_session, generate_dummy_users, generate_dummy_casinos, generate_dummy_events, \
-generate_dummy_teams, generate_dummy_purchased_coupons, generate_dummy_purchased_coupons_with_dummy_events
+from app.utils import IdAllocator, get_random_casino_id, get_random_user_id, create_db_per_casino, \
+db_engine_cache, get_casino_db_session, ensure_template_database, TenantEngineManager, SchemaTenantRouter, generate_dummy_users, generate_dummy_casinos, generate_dummy_events, \
+generate_dummy_teams, generate_dummy_purchased_coupons, generate_dummy_purchased_coupons_with_dummy_events, \
+ConnectionBudgetExceeded
 from app.config import Config
+from app.db_models_shared import SharedBase, Team
+from sqlalchemy import create_engine as real_create_engine, text
+from sqlalchemy.pool import StaticPool
 import psycopg2
 from datetime import datetime
 
@@ -11,20 +16,51 @@ from datetime import datetime
 class TestUtils(unittest.TestCase):
 '''    
 class TestGenerateUniqueUserId(unittest.TestCase):
-    @patch('app.utils.randint')
-    def test_generate_unique_id(self, mock_randint):
+
+    def make_session(self, starts):
         session = MagicMock()
-        Model = MagicMock()
-        
-        mock_randint.side_effect = [123, 456]
-        
-        session.query().filter_by().first.side_effect = [True, None]
-        
-        result = generate_unique_id(session, Model)
-        
-        self.assertEqual(result, 456)
-        self.assertEqual(mock_randint.call_count, 2)
-        session.query.assert_called_with(Model.id)
+        bind = session.get_bind.return_value
+        bind.get_execution_options.return_value = {}
+        bind.url = "postgresql://casino_1"
+        bind.connect.return_value.__enter__.return_value.execute.return_value.scalar.return_value = 100
+        session.execute.return_value.scalar.side_effect = starts
+        return session
+
+    def test_generate_unique_id(self):
+        allocator = IdAllocator(100)
+        session = self.make_session([1_000_001, 1_000_101])
+        Model = MagicMock(__tablename__="users")
+
+        ids = [allocator.next_ids(session, Model, 1)[0] for _ in range(101)]
+
+        self.assertEqual(ids, list(range(1_000_001, 1_000_102)))
+        self.assertEqual(session.execute.call_count, 2)
+        self.assertIn("nextval('users_id_blocks')", str(session.execute.call_args[0][0]))
+        #the sequence is created once, outside the caller's transaction
+        session.get_bind.return_value.connect.assert_called_once()
+
+    def test_blocks_are_kept_per_table(self):
+        allocator = IdAllocator(100)
+        session = self.make_session([1_000_001, 1_000_101, 1_000_001])
+
+        users = allocator.next_ids(session, MagicMock(__tablename__="users"), 150)
+        teams = allocator.next_ids(session, MagicMock(__tablename__="teams"), 1)
+
+        self.assertEqual(len(set(users)), 150)
+        self.assertEqual(teams, [1_000_001])
+        self.assertEqual(session.execute.call_count, 3)
+
+    def test_a_reservation_only_blocks_its_own_table(self):
+        allocator = IdAllocator(100)
+        session = self.make_session([1_000_001, 1_000_001])
+        users = MagicMock(__tablename__="users")
+        allocator.next_ids(session, users, 1)
+
+        #another thread holds the users lock, e.g. waiting on nextval
+        with allocator.locks(("postgresql://casino_1", "users_id_blocks")):
+            teams = allocator.next_ids(session, MagicMock(__tablename__="teams"), 1)
+
+        self.assertEqual(teams, [1_000_001])
     
 class TestGetRandomCasinoId(unittest.TestCase):
     def setUp(self):
@@ -66,10 +102,10 @@ class TestGetRandomUserId:
         
 class TestCreateDbPerCasino(unittest.TestCase):
 
-    @patch('app.utils.SharedBase.metadata.create_all')
+    @patch('app.utils.ensure_template_database', return_value="casino_template")
     @patch('app.utils.create_engine')
     @patch('app.utils.psycopg2.connect')
-    def test_create_db_successfully(self, mock_connect, mock_create_engine, mock_create_all):
+    def test_create_db_successfully(self, mock_connect, mock_create_engine, mock_ensure_template):
         mock_conn = MagicMock()
         mock_cursor = MagicMock()
         mock_connect.return_value = mock_conn
@@ -79,16 +115,16 @@ class TestCreateDbPerCasino(unittest.TestCase):
 
         self.assertEqual(db_name, "casino_123")
         mock_connect.assert_called_once()
-        mock_cursor.execute.assert_called_with("CREATE DATABASE casino_123")
+        mock_cursor.execute.assert_called_with("CREATE DATABASE casino_123 TEMPLATE casino_template")
         mock_cursor.close.assert_called_once()
         mock_conn.close.assert_called_once()
-        mock_create_engine.assert_called_once()
-        mock_create_all.assert_called_once()
+        #the tables come with the template
+        mock_create_engine.assert_not_called()
 
-    @patch('app.utils.SharedBase.metadata.create_all')
+    @patch('app.utils.ensure_template_database', return_value="casino_template")
     @patch('app.utils.create_engine')
     @patch('app.utils.psycopg2.connect')
-    def test_create_db_already_exists(self, mock_connect, mock_create_engine, mock_create_all):
+    def test_create_db_already_exists(self, mock_connect, mock_create_engine, mock_ensure_template):
         mock_conn = MagicMock()
         mock_cursor = MagicMock()
         mock_cursor.execute.side_effect = psycopg2.errors.DuplicateDatabase
@@ -98,11 +134,24 @@ class TestCreateDbPerCasino(unittest.TestCase):
         db_name = create_db_per_casino(456)
 
         self.assertEqual(db_name, "casino_456")
-        mock_cursor.execute.assert_called_once_with("CREATE DATABASE casino_456")
+        mock_cursor.execute.assert_called_once_with("CREATE DATABASE casino_456 TEMPLATE casino_template")
         mock_cursor.close.assert_called_once()
         mock_conn.close.assert_called_once()
-        mock_create_engine.assert_called_once()
-        mock_create_all.assert_called_once()
+        mock_create_engine.assert_not_called()
+
+    @patch('app.utils.migrate_tenant_db')
+    @patch('app.utils.create_engine')
+    @patch('app.utils.psycopg2.connect')
+    def test_template_is_built_once(self, mock_connect, mock_create_engine, mock_migrate):
+        mock_cursor = mock_connect.return_value.cursor.return_value
+
+        with patch('app.utils.template_ready', False):
+            self.assertEqual(ensure_template_database(), "casino_template")
+            self.assertEqual(ensure_template_database(), "casino_template")
+
+        mock_cursor.execute.assert_called_once_with("CREATE DATABASE casino_template")
+        mock_migrate.assert_called_once_with(mock_create_engine.return_value)
+        mock_create_engine.return_value.dispose.assert_called_once()
         
 class TestGetCasinoDbSession(unittest.TestCase):
     
@@ -148,6 +197,159 @@ class TestGetCasinoDbSession(unittest.TestCase):
         self.assertEqual(session, mock_session)
         
         
+class TestTenantEngineManager(unittest.TestCase):
+
+    def make_engine(self, checked_out=0):
+        engine = MagicMock(name='Engine')
+        engine.pool.checkedout.return_value = checked_out
+        engine.pool.checkedin.return_value = 0
+        return engine
+
+    @patch('app.utils.create_engine')
+    def test_pool_sizes_follow_overrides(self, mock_create_engine):
+        manager = TenantEngineManager(5, 5, 100, 300, overrides={"7": {"pool_size": 20, "max_overflow": 0}})
+
+        manager.engine(1)
+        manager.engine(7)
+
+        self.assertEqual(mock_create_engine.call_args_list[0][1], {"pool_size": 5, "max_overflow": 5})
+        self.assertEqual(mock_create_engine.call_args_list[1][1], {"pool_size": 20, "max_overflow": 0})
+        self.assertEqual(manager.reserved(), 30)
+
+    @patch('app.utils.create_engine')
+    def test_budget_evicts_least_recently_used_idle_engine(self, mock_create_engine):
+        engines = [self.make_engine(checked_out=1), self.make_engine(), self.make_engine()]
+        mock_create_engine.side_effect = engines
+        manager = TenantEngineManager(5, 5, 20, 300)
+
+        manager.engine(1)
+        manager.engine(2)
+        manager.engine(3)
+
+        self.assertEqual(list(manager.engines), [1, 3])
+        engines[1].dispose.assert_called_once()
+        engines[0].dispose.assert_not_called()
+        self.assertEqual(manager.evictions, 1)
+
+    @patch('app.utils.create_engine')
+    def test_busy_engines_are_never_evicted_and_the_budget_holds(self, mock_create_engine):
+        engines = [self.make_engine(checked_out=1), self.make_engine(checked_out=2), self.make_engine()]
+        mock_create_engine.side_effect = engines
+        manager = TenantEngineManager(5, 5, 20, 300, budget_wait_seconds=0.1)
+
+        manager.engine(1)
+        manager.engine(2)
+        with self.assertRaises(ConnectionBudgetExceeded):
+            manager.engine(3)
+
+        self.assertEqual(list(manager.engines), [1, 2])
+        self.assertEqual(mock_create_engine.call_count, 2)
+        engines[0].dispose.assert_not_called()
+        engines[1].dispose.assert_not_called()
+        self.assertEqual((manager.evictions, manager.budget_waits, manager.budget_refusals), (0, 1, 1))
+
+    @patch('app.utils.create_engine')
+    def test_a_waiting_engine_opens_once_a_busy_one_goes_idle(self, mock_create_engine):
+        engines = [self.make_engine(checked_out=1), self.make_engine(checked_out=2), self.make_engine()]
+        mock_create_engine.side_effect = engines
+        manager = TenantEngineManager(5, 5, 20, 300, budget_wait_seconds=5)
+        manager.engine(1)
+        manager.engine(2)
+
+        timer = threading.Timer(0.1, lambda: setattr(engines[0].pool.checkedout, "return_value", 0))
+        timer.start()
+        self.assertIs(manager.engine(3), engines[2])
+        timer.join()
+
+        self.assertEqual(list(manager.engines), [2, 3])
+        engines[0].dispose.assert_called_once()
+        self.assertEqual(manager.budget_refusals, 0)
+
+    @patch('app.utils.create_engine')
+    def test_a_pool_larger_than_the_budget_is_refused(self, mock_create_engine):
+        manager = TenantEngineManager(5, 5, 20, 300, overrides={"7": {"pool_size": 30, "max_overflow": 0}})
+
+        with self.assertRaises(ConnectionBudgetExceeded):
+            manager.engine(7)
+
+        mock_create_engine.assert_not_called()
+
+    @patch('app.utils.create_engine')
+    def test_string_casino_ids_share_the_engine_and_overrides(self, mock_create_engine):
+        manager = TenantEngineManager(5, 5, 100, 300, overrides={"7": {"pool_size": 20, "max_overflow": 0}})
+
+        engine = manager.engine("7")
+
+        self.assertIs(manager.engine(7), engine)
+        self.assertEqual(mock_create_engine.call_args[1], {"pool_size": 20, "max_overflow": 0})
+        manager.release("7")
+        self.assertEqual(list(manager.engines), [])
+
+    @patch('app.utils.sessionmaker')
+    @patch('app.utils.create_engine')
+    def test_sessionmaker_is_cached_per_engine(self, mock_create_engine, mock_session_maker):
+        manager = TenantEngineManager(5, 5, 100, 300)
+
+        manager.session(1)
+        manager.session(1)
+
+        mock_session_maker.assert_called_once_with(bind=mock_create_engine.return_value)
+
+    @patch('app.utils.time.time')
+    @patch('app.utils.create_engine')
+    def test_idle_engines_are_disposed(self, mock_create_engine, mock_time):
+        engines = [self.make_engine(), self.make_engine()]
+        mock_create_engine.side_effect = engines
+        manager = TenantEngineManager(5, 5, 100, 300)
+
+        mock_time.return_value = 1000.0
+        manager.engine(1)
+        mock_time.return_value = 1400.0
+        manager.engine(2)
+
+        self.assertEqual(list(manager.engines), [2])
+        engines[0].dispose.assert_called_once()
+        self.assertEqual(manager.stats()["tenants"][0]["casino_id"], 2)
+        self.assertEqual(manager.stats()["idle_disposals"], 1)
+
+    @patch('app.utils.create_engine')
+    def test_release_disposes_only_that_casino(self, mock_create_engine):
+        engines = [self.make_engine(), self.make_engine()]
+        mock_create_engine.side_effect = engines
+        manager = TenantEngineManager(5, 5, 100, 300)
+        manager.engine(1)
+        manager.engine(2)
+
+        manager.release(1)
+        manager.release(3)
+
+        self.assertEqual(list(manager.engines), [2])
+        engines[0].dispose.assert_called_once()
+        self.assertEqual(manager.reserved(), 10)
+
+class TestSchemaTenantRouter(unittest.TestCase):
+
+    @patch('app.utils.create_engine')
+    def test_casinos_share_one_pool_and_use_their_own_schema(self, mock_create_engine):
+        engine = real_create_engine("sqlite://", poolclass=StaticPool)
+        with engine.begin() as connection:
+            connection.execute(text("ATTACH DATABASE ':memory:' AS casino_1"))
+            connection.execute(text("ATTACH DATABASE ':memory:' AS casino_2"))
+        mock_create_engine.return_value = engine
+        router = SchemaTenantRouter(5, 5)
+
+        for casino_id in (1, 2):
+            SharedBase.metadata.create_all(router.engine(casino_id))
+        session = router.session(1)
+        session.add(Team(id=1, name="TEAM1", sport="FOOTBALL"))
+        session.commit()
+        session.close()
+
+        mock_create_engine.assert_called_once()
+        self.assertEqual(router.session(1).query(Team).count(), 1)
+        self.assertEqual(router.session(2).query(Team).count(), 0)
+        self.assertEqual(router.stats()["schemas"], 2)
+
 class TestGenerateDummyUsers(unittest.TestCase):
     def test_generate_dummy_users_default_count(self):
         users = generate_dummy_users()
@@ -0,0 +1,117 @@
+import random
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+from marshmallow import Schema, fields, post_load
+from app.schemas import UserResponseSchema, EventSchema, PurchasedCouponSchema, TeamSchema
+from app.utils import uppercase_dict
+from app.validators import compiled_validator, load_batch, CompiledValidator, SlowPath
+
+
+def user():
+    return {"id": 1, "birth_year": 1995, "currency": "usd", "country": "Spain", "gender": "other",
+            "timestamp": "2025-04-25T08:11:11.663775", "name": "John", "surname": "Doe", "favorite_sport": "football"}
+
+def event():
+    return {"id": 2, "sport": "football", "league": "La Liga", "country": "Spain", "odd": 2.5,
+            "home_team": "Team1", "away_team": "Team2",
+            "begin_timestamp": "2025-03-28T08:11:11", "end_timestamp": "2025-03-28T09:11:11"}
+
+def coupon():
+    leg = {"sport": "basketball", "league": "NBA", "country": "USA", "home_team": "Team1", "away_team": "Team2", "odd": 1.9}
+    return {"id": 3, "user_id": 1, "stake": 20.0, "timestamp": "2025-04-25T12:49:15.399950",
+            "recommended_events": [leg, dict(leg, sport="handball")]}
+
+#values a producer could plausibly send instead of the right one
+ODD_VALUES = [None, "", " 12", "12", "1_000", "1e3", "nan", "inf", "abc", 1.5, 0, -3, True, 10 ** 400, b"12",
+              [], {}, ["x"], "2025-03-28", "2025-03-28 08:11:11", "2025-03-28t08:11:11Z", "handball", "eur"]
+
+def mutations(record, rng, n=300):
+    yield record
+    for _ in range(n):
+        mutated = uppercase_dict(record) if rng.random() < 0.2 else {**record}
+        action = rng.random()
+        key = rng.choice(sorted(mutated))
+        if action < 0.15:
+            del mutated[key]
+        elif action < 0.25:
+            mutated["unexpected"] = 1
+        elif action < 0.4 and isinstance(mutated.get("recommended_events"), list):
+            legs = [dict(leg) for leg in mutated["recommended_events"]]
+            leg_key = rng.choice(sorted(legs[0]))
+            legs[0][leg_key] = rng.choice(ODD_VALUES)
+            mutated["recommended_events"] = legs
+        else:
+            mutated[key] = rng.choice(ODD_VALUES)
+        yield mutated
+
+
+class TestCompiledValidatorParity(unittest.TestCase):
+
+    def assert_parity(self, schema, record):
+        try:
+            expected = schema.load(uppercase_dict(record))
+        except Exception:
+            expected = None
+
+        try:
+            compiled = compiled_validator(schema).check(record)
+        except SlowPath:
+            compiled = None
+
+        #the fast path may defer to marshmallow, but whatever it accepts marshmallow accepts the same way
+        if compiled is not None:
+            self.assertEqual(compiled, expected, record)
+
+        rows, errors = load_batch(schema, [record])
+        self.assertEqual(rows[0][1] if rows else None, expected, record)
+        self.assertEqual(bool(errors), expected is None, record)
+
+    def test_ingestion_schemas_are_compiled(self):
+        for schema in (UserResponseSchema(), EventSchema(), PurchasedCouponSchema(), TeamSchema()):
+            self.assertIsInstance(compiled_validator(schema), CompiledValidator)
+
+    def test_same_decisions_as_marshmallow(self):
+        rng = random.Random(7)
+        cases = [(UserResponseSchema(), user()), (EventSchema(), event()), (PurchasedCouponSchema(), coupon()),
+                 (TeamSchema(), {"id": 4, "name": "Team1", "sport": "football"})]
+
+        for schema, record in cases:
+            for mutated in mutations(record, rng):
+                self.assert_parity(schema, mutated)
+
+    def test_valid_records_take_the_fast_path(self):
+        with patch.object(UserResponseSchema, "load") as load:
+            rows, errors = load_batch(UserResponseSchema(), [user(), dict(user(), favorite_sport=None)])
+
+        load.assert_called_once()
+        self.assertEqual(rows[0], (0, {**uppercase_dict(user()), "id": 1}))
+        self.assertEqual(rows[0][1]["currency"], "USD")
+
+    def test_rejected_records_get_marshmallow_messages(self):
+        rows, errors = load_batch(EventSchema(), [event(), dict(event(), sport="cricket", odd="x")])
+
+        self.assertEqual([position for position, _ in rows], [0])
+        self.assertEqual(rows[0][1]["begin_timestamp"], datetime(2025, 3, 28, 8, 11, 11))
+        position, exc = errors[0]
+        self.assertEqual(position, 1)
+        self.assertEqual(exc.messages, {"odd": ["Not a valid number."], "sport": ["Must be one of: HANDBALL, FOOTBALL, BASKETBALL."]})
+
+    def test_schemas_with_load_hooks_fall_back_to_marshmallow(self):
+        class HookedSchema(Schema):
+            name = fields.String(required=True)
+
+            @post_load
+            def strip(self, data, **kwargs):
+                return {"name": data["name"].strip()}
+
+        with patch("builtins.print"):
+            self.assertIsNone(compiled_validator(HookedSchema()))
+        rows, errors = load_batch(HookedSchema(), [{"name": " a "}, {"name": 1}])
+
+        self.assertEqual(rows, [(0, {"name": "A"})])
+        self.assertEqual(errors[0][0], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
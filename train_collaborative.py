@@ -0,0 +1,26 @@
+import sys
+from app import create_app, db
+from app.db_models_master import Casino
+from app.collaborative import train_collaborative_model
+from app.utils import get_casino_db_session
+
+
+app = create_app()
+
+if __name__ == "__main__":
+    with app.app_context():
+        casino_ids = [int(arg) for arg in sys.argv[1:]]
+        if not casino_ids:
+            casino_ids = [row[0] for row in db.session.query(Casino.id).all()]
+        
+        for casino_id in casino_ids:
+            session = get_casino_db_session(casino_id)
+            try:
+                summary = train_collaborative_model(casino_id, session)
+            finally:
+                session.close()
+                
+            if summary is None:
+                print(f"No coupons to train on for casino {casino_id}.")
+            else:
+                print(f"Trained collaborative model for casino {casino_id}: {summary['users']} users, {summary['items']} items.")